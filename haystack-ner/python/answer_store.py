@@ -0,0 +1,313 @@
+#!/bin/env python
+import argparse
+import json
+import os
+import sys
+import time
+import regex
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+# one row per answer, rank 0 marks a question the reader returned no answers for
+# (so the store records that the question of the text was processed)
+schema = pa.schema([('handle', pa.string()),
+                    ('text_name', pa.string()),
+                    ('question', pa.string()),
+                    ('rank', pa.int16()),
+                    ('answer', pa.string()),
+                    ('score', pa.float64()),
+                    ('probability', pa.float64()),
+                    ('context', pa.string()),
+                    ('lang', pa.string())])
+
+answer_columns = ['answer', 'score', 'probability', 'context', 'lang']
+
+
+def handle_from_text_name(text_name: str) -> str:
+    """The EconStor handle of a text or answer file: the name up to the first '_' after the prefix
+       (e.g. 10419-123456, 10419-123456_1 and 10419-123456_1_roberta.json -> 10419/123456)"""
+
+    end = text_name.find('_', len('10419-'))
+    return regex.sub('-|_', '/', text_name[:end] if end >= 0 else text_name)
+
+
+class AnswerStore:
+    """Columnar store of the answers extracted by extract_top_hits.py.
+
+    The answers are kept in parquet files partitioned by model (directory model=NAME),
+    every write appends a new part file. When the answers of a text are written again,
+    the rows of the newest part file containing the text replace the older rows.
+    compact rewrites a partition into a single part file without the replaced rows.
+    """
+
+    def __init__(self, directory: str, buffer_texts: int = 100):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.buffer_texts = buffer_texts
+        self.buffer = {}
+
+    def partition(self, model: str) -> str:
+        return os.path.join(self.directory, f"model={model}")
+
+    def models(self) -> list:
+        return sorted(entry[len('model='):] for entry in os.listdir(self.directory)
+                        if entry.startswith('model=') and os.path.isdir(os.path.join(self.directory, entry)))
+
+    def parts(self, model: str) -> list:
+        """The part files of a model, newest first (the names start with the write time)"""
+
+        partition = self.partition(model)
+        if not os.path.isdir(partition):
+            return []
+        return sorted((os.path.join(partition, entry) for entry in os.listdir(partition) if entry.endswith('.parquet')),
+                        reverse=True)
+
+    def write(self, model: str, results_by_text: dict) -> list:
+        """Append the answers of texts as a new part file of the model.
+
+        Args:
+            model (str): short name of the model (e.g. roberta)
+            results_by_text (dict): relevant answer data by question by text name (see extract_top_hits.py)
+
+        Returns:
+            list: the names of the texts written
+        """
+
+        rows = {name: [] for name in schema.names}
+        for text_name, results in results_by_text.items():
+            handle = handle_from_text_name(text_name)
+            for question, answers in results.items():
+                ranked = list(enumerate(answers, start=1)) if len(answers) > 0 else [(0, {})]
+                for rank, answer in ranked:
+                    rows['handle'].append(handle)
+                    rows['text_name'].append(text_name)
+                    rows['question'].append(question)
+                    rows['rank'].append(rank)
+                    for column in answer_columns:
+                        rows[column].append(answer.get(column))
+        if len(rows['text_name']) == 0:
+            return []
+
+        partition = self.partition(model)
+        os.makedirs(partition, exist_ok=True)
+        filename = os.path.join(partition, f"part-{time.time_ns():020d}-{os.getpid()}.parquet")
+        # a part file is complete or missing, never partially written
+        pq.write_table(pa.Table.from_pydict(rows, schema=schema), filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+        return list(results_by_text)
+
+    def add(self, model: str, text_name: str, results: dict) -> list:
+        """Buffer the answers of a text, the buffer of a model is written when it holds buffer_texts texts.
+           Returns the names of the texts written (empty while buffered).
+        """
+
+        self.buffer.setdefault(model, {})[text_name] = results
+        if len(self.buffer[model]) >= self.buffer_texts:
+            return self.write(model, self.buffer.pop(model))
+        return []
+
+    def flush(self) -> list:
+        written = []
+        for model in list(self.buffer):
+            written += self.write(model, self.buffer.pop(model))
+        return written
+
+    def scan(self, columns: list = None, models: list = None, handles: list = None, questions: list = None,
+                answered_only: bool = True) -> pa.Table:
+        """Read the current answers, only the requested columns and rows.
+
+        Args:
+            columns (list, optional): the columns to read (schema names and 'model'). Defaults to None (all).
+            models (list, optional): read only these models. Defaults to None (all).
+            handles (list, optional): read only the answers of these handles. Defaults to None (all).
+            questions (list, optional): read only the answers to these questions. Defaults to None (all).
+            answered_only (bool, optional): skip the rank 0 rows of questions without answers. Defaults to True.
+
+        Returns:
+            pa.Table: the answers
+        """
+
+        if columns is None:
+            columns = ['model'] + schema.names
+        read_columns = [column for column in schema.names if column in columns or column == 'text_name']
+        condition = None
+        for expression in [ds.field('handle').isin(handles) if handles is not None else None,
+                            ds.field('question').isin(questions) if questions is not None else None,
+                            ds.field('rank') > 0 if answered_only else None]:
+            if expression is not None:
+                condition = expression if condition is None else condition & expression
+
+        tables = []
+        for model in self.models():
+            if models is not None and model not in models:
+                continue
+            seen = set()
+            for filename in self.parts(model):
+                table = ds.dataset(filename, schema=schema, format='parquet').to_table(columns=read_columns, filter=condition)
+                text_names = table.column('text_name').to_pylist()
+                if len(seen) > 0:
+                    # rows of texts written again in a newer part file are replaced
+                    table = table.filter(pa.array([text_name not in seen for text_name in text_names], type=pa.bool_()))
+                seen.update(pq.read_table(filename, columns=['text_name']).column('text_name').to_pylist())
+                if 'model' in columns:
+                    table = table.append_column('model', pa.array([model] * table.num_rows, type=pa.string()))
+                tables.append(table.select([column for column in columns if column in table.column_names]))
+
+        if len(tables) == 0:
+            return pa.Table.from_pydict({column: [] for column in columns},
+                                        schema=pa.schema([('model', pa.string()) if column == 'model' else schema.field(column)
+                                                            for column in columns]))
+        return pa.concat_tables(tables)
+
+    def texts(self, handles: list = None) -> list:
+        """The texts with answers (or no answers rows), only the names are read.
+
+        Args:
+            handles (list, optional): only the texts of these handles. Defaults to None (all).
+
+        Returns:
+            list: tuples of model, handle and text name, ordered like answer_file_names (by text name and model)
+        """
+
+        table = self.scan(columns=['model', 'text_name', 'handle'], handles=handles, answered_only=False)
+        texts = set(zip(*[table.column(name).to_pylist() for name in ['model', 'handle', 'text_name']]))
+        return sorted(texts, key=lambda text: (text[2], text[0]))
+
+    def read_texts(self, texts: list) -> list:
+        """Read the answer sets of texts.
+
+        Args:
+            texts (list): tuples of model, handle and text name (see texts)
+
+        Returns:
+            list: tuples of model, handle and answers by question (see answers_by_text_name), in the order of texts
+        """
+
+        table = self.scan(models=sorted(set(text[0] for text in texts)), handles=sorted(set(text[1] for text in texts)),
+                            answered_only=False)
+        answer_sets = answers_by_text_name(table)
+        return [answer_sets[(text_name, model)] for model, _, text_name in texts if (text_name, model) in answer_sets]
+
+    def complete_texts(self, model: str, questions: list) -> set:
+        """The names of the texts of a model with answers (or a no answers row) to all questions"""
+
+        table = self.scan(columns=['text_name', 'question'], models=[model], questions=questions, answered_only=False)
+        answered = {}
+        for text_name, question in zip(table.column('text_name').to_pylist(), table.column('question').to_pylist()):
+            answered.setdefault(text_name, set()).add(question)
+        return set(text_name for text_name, text_questions in answered.items() if len(text_questions) == len(set(questions)))
+
+    def compact(self, model: str) -> None:
+        """Rewrite the partition of a model into a single part file without replaced rows"""
+
+        parts = self.parts(model)
+        if len(parts) <= 1:
+            return
+        table = self.scan(columns=schema.names, models=[model], answered_only=False)
+        filename = os.path.join(self.partition(model), f"part-{time.time_ns():020d}-{os.getpid()}.parquet")
+        pq.write_table(table, filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+        for part in parts:
+            os.remove(part)
+
+
+def answers_by_text_name(table: pa.Table) -> dict:
+    """Group scanned answers like the json answer files of extract_top_hits.py, one answer set per text
+       (the texts 10419-123456_1 and 10419-123456_2 have the same handle).
+
+    Args:
+        table (pa.Table): answers with the columns model, text_name, handle, question, rank and the answer columns
+
+    Returns:
+        dict: tuples of model, handle and answers by question (in rank order, as the rows are written) by text name and model
+    """
+
+    texts = {}
+    columns = [table.column(name).to_pylist() for name in ['model', 'text_name', 'handle', 'question', 'rank'] + answer_columns]
+    for model, text_name, handle, question, rank, *values in zip(*columns):
+        answers = texts.setdefault((text_name, model), (model, handle, {}))[2].setdefault(question, [])
+        if rank > 0:
+            answers.append(dict(zip(answer_columns, values)))
+
+    return texts
+
+
+def answers_by_text(table: pa.Table) -> list:
+    """The answer sets of answers_by_text_name ordered like answer_file_names (by text name and model)"""
+
+    answer_sets = answers_by_text_name(table)
+    return [answer_sets[key] for key in sorted(answer_sets)]
+
+
+def answer_file_key(filename: str) -> tuple:
+    """The text name and model of a json answer file (TEXT_MODEL.json)"""
+
+    return tuple(filename[:-5].rsplit('_', 1))
+
+
+def answer_file_names(directory: str) -> list:
+    """The json answer files of extract_top_hits.py in a directory, ordered by text name and model"""
+
+    return sorted((filename for filename in os.listdir(directory) if filename.lower().endswith('.json')), key=answer_file_key)
+
+
+def read_answer_file(filepath: str) -> tuple:
+    """Read a json answer file of extract_top_hits.py.
+
+    Args:
+        filepath (str): the path of the file (TEXT_MODEL.json)
+
+    Returns:
+        tuple: model, handle and answers by question
+    """
+
+    text_name, model = answer_file_key(os.path.basename(filepath))
+    with open(filepath, 'r', encoding="utf-8") as answer_file:
+        return model, handle_from_text_name(text_name), json.load(answer_file)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="answer_store.py\n" +
+                                    "Import the json answer files written by extract_top_hits.py into an answer store,\n" +
+                                    "or compact the part files of an answer store.\n")
+    parser.add_argument('store', metavar='answer-store', type=str,
+                        help='the directory of the answer store')
+    parser.add_argument('-i', '--import',
+                        help='import the json answer files of this directory (TEXT_MODEL.json).',
+                        metavar='DIR',
+                        dest='i')
+    parser.add_argument('-c', '--compact',
+                        help='compact the part files of every model.',
+                        dest='c',
+                        action="store_true")
+    parser.add_argument('-?', help='print this help message', dest='h', action="store_true")
+    args = parser.parse_args()
+
+    if args.h or not (args.i or args.c):
+        parser.print_help()
+        sys.exit(0)
+
+    answer_store = AnswerStore(args.store, buffer_texts=1000)
+    if args.i:
+        count = 0
+        for answer_file_json in answer_file_names(args.i):
+            try:
+                text_name, model = answer_file_key(answer_file_json)
+                with open(os.path.join(args.i, answer_file_json), 'r', encoding="utf-8") as answer_file:
+                    answer_store.add(model, text_name, json.load(answer_file))
+                count += 1
+            except Exception as e:
+                print(f"\nException {answer_file_json}: ", e)
+        answer_store.flush()
+        print(f"imported {count} answer files")
+    if args.c:
+        for model in answer_store.models():
+            answer_store.compact(model)
+            print(f"compacted model {model}")
+
+
+if __name__ == "__main__":
+    main()
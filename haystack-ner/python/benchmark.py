@@ -0,0 +1,444 @@
+#!/bin/env python
+import argparse
+import csv
+import datetime as dt
+import functools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import time
+import psutil
+
+
+model_names = ['roberta', 'xlm-roberta', 'electra', 'mfeb-albert-xxl-v2', 'minilm-uncased']
+
+questions = ['Who funded the article?', 'Who funded the work?', 'Who gives financial support?',
+                'By whom was the study funded?', 'Whose financial support do you acknowledge?',
+                'Who provided funding?', 'Who provided financial support?',
+                'By which grant was this research supported?']
+
+funder_prefixes = ['National', 'Federal', 'European', 'German', 'Swiss', 'Norwegian', 'Japan', 'Canadian', 'Royal', 'State']
+funder_subjects = ['Science', 'Research', 'Economic', 'Social Sciences', 'Health', 'Humanities', 'Innovation', 'Education', 'Energy', 'Labour']
+funder_kinds = ['Foundation', 'Council', 'Agency', 'Fund', 'Ministry', 'Institute', 'Trust', 'Society', 'Office', 'Bank']
+countries = ['Germany', 'Switzerland', 'Norway', 'Japan', 'Canada', 'United Kingdom', 'United States', 'France', 'Italy', 'Spain']
+syllables = ['ka', 'lo', 'mi', 'ren', 'sta', 'ber', 'ton', 'vi', 'dal', 'en', 'gor', 'hel', 'in', 'jus', 'mar', 'nor']
+filler_words = ['the', 'model', 'market', 'price', 'labour', 'effect', 'data', 'policy', 'we', 'estimate', 'results', 'show',
+                'that', 'firms', 'growth', 'rate', 'of', 'in', 'and', 'is', 'a', 'regression', 'sample', 'income', 'trade']
+acknowledgements = ['We gratefully acknowledge financial support from the {funder}.',
+                    'This work was funded by the {funder} under grant {grant}.',
+                    'The authors thank the {funder} for financial support (grant {grant}).',
+                    'Financial support by the {funder} is gratefully acknowledged.']
+
+sprint = functools.partial(print, end="")
+
+
+def funder_name(rng: random.Random, number: int) -> str:
+    """A synthetic funder name, unique by a made up proper name derived from number"""
+
+    proper_name = ''
+    while True:
+        proper_name += syllables[number % len(syllables)]
+        number //= len(syllables)
+        if number == 0:
+            break
+    return f"{rng.choice(funder_prefixes)} {rng.choice(funder_subjects)} {rng.choice(funder_kinds)} {proper_name.capitalize()}"
+
+
+def generate_funder_csv(filename: str, funders: int, rng: random.Random) -> list:
+    """Write a funder list in the format of extract_funders_from_rdf.py (ispref, id, name).
+
+    Args:
+        filename (str): the excel tab csv file
+        funders (int): the number of funders (each with a preflabel and an acronym as altlabel)
+        rng (random.Random): the random generator
+
+    Returns:
+        list: the preflabel names without country
+    """
+
+    names = []
+    with open(filename, 'w', newline='', encoding='utf-8') as csvoutfile:
+        csvwriter = csv.DictWriter(csvoutfile, fieldnames=['ispref', 'id', 'name'], dialect='excel-tab')
+        csvwriter.writeheader()
+        for number in range(funders):
+            name = funder_name(rng, number)
+            country = rng.choice(countries)
+            funder_id = f"doi:10.13039/{501100000000 + number}"
+            acronym = ''.join(word[0] for word in name.split()).upper()
+            csvwriter.writerow({'ispref': True, 'id': funder_id, 'name': f"{name} ({country})"})
+            csvwriter.writerow({'ispref': False, 'id': funder_id, 'name': f"{acronym} ({country})"})
+            names.append(name)
+
+    return names
+
+
+def generate_text(rng: random.Random, size: int, acknowledgement: str) -> str:
+    """A synthetic document of about size characters, the acknowledgement is put near the end"""
+
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = ' '.join(rng.choice(filler_words) for _ in range(rng.randint(40, 120))).capitalize() + '.'
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    if acknowledgement:
+        paragraphs.insert(max(len(paragraphs) - 2, 0), acknowledgement)
+
+    return '\n\n'.join(paragraphs)
+
+
+def generate_answers(rng: random.Random, acknowledgement: str, funder: str) -> dict:
+    """Answers of one model for one document in the format of extract_top_hits.py"""
+
+    results = {}
+    for question in questions:
+        no_answer = {'answer': None, 'score': rng.uniform(-5.0, 5.0), 'probability': rng.uniform(0.3, 0.6), 'context': None}
+        if funder and rng.random() < 0.8:
+            answer = {'answer': funder if rng.random() < 0.7 else f"the {funder}", 'score': rng.uniform(5.0, 25.0),
+                        'probability': rng.uniform(0.5, 0.99), 'context': acknowledgement, 'lang': 'en'}
+            results[question] = [answer, no_answer]
+        else:
+            other = ' '.join(rng.choice(filler_words) for _ in range(3))
+            answer = {'answer': other, 'score': rng.uniform(0.0, 8.0), 'probability': rng.uniform(0.1, 0.5),
+                        'context': f"... {other} ...", 'lang': 'en'}
+            results[question] = [no_answer, answer]
+
+    return results
+
+
+def generate_corpus(corpus_dir: str, items: int, funders: int, doc_size: int, models: int, seed: int) -> int:
+    """Generate the synthetic corpus: text documents, answer json files, funder list and merge input csv files.
+
+    Args:
+        corpus_dir (str): the directory of the corpus
+        items (int): the number of documents
+        funders (int): the number of funders in the funder list
+        doc_size (int): the approximate size of a document in characters
+        models (int): the number of models to generate answers for
+        seed (int): seed of the random generator
+
+    Returns:
+        int: the number of documents
+    """
+
+    rng = random.Random(seed)
+    for sub_dir in ['text', 'answers', 'csv']:
+        os.makedirs(os.path.join(corpus_dir, sub_dir), exist_ok=True)
+
+    funder_names = generate_funder_csv(os.path.join(corpus_dir, 'funder_list.csv'), funders, rng)
+    merge_rows = {model_name: [] for model_name in model_names[:models]}
+    for number in range(items):
+        text_name = f"10419-{100000 + number}"
+        funder = rng.choice(funder_names) if rng.random() < 0.7 else None
+        acknowledgement = ''
+        if funder:
+            acknowledgement = rng.choice(acknowledgements).format(funder=funder, grant=f"{rng.randint(10, 99)}-{rng.randint(1000, 9999)}")
+        with open(os.path.join(corpus_dir, 'text', f"{text_name}.txt"), 'w', encoding='utf-8') as text_file:
+            text_file.write(generate_text(rng, doc_size, acknowledgement))
+        for model_name in model_names[:models]:
+            results = generate_answers(rng, acknowledgement, funder)
+            with open(os.path.join(corpus_dir, 'answers', f"{text_name}_{model_name}.json"), 'w', encoding='utf-8') as json_file:
+                json.dump(results, json_file, ensure_ascii=False, indent=4)
+            merge_rows[model_name].append(merge_row(text_name, model_name, funder, results))
+        if (number + 1) % 1000 == 0:
+            sprint(f"\rgenerated {number + 1} items")
+    print(f"\rgenerated {items} items")
+
+    for model_name, rows in merge_rows.items():
+        write_rows(os.path.join(corpus_dir, 'csv', f"{model_name}_testset.csv"), rows)
+
+    return items
+
+
+def merge_row(text_name: str, model_name: str, funder: str, results: dict) -> dict:
+    """A row of the testset csv files of extract_answers_from_files.py -t as read by merge_answers.py"""
+
+    row = {'Handle': text_name.replace('-', '/'), 'Funder Identifier lt. CrossRef': '', 'Funder-Info lt. CrossRef': funder or '',
+            'Funder-Phrase lt. PDF': funder or '', 'keine Funder-Angabe im PDF': '' if funder else 'x', 'model': model_name}
+    for question, answers in results.items():
+        answer = answers[0]
+        valid = answer['answer'] is not None and answer['score'] >= 12.0
+        row[f"{question}_1_score_ge_12"] = valid
+        row[f"{question}_1_score_x_probability_ge_5"] = answer['answer'] is not None and answer['score'] * answer['probability'] >= 5.0
+        row[f"{question}_1_answer"] = answer['answer'] if valid else '-'
+        row[f"{question}_1_score"] = answer['score'] if valid else '-'
+        row[f"{question}_1_probability"] = answer['probability'] if valid else '-'
+        row[f"{question}_1_check"] = ('match' if funder else 'false positive') if valid else ('false negative' if funder else 'no funder')
+        row[f"{question}_1_found_funder_id"] = f"{funder}; doi:10.13039/501100000000; 95.00" if valid and funder else ''
+        row[f"{question}_1_found_funder_doi"] = 'doi:10.13039/501100000000' if valid and funder else ''
+
+    return row
+
+
+def write_rows(filename: str, rows: list) -> None:
+    if len(rows) == 0:
+        return
+    with open(filename, 'w', newline='', encoding='utf-8') as csvoutfile:
+        csvwriter = csv.DictWriter(csvoutfile, fieldnames=list(rows[0].keys()), dialect='excel-tab')
+        csvwriter.writeheader()
+        for row in rows:
+            csvwriter.writerow(row)
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the process in bytes (ru_maxrss is in KB on linux)"""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def run_stage(stages: dict, name: str, stage, *args) -> None:
+    """Run and time a benchmark stage and record its results in stages[name].
+       A stage returns the number of processed items and optionally a dict with further numbers.
+       Stages that fail, e.g. because haystack or the context classifier model are missing, are recorded as skipped.
+
+    Args:
+        stages (dict): the results of the stages
+        name (str): the name of the stage
+        stage (function): the stage function
+        *args: the arguments of the stage function
+    """
+
+    print(f"stage {name}")
+    start = time.perf_counter()
+    try:
+        result = stage(*args)
+    except Exception as e:
+        print(f"skip stage {name}: {e}")
+        stages[name] = {'skipped': f"{type(e).__name__}: {e}"}
+        return
+    seconds = time.perf_counter() - start
+
+    items, extra = result if isinstance(result, tuple) else (result, {})
+    stages[name] = {
+        'seconds': seconds,
+        'items': items,
+        'items_per_s': items / seconds if seconds > 0 else 0.0,
+        'rss_mb': psutil.Process().memory_info().rss / 2**20,
+        'peak_rss_mb': peak_rss() / 2**20,
+        }
+    stages[name].update(extra)
+    print(f"stage {name}: {items} items in {seconds:.2f}s ({stages[name]['items_per_s']:.1f}/s), "
+          f"peak rss {stages[name]['peak_rss_mb']:.0f} MB")
+
+
+def stage_ingest_preprocessing(file_paths: list, workers: int):
+    from load_docs_into_elasticsearch_split_pdf_lang import convert_files
+
+    splits = 0
+    size = 0
+    for file_path, lang_info, doc_parts, timings in convert_files(file_paths, 'txt', workers=workers):
+        if doc_parts is not None:
+            splits += len(doc_parts)
+            size += os.path.getsize(file_path)
+    return len(file_paths), {'splits': splits, 'mb': size / 2**20}
+
+
+def stage_load_answers(answers_dir: str, answers: list):
+    for answer_file_json in sorted(os.listdir(answers_dir)):
+        with open(os.path.join(answers_dir, answer_file_json), 'r', encoding='utf-8') as answer_file:
+            answers.append((answer_file_json, json.load(answer_file)))
+    return len(answers)
+
+
+def stage_answer_store_write(store_dir: str, answers: list):
+    from answer_store import AnswerStore
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    answer_store = AnswerStore(store_dir, buffer_texts=1000)
+    for answer_file_json, answers_from_file in answers:
+        text_name, model_name = answer_file_json[:-5].rsplit('_', 1)
+        answer_store.add(model_name, text_name, answers_from_file)
+    answer_store.flush()
+    return len(answers)
+
+
+def stage_load_answer_store(store_dir: str):
+    from answer_store import AnswerStore, answers_by_text
+
+    return len(answers_by_text(AnswerStore(store_dir).scan(answered_only=False)))
+
+
+def stage_classification(contexts: list, batch_size: int):
+    from nlu import prediction
+    from nlu.handlers.prediction import make_predictions
+
+    prediction.load()
+    make_predictions(prediction.nlp, prediction.model, contexts, batch_size, prediction.config['PREDICT_N_PROCESS'])
+    return len(contexts)
+
+
+def stage_funder_registry(funder_csv_file: str, registry_file: str, funder: dict):
+    from funder_registry import load_funder_registry
+
+    # time building, writing and mapping the registry, not only mapping it
+    if os.path.exists(registry_file):
+        os.remove(registry_file)
+    funder['registry'] = load_funder_registry(funder_csv_file, registry_file)
+    return len(funder['registry'])
+
+
+def stage_funder_index(funder: dict):
+    from funder_index import FunderIndex
+
+    funder['index'] = FunderIndex(funder['registry'])
+    return len(funder['registry'])
+
+
+def stage_funder_matching(possible_funders: list, funder: dict, matches: list):
+    from extract_answers_from_files import find_funder_from_list
+
+    for possible_funder in possible_funders:
+        matches.append(find_funder_from_list(possible_funder, funder['index']))
+    return len(possible_funders), {'matched': sum(1 for match in matches if match)}
+
+
+def stage_merging(csv_dir: str, merged: dict):
+    from merge_answers import load_testset_answers_from_csv_file, merge_answers
+
+    rows = 0
+    for csv_filename in sorted(os.listdir(csv_dir)):
+        answers = load_testset_answers_from_csv_file(os.path.join(csv_dir, csv_filename))
+        rows += len(answers)
+        merge_answers(merged, answers, 12.0, False, 5.0)
+    return rows
+
+
+def stage_csv_writing(filename: str, answers: list):
+    from extract_answers_from_files import ExcelTabCsvWriter
+
+    fieldnames = ['handle', 'question', 'model', 'answer', 'score', 'probability', 'context', 'lang']
+    writer = ExcelTabCsvWriter(filename, fieldnames)
+    for answer_file_json, answers_from_file in answers:
+        for question, question_answers in answers_from_file.items():
+            for answer in question_answers:
+                if answer['answer'] is not None:
+                    record = {'handle': answer_file_json[:-5], 'question': question, 'model': ''}
+                    record.update(answer)
+                    writer.write(record)
+    writer.close()
+    records = writer.rows
+    return records, {'mb': os.path.getsize(filename) / 2**20}
+
+
+def compare_results(old: dict, new: dict) -> None:
+    """Print the throughput of the stages of two benchmark runs side by side"""
+
+    print(f"{'stage':25} {'old items/s':>12} {'new items/s':>12} {'speedup':>8} {'old peak MB':>12} {'new peak MB':>12}")
+    for name, new_stage in new['stages'].items():
+        old_stage = old['stages'].get(name, {})
+        if 'items_per_s' not in new_stage or 'items_per_s' not in old_stage:
+            continue
+        speedup = new_stage['items_per_s'] / old_stage['items_per_s'] if old_stage['items_per_s'] > 0 else 0.0
+        print(f"{name:25} {old_stage['items_per_s']:12.1f} {new_stage['items_per_s']:12.1f} {speedup:7.2f}x "
+              f"{old_stage['peak_rss_mb']:12.0f} {new_stage['peak_rss_mb']:12.0f}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="benchmark.py\n" +
+                                    "Time the pipeline stages on a synthetic EconStor-like corpus (no network or gpu needed).\n" +
+                                    "Stages: ingest preprocessing, loading answers, classification, funder index and matching, merging, csv writing.\n" +
+                                    "Stages whose dependencies (haystack, context classifier model) are missing are skipped.\n")
+    parser.add_argument('-n', '--items',
+                        help='number of documents of the synthetic corpus, e.g. 1000, 10000, 100000 (default 1000).',
+                        metavar='N',
+                        dest='n', type=int, default=1000)
+    parser.add_argument('-f', '--funders',
+                        help='number of funders in the synthetic funder list (default 30000).',
+                        metavar='N',
+                        dest='f', type=int, default=30000)
+    parser.add_argument('-s', '--doc-size',
+                        help='approximate size of a document in characters (default 20000).',
+                        metavar='N',
+                        dest='s', type=int, default=20000)
+    parser.add_argument('-m', '--models',
+                        help='number of models to generate answer files for (default 1).',
+                        metavar='N',
+                        dest='m', type=int, default=1)
+    parser.add_argument('-l', '--limit',
+                        help='maximum number of documents, contexts and answers per stage for the slow stages (default 1000).',
+                        metavar='N',
+                        dest='l', type=int, default=1000)
+    parser.add_argument('-w', '--workers',
+                        help='number of worker processes for ingest preprocessing (default 1).',
+                        metavar='N',
+                        dest='w', type=int, default=1)
+    parser.add_argument('-c', '--corpus',
+                        help='directory of the synthetic corpus, generated if it does not exist (default ./benchmark_corpus/ITEMS).',
+                        dest='c')
+    parser.add_argument('-o', '--output',
+                        help='json file to write the results to (default ./benchmark_results/benchmark_ITEMS_%%Y-%%m-%%d_%%H%%M%%S.json).',
+                        dest='o')
+    parser.add_argument('-r', '--compare',
+                        help='json file of an earlier run to compare the results with.',
+                        dest='r')
+    parser.add_argument('--seed',
+                        help='seed of the random generator (default 42).',
+                        dest='seed', type=int, default=42)
+    parser.add_argument('-?', help='print this help message', dest='h', action="store_true")
+    args = parser.parse_args()
+
+    if args.h:
+        parser.print_help()
+        sys.exit(0)
+
+    corpus_dir = args.c if args.c else f"./benchmark_corpus/{args.n}"
+    output = args.o if args.o else f"./benchmark_results/benchmark_{args.n}_{dt.datetime.now():%Y-%m-%d_%H%M%S}.json"
+
+    results = {
+        'started': f"{dt.datetime.now():%Y-%m-%d %H:%M:%S}",
+        'parameters': {'items': args.n, 'funders': args.f, 'doc_size': args.s, 'models': args.m,
+                        'limit': args.l, 'workers': args.w, 'seed': args.seed},
+        'system': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count(), 'memory_mb': psutil.virtual_memory().total / 2**20},
+        'stages': {},
+        }
+    stages = results['stages']
+
+    if not os.path.isdir(corpus_dir):
+        run_stage(stages, 'generate', generate_corpus, corpus_dir, args.n, args.f, args.s, args.m, args.seed)
+
+    text_dir = os.path.join(corpus_dir, 'text')
+    file_paths = sorted(os.path.join(text_dir, filename) for filename in os.listdir(text_dir))
+    run_stage(stages, 'ingest_preprocessing', stage_ingest_preprocessing, file_paths[:args.l], args.w)
+
+    answers = []
+    run_stage(stages, 'load_answers', stage_load_answers, os.path.join(corpus_dir, 'answers'), answers)
+    run_stage(stages, 'answer_store_write', stage_answer_store_write, os.path.join(corpus_dir, 'answer_store'), answers)
+    run_stage(stages, 'load_answer_store', stage_load_answer_store, os.path.join(corpus_dir, 'answer_store'))
+
+    contexts = list(dict.fromkeys(answer['context'] for _, answers_from_file in answers
+                                    for question_answers in answers_from_file.values()
+                                    for answer in question_answers if answer['context'] is not None))
+    run_stage(stages, 'classification', stage_classification, contexts[:args.l], 64)
+
+    funder = {}
+    run_stage(stages, 'funder_registry', stage_funder_registry, os.path.join(corpus_dir, 'funder_list.csv'),
+                os.path.join(corpus_dir, 'funder_list.reg'), funder)
+    if 'registry' in funder:
+        run_stage(stages, 'funder_index', stage_funder_index, funder)
+    if 'index' in funder:
+        possible_funders = [question_answers[0]['answer'] for _, answers_from_file in answers
+                                for question_answers in answers_from_file.values() if question_answers[0]['answer'] is not None]
+        run_stage(stages, 'funder_matching', stage_funder_matching, possible_funders[:args.l], funder, [])
+
+    run_stage(stages, 'merging', stage_merging, os.path.join(corpus_dir, 'csv'), {})
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    run_stage(stages, 'csv_writing', stage_csv_writing, f"{os.path.splitext(output)[0]}_answers.csv", answers)
+
+    results['peak_rss_mb'] = peak_rss() / 2**20
+    with open(output, 'w', encoding='utf-8') as json_file:
+        json.dump(results, json_file, ensure_ascii=False, indent=4)
+    print(f"results written to {output}")
+
+    if args.r:
+        with open(args.r, 'r', encoding='utf-8') as json_file:
+            compare_results(json.load(json_file), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/bin/env python
+import argparse
+import json
+import sys
+import time
+import yaml
+from extract_top_hits import models, questions, create_retriever, retrieve_passages, predict_answers_batched
+from extract_answers_from_files import load_testset_from_csv_file
+from reader_backend import READER_BACKENDS, load_reader, model_backend
+
+
+def compare_results(reference: dict, candidate: dict) -> dict:
+    """Compare the answers of a text extracted with two reader backends.
+
+    Args:
+        reference (dict): answers by question of the fp32 reader
+        candidate (dict): answers by question of the reader to check
+
+    Returns:
+        dict: number of questions, of equal top answers, of reference answers found by
+              the candidate and the sum of the absolute differences of the top scores
+    """
+
+    comparison = {'questions': 0, 'top1_equal': 0, 'answers': 0, 'answers_found': 0, 'score_diff': 0.0}
+    for question, reference_answers in reference.items():
+        candidate_answers = candidate.get(question, [])
+        if len(reference_answers) == 0 or len(candidate_answers) == 0:
+            continue
+        comparison['questions'] += 1
+        if reference_answers[0]['answer'] == candidate_answers[0]['answer']:
+            comparison['top1_equal'] += 1
+        comparison['score_diff'] += abs(reference_answers[0]['score'] - candidate_answers[0]['score'])
+        found = set(answer['answer'] for answer in candidate_answers)
+        comparison['answers'] += len(reference_answers)
+        comparison['answers_found'] += sum(1 for answer in reference_answers if answer['answer'] in found)
+
+    return comparison
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="check_reader_backend.py\n" +
+                                    "Compare the answers of a reader backend with the fp32 pytorch reader on the test set.\n" +
+                                    "Both readers get the same retrieved passages, the top answers, scores and the inference time are compared.\n")
+    parser.add_argument('-e', '--backend',
+                        help='reader backend to check (default: onnx-int8).',
+                        dest='e',
+                        choices=READER_BACKENDS,
+                        default='onnx-int8')
+    parser.add_argument('-m', '--model',
+                        help='check only this model (e.g. roberta), can be repeated (default: all models).',
+                        dest='m',
+                        action='append')
+    parser.add_argument('-n', '--max-items',
+                        help='check only the first N items of the test set.',
+                        metavar='N',
+                        dest='n',
+                        type=int)
+    parser.add_argument('-s', '--batch-size',
+                        help='number of samples per reader inference batch (default: 64).',
+                        dest='s',
+                        type=int,
+                        default=64)
+    parser.add_argument('-d', '--DPR',
+                        help='use DensePassageRetriever for retrieval.',
+                        dest='d',
+                        action="store_true")
+    parser.add_argument('-o', '--offline',
+                        help='read the splits from the split store, without elasticsearch.',
+                        dest='o',
+                        action="store_true")
+    parser.add_argument('-j', '--json',
+                        help='write the results to this json file.',
+                        dest='j')
+    parser.add_argument('-?', help='print this help message', dest='h', action="store_true")
+    args = parser.parse_args()
+
+    if args.h:
+        parser.print_help()
+        sys.exit(0)
+
+    with open('config.yaml', 'r') as cfgin:
+            config = yaml.safe_load(cfgin)
+
+    testset = load_testset_from_csv_file(config['test_csv_file'])
+    text_names = [handle.replace('/', '-') for handle in testset]
+    if args.n is not None:
+        text_names = text_names[:args.n]
+
+    el_retriever, _, _ = create_retriever(config, args)
+    passages_by_text = {}
+    for text_name in text_names:
+        try:
+            passages_by_text[text_name] = retrieve_passages(el_retriever, text_name, questions, top_k_retriever=10)
+        except Exception as e:
+            print("\nException ", e)
+    print(f'Retrieved passages for {len(passages_by_text)} test set items')
+
+    results = {}
+    for model_name, model in models:
+        if args.m and model_name not in args.m:
+            continue
+        timings = {}
+        answers = {}
+        try:
+            for backend in ['pytorch', args.e]:
+                print(f'Load model: {model_name}, {model} ({backend})')
+                reader = load_reader(model, backend, use_gpu=False, models_cache=config['models_cache'], no_ans_boost=1, return_no_answer=True)
+                start = time.perf_counter()
+                answers[backend] = predict_answers_batched(reader, passages_by_text, top_k_reader=2, batch_size=args.s)
+                timings[backend] = time.perf_counter() - start
+                del reader
+        except Exception as e:
+            print(f"\nException model {model_name}: ", e)
+            continue
+
+        comparison = {'questions': 0, 'top1_equal': 0, 'answers': 0, 'answers_found': 0, 'score_diff': 0.0}
+        for text_name, reference in answers['pytorch'].items():
+            for key, value in compare_results(reference, answers[args.e][text_name]).items():
+                comparison[key] += value
+
+        questions_compared = max(comparison['questions'], 1)
+        results[model_name] = {
+            'backend': model_backend(model, args.e),
+            'questions': comparison['questions'],
+            'top1_agreement': comparison['top1_equal'] / questions_compared,
+            'answers_recall': comparison['answers_found'] / max(comparison['answers'], 1),
+            'mean_top1_score_diff': comparison['score_diff'] / questions_compared,
+            'seconds_pytorch': timings['pytorch'],
+            f'seconds_{args.e}': timings[args.e],
+            'speedup': timings['pytorch'] / max(timings[args.e], 1e-9),
+            }
+        print(f"{model_name}: top answer agreement {results[model_name]['top1_agreement']:.3f}, "
+              f"answers found {results[model_name]['answers_recall']:.3f}, "
+              f"mean score difference {results[model_name]['mean_top1_score_diff']:.3f}, "
+              f"speedup {results[model_name]['speedup']:.2f}x")
+
+    if args.j:
+        with open(args.j, 'w', encoding="utf-8") as json_file:
+            json.dump(results, json_file, ensure_ascii=False, indent=4)
+
+if __name__ == "__main__":
+    main()
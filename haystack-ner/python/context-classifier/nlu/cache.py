@@ -0,0 +1,96 @@
+import hashlib
+import sqlite3
+from collections import OrderedDict
+
+
+def file_fingerprint(filepath):
+    '''
+    returns sha256 hex digest of the content of the file
+    '''
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as fs:
+        for chunk in iter(lambda: fs.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def normalize(text):
+    # whitespace does not change the prediction, case does (token shape)
+    return ' '.join(text.split())
+
+
+class PredictionCache:
+    '''
+    persistent cache of context predictions (sqlite) with an in-memory LRU in front.
+    entries are keyed by the normalized text and the fingerprint of the model file,
+    entries of another model file are dropped when the cache is opened.
+    '''
+
+    def __init__(self, filepath, model_fingerprint, lru_size=100000):
+        self.model_fingerprint = model_fingerprint
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(filepath, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                        '(key TEXT PRIMARY KEY, intent TEXT, confidence REAL)')
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'model'").fetchone()
+        if row is None or row[0] != model_fingerprint:
+            if row is not None:
+                print('model file changed, clearing prediction cache')
+            self.db.execute('DELETE FROM predictions')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('model', ?)", (model_fingerprint,))
+        self.db.commit()
+
+    def key(self, text):
+        content = f'{self.model_fingerprint}\0{normalize(text)}'
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def remember(self, key, prediction):
+        self.lru[key] = prediction
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def get(self, text):
+        '''
+        returns the cached prediction of text or None
+        '''
+        key = self.key(text)
+        prediction = self.lru.get(key)
+        if prediction is not None:
+            self.lru.move_to_end(key)
+            self.memory_hits += 1
+            return prediction
+
+        row = self.db.execute('SELECT intent, confidence FROM predictions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        prediction = {'intent': {'value': row[0], 'confidence': row[1]}}
+        self.remember(key, prediction)
+        self.disk_hits += 1
+        return prediction
+
+    def put_many(self, texts, predictions):
+        rows = []
+        for text, prediction in zip(texts, predictions):
+            key = self.key(text)
+            self.remember(key, prediction)
+            rows.append((key, str(prediction['intent']['value']), float(prediction['intent']['confidence'])))
+        self.db.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)', rows)
+        self.db.commit()
+
+    def info(self):
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'memory_entries': len(self.lru),
+            }
@@ -1,8 +1,4 @@
 import numpy as np
-from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import GridSearchCV
-from sklearn.model_selection import train_test_split
-from sklearn.svm import SVC
 
 
 class IntentSklearnClassifier:
@@ -12,6 +8,12 @@ class IntentSklearnClassifier:
 
 
 def train(nlp, expressions):
+    # sklearn is only imported for training, unpickling a model imports what it needs
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.model_selection import train_test_split
+    from sklearn.svm import SVC
+
     le = LabelEncoder()
 
     labels = [exp.intent for exp in expressions]
@@ -59,4 +61,26 @@ def predict(nlp, intent_model, text):
 
     intent, confidence = list(zip(intents, probabilities))[0]
 
-    return intent, confidence
\ No newline at end of file
+    return intent, confidence
+
+def predict_batch(nlp, intent_model, texts, batch_size=64, n_process=1):
+
+    assert isinstance(intent_model, IntentSklearnClassifier), (
+        'intent_sklearn-classifier: predict_batch: intent_model is not '
+        'of type IntentSklearn'
+        )
+
+    if len(texts) == 0:
+        return []
+
+    le = intent_model.le
+    clf = intent_model.clf
+
+    docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+    X = np.stack([doc.vector for doc in docs])
+    predictions = clf.predict_proba(X)
+    intent_ids = np.fliplr(np.argsort(predictions, axis=1))[:, 0]
+    intents = le.inverse_transform(intent_ids)
+    probabilities = predictions[np.arange(len(intent_ids)), intent_ids]
+
+    return list(zip(intents, probabilities))
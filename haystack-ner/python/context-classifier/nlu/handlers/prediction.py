@@ -15,4 +15,19 @@ def make_prediction(nlp, model, text):
         'confidence': round(np.float64(confidence), 4),
         }
 
-    return prediction
\ No newline at end of file
+    return prediction
+
+
+def make_predictions(nlp, model, texts, batch_size=64, n_process=1):
+
+    # predict intents of all texts at once
+    ic = model.intent_classifier
+
+    predictions = []
+    for intent, confidence in intent_sklearn.predict_batch(nlp, ic, texts, batch_size, n_process):
+        predictions.append({'intent': {
+            'value': intent,
+            'confidence': round(np.float64(confidence), 4),
+            }})
+
+    return predictions
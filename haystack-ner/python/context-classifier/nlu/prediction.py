@@ -1,14 +1,79 @@
-from nlu.handlers.prediction import make_prediction
+from nlu.handlers.prediction import make_prediction, make_predictions
 from nlu.model import Model
 from nlu.config.config import load_config
-import spacy
+from nlu.cache import PredictionCache, file_fingerprint
+from nlu import utils
 
 config = load_config()
-print('loading model')
-model = Model(config['MODEL_FILEPATH'])
-print('loading spaCy')
-nlp = spacy.load('en_core_web_sm')
+
+# model and spaCy pipeline are loaded on first use, not on import
+model = None
+nlp = None
+cache = None
+
+
+def load():
+    global model, nlp
+    if model is None:
+        print('loading model')
+        model = Model(config['MODEL_FILEPATH'])
+    if nlp is None:
+        print('loading spaCy')
+        nlp = utils.spacy_load(config['SPACY_MODEL'], config['SPACY_VECTORS_ONLY'], config['SPACY_EXCLUDE'])
+
+
+def load_cache():
+    # the cache only needs the fingerprint of the model file,
+    # model and spaCy are not loaded as long as all predictions are cached
+    global cache
+    if cache is None and config['CACHE_FILEPATH']:
+        cache = PredictionCache(config['CACHE_FILEPATH'], file_fingerprint(config['MODEL_FILEPATH']),
+                                config['CACHE_LRU_SIZE'])
+    return cache
+
+
+def cache_info():
+    if cache is None:
+        return None
+    return cache.info()
 
 
 def predict(text):
-    return make_prediction(nlp, model, text)
\ No newline at end of file
+    if load_cache() is not None:
+        prediction = cache.get(text)
+        if prediction is None:
+            load()
+            prediction = make_prediction(nlp, model, text)
+            cache.put_many([text], [prediction])
+        return prediction
+
+    load()
+    return make_prediction(nlp, model, text)
+
+
+def predict_batch(texts, batch_size=None, n_process=None):
+    if batch_size is None:
+        batch_size = config['PREDICT_BATCH_SIZE']
+    if n_process is None:
+        n_process = config['PREDICT_N_PROCESS']
+
+    if load_cache() is None:
+        load()
+        return make_predictions(nlp, model, texts, batch_size, n_process)
+
+    predictions = [cache.get(text) for text in texts]
+    # classify each missing context once, even if it occurs several times
+    missing = {}
+    for text, prediction in zip(texts, predictions):
+        if prediction is None:
+            missing.setdefault(cache.key(text), text)
+    if len(missing) > 0:
+        load()
+        missing_texts = list(missing.values())
+        computed = make_predictions(nlp, model, missing_texts, batch_size, n_process)
+        cache.put_many(missing_texts, computed)
+        computed = dict(zip(missing.keys(), computed))
+        predictions = [computed[cache.key(text)] if prediction is None else prediction
+                       for text, prediction in zip(texts, predictions)]
+
+    return predictions
@@ -1,5 +1,5 @@
-import spacy
 from nlu.config.config import load_config
+from nlu import utils
 from nlu.handlers import data
 from nlu.model import Model
 from nlu.classifiers import intent_sklearn
@@ -16,7 +16,7 @@ def train():
     model = Model()
     # load spaCy
     print('loading spacy model...')
-    nlp = spacy.load('en_core_web_sm')
+    nlp = utils.spacy_load(config['SPACY_MODEL'], config['SPACY_VECTORS_ONLY'], config['SPACY_EXCLUDE'])
     # train intent classifier
     ic = intent_sklearn.train(nlp, expressions)
     model.set_intent_classifier(ic)
@@ -23,3 +23,12 @@ def yaml_dump(data, file_path):
     with open(file_path, 'w') as fs:
         yaml.dump(data, fs)
         return None
+
+
+def spacy_load(name, vectors_only=False, exclude=None):
+    # spaCy is imported here, so importing nlu does not pay for it
+    import spacy
+    if vectors_only and exclude:
+        # doc.vector only needs the tokenizer and tok2vec (or static vectors)
+        return spacy.load(name, exclude=exclude)
+    return spacy.load(name)
@@ -1,105 +1,85 @@
 #!/bin/env python
 import argparse
+import collections
 import csv
 import datetime as dt
 import functools
-import json
 import logging
+import math
+import multiprocessing
 import os
 import regex
 import yaml
 import sys
 import rapidfuzz as fuzz
+from concurrent.futures import ProcessPoolExecutor
 from unidecode import unidecode
-from nlu.prediction import predict
+from nlu.prediction import predict_batch, cache_info, load as load_context_classifier
+from funder_index import FunderIndex, load_funder_index
+from answer_store import AnswerStore, answer_file_key, answer_file_names, handle_from_text_name, read_answer_file
+from funder_questions import questions, top_k_reader
+import metrics
 #import strsimpy as strsim
 
 
-def get_modelname_from_filename(filename: str) -> str:
-    """Extract squad model name from filename (e.g. roberta).
+class ExcelTabCsvWriter:
+    """An exel csv file that uses TABs as separators, kept open to write the rows as they are produced.
 
-    Args:
-        filename (str): filename of json file containing answers
-
-    Returns:
-        str: the squad model name retrieved from filename (e.g. roberta)
+    The file is created with the first row. The columns are declared up front,
+    fields missing in a row are left empty, fields not declared are ignored.
     """
 
-    modelname = ""
-
-    if (filename is not None) and (len(filename) > 5):
-        try:
-            lindex = filename.rindex('_') + 1
-            modelname = filename[lindex:-5]
-        except KeyError as k:
-            pass
-
-    return modelname
-
-
-def get_handle_from_filename(filename: str) -> str:
-    """Extract item handle from filename.
-
-    Args:
-        filename (str): filename of json file containing answers
-
-    Returns:
-        str: the EconStor handle retrieved from filename
-    """
-
-    prefix_len = len('10419-')
-    handle = ""
-
-    if (filename is not None) and (len(filename) > 5):
-        try:
-            handle = regex.sub('-|_', '/', filename[:filename.find('_', prefix_len)])
-        except KeyError as k:
-            pass
+    def __init__(self, filename: str, fieldnames: list):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.csvoutfile = None
+        self.csvwriter = None
+        self.rows = 0
 
-    return handle
+    def write(self, record: dict) -> None:
+        if self.csvwriter is None:
+            self.csvoutfile = open(self.filename, 'w', newline='', encoding='utf-8')
+            self.csvwriter = csv.DictWriter(self.csvoutfile, fieldnames=self.fieldnames, dialect='excel-tab',
+                                            restval='', extrasaction='ignore')
+            self.csvwriter.writeheader()
+        self.csvwriter.writerow(record)
+        self.rows += 1
 
+    def close(self) -> None:
+        if self.csvoutfile is not None:
+            self.csvoutfile.close()
 
-def write_excel_tab_csv_file(filename: str, fieldnames: list, records: list) -> None:
-    """Writes an exel csv file that uses TABs as separators.
 
-    Args:
-        filename (str): The filename of the csv file
-        fieldnames (list): The fieldnames in the first row
-        records (list): The rows of data to save in the file
-    """
+# columns of the files with all valid answers (-f) and the valid answers per model (-p)
+valid_answer_fieldnames = ['handle', 'question', 'score_ge_12', 'score_x_probability_ge_5', 'context_prediction', 'context_confidence',
+                            'model', 'answer', 'score', 'probability', 'context', 'lang', 'found_funder_id', 'found_funder_doi']
 
-    with open(filename, 'w', newline='', encoding='utf-8') as csvoutfile:
-        csvwriter = csv.DictWriter(csvoutfile, fieldnames=fieldnames, dialect='excel-tab')
-        csvwriter.writeheader()
-        for record in records:
-            csvwriter.writerow(record)
+# columns of an answer in the testset files (-t), prefixed with question and answer number
+testset_answer_columns = ['score_ge_12', 'score_x_probability_ge_5', 'answer', 'score', 'probability', 'context_prediction',
+                            'context_confidence', 'check', 'found_funder_id', 'found_funder_doi']
 
 
-def load_funder_from_csv_file(filename: str) -> dict:
-    """load funder names from serialized csv file
+def testset_fieldnames(testset_columns: list, questions: list, answers_per_question: int, add_context: bool) -> list:
+    """Columns of the testset files (see update_testset_answer)
 
     Args:
-        filename (str): the name of the file containing the serialized rdf crossref funder list
+        testset_columns (list): the columns of the testset csv file
+        questions (list): the questions
+        answers_per_question (int): max. number of answers per question
+        add_context (bool): add the context column of every answer
 
     Returns:
-        dict: dictionary of funders
+        list: the columns
     """
 
-    funder = {'preflabel': {}, 'altlabel': {}}
-
-    try:
-        with open(filename, 'r',newline='', encoding='utf-8') as csvinfile:
-            csvreader = csv.DictReader(csvinfile, dialect='excel-tab')
-            for row in csvreader:
-                if row['ispref'] == 'True':
-                    funder['preflabel'][row['id']] = row['name']
-                else:
-                    funder['altlabel'][f"{row['id']}_{row['name']}"] = row['name']
+    fieldnames = testset_columns + ['model']
+    for question in questions:
+        for answerno in range(1, answers_per_question + 1):
+            fieldnames += [f"{question}_{answerno}_{column}" for column in testset_answer_columns]
+            if add_context:
+                fieldnames.append(f"{question}_{answerno}_context")
 
-    except Exception as e:
-        print(e)
-    
-    return funder
+    return fieldnames
 
 
 def load_testset_from_csv_file(filename: str) -> dict:
@@ -124,54 +104,59 @@ def load_testset_from_csv_file(filename: str) -> dict:
     return rows
 
 
-def find_funder_from_list(possible_funder: str, list_of_funders: dict) -> str:
+# a funder authority record matched by an answer: preferred name, crossref id, similarity of the matched label,
+# whether the match was found via an alternative label and the matched label
+FunderMatch = collections.namedtuple('FunderMatch', ['name', 'id', 'score', 'via_altlabel', 'label'])
+
+# diagnostic record of a funder search, only created when debug logging is enabled
+MatchTrace = collections.namedtuple('MatchTrace', ['query', 'label_kind', 'candidates', 'match'])
+
+
+def tracing() -> bool:
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+
+def find_funder_from_list(possible_funder: str, list_of_funders: FunderIndex) -> FunderMatch:
     """search for funder name in crossref authority records
 
     Args:
         possible_funder (str): fundername to look up in authority records
-        list_of_funders (dict): crossref funder authority records
+        list_of_funders (FunderIndex): matching index of the crossref funder authority records
 
     Returns:
-        str: containing a list of possible authority records -> 
-            'funder name; crossref id; similarity ratio between possible_funder and funder name in record' 
+        FunderMatch: the authority record with the highest similarity (>= 90) of the preflabels,
+            else of the altlabels, None if there is no match
     """
-    
-    results = fuzz.process.extract(possible_funder, list_of_funders['preflabel'], scorer=fuzz.fuzz.WRatio)
-    result_str = ""
-    max_sim_res = ""
-    maxsim = 0.0
-    for funder, similarity, funder_identifier in results:
-        if similarity > maxsim:
-            maxsim = similarity
-            max_sim_res = f"{funder}; {funder_identifier}; {similarity:.2f}"
-        result_str = result_str + f", ({funder}; {funder_identifier}; {similarity:.2f})"
-    result_str = result_str[2:]
-    if maxsim >= 90.0:
-        logging.debug(f"\nmatch preflabel search: '{possible_funder}' -> {result_str}'")
-        return max_sim_res
-    else:
-        logging.debug(f"\nno match preflabel search: '{possible_funder}' -> {result_str}'")
-        results = fuzz.process.extract(possible_funder, list_of_funders['altlabel'], scorer=fuzz.fuzz.WRatio)
-        result_str = ""
-        max_sim_res = ""
-        max_sim_res_id = ""
-        maxsim = 0.0
-        for funder, similarity, funder_identifier in results:
-            id = (funder_identifier.split("_"))[0]
-            if similarity > maxsim:
-                maxsim = similarity
-                max_sim_res = f" ({funder}); {id}; {similarity:.2f}"
-                max_sim_res_id = id
-            result_str = result_str + f", ({funder}; {id}; {similarity:.2f})"
-        result_str = result_str[2:]
-        if maxsim >= 90.0:
-            funderpref = list_of_funders['preflabel'].get(max_sim_res_id)
-            max_sim_res = funderpref + max_sim_res
-            logging.debug(f"\nmatch altlabel search: '{possible_funder}' -> {result_str}'")
-            return max_sim_res
-        else:
-            logging.debug(f"\nno match altlabel search: '{possible_funder}' ->  {result_str}'")
-            return ""
+
+    registry = list_of_funders.registry
+    for label_kind in ['preflabel', 'altlabel']:
+        results = list_of_funders.extract(possible_funder, label_kind)
+        match = None
+        if len(results) > 0:
+            label, similarity, funder_no = max(results, key=lambda result: result[1])
+            if similarity >= 90.0:
+                if label_kind == 'preflabel':
+                    match = FunderMatch(label, registry.ids[funder_no], similarity, False, label)
+                else:
+                    match = FunderMatch(registry.preflabel[funder_no], registry.ids[funder_no], similarity, True, label)
+        if tracing():
+            logging.debug("%s", MatchTrace(possible_funder, label_kind, results, match))
+        if match is not None:
+            return match
+
+    return None
+
+
+def format_funder_match(match: FunderMatch) -> str:
+    """The found_funder_id column of a match: 'funder name; crossref id; similarity',
+       the name is followed by the matched altlabel in brackets for altlabel matches
+    """
+
+    if match is None:
+        return ""
+    if match.via_altlabel:
+        return f"{match.name} ({match.label}); {match.id}; {match.score:.2f}"
+    return f"{match.name}; {match.id}; {match.score:.2f}"
 
 
 def check_similarity_of_answers(given_answer: str, expected_answer: str, try_unidecode: bool = True) -> bool:
@@ -186,8 +171,10 @@ def check_similarity_of_answers(given_answer: str, expected_answer: str, try_uni
         bool: returns True if the given answer is simmilar to the expected answer (fuzz.partial_ratio >= 90%), returns False otherwise.
     """
 
-    fuzz_conf = fuzz.fuzz.partial_ratio(fuzz.utils.default_process(given_answer), fuzz.utils.default_process(expected_answer))
-    logging.debug(f"\nfuzz.fuzz.partial_ratio('{fuzz.utils.default_process(given_answer)}', '{fuzz.utils.default_process(expected_answer)}') -> {fuzz_conf}")
+    given_processed = fuzz.utils.default_process(given_answer)
+    expected_processed = fuzz.utils.default_process(expected_answer)
+    fuzz_conf = fuzz.fuzz.partial_ratio(given_processed, expected_processed)
+    logging.debug("fuzz.fuzz.partial_ratio(%r, %r) -> %s", given_processed, expected_processed, fuzz_conf)
     if fuzz_conf >= 90.0:
         return True
     elif try_unidecode:
@@ -197,7 +184,8 @@ def check_similarity_of_answers(given_answer: str, expected_answer: str, try_uni
 
 
 def update_testset_answer(question: str, valid_score: bool, valid_score_probability: bool, min_no_funder_confidence: float,
-                            answer: dict, answerno: int, testsetitem: dict, funder: dict, add_context: bool) -> dict:
+                            answer: dict, answerno: int, testsetitem: dict, funder: FunderIndex, add_context: bool,
+                            predictions: dict) -> dict:
     """Create dictionary with result data
     
         testset_answer[f"{question}_{answerno}_COLUMN]"]\n
@@ -211,6 +199,7 @@ def update_testset_answer(question: str, valid_score: bool, valid_score_probabil
             context_confidence \n
             check\n
             found_funder_id\n
+            found_funder_doi\n
         
         testset_answer[f"{question}_{answerno}_check"] can contain one the following values:
             "match" -> item has funder and a matching funder was found by haystack\n
@@ -226,6 +215,7 @@ def update_testset_answer(question: str, valid_score: bool, valid_score_probabil
         answer (dict): the answer with information from haystack for an item
         answerno (int): the number of the answer to the question (first: 1 or second: 2)
         testsetitem (dict): the testset data of an item
+        predictions (dict): the context classifier predictions by answer context
 
     Returns:
         dict: [description]
@@ -243,22 +233,25 @@ def update_testset_answer(question: str, valid_score: bool, valid_score_probabil
         testset_answer[f"{prefix}_context_confidence"] = 0.0
         if not(is_open_access_funding(answer['answer'], answer['context'])):
             if testsetitem["keine Funder-Angabe im PDF"] is not None and testsetitem["keine Funder-Angabe im PDF"] != '':
-                testset_answer = check_testset_false_positive(testset_answer, prefix, answer, testsetitem, add_context, min_no_funder_confidence)
+                testset_answer = check_testset_false_positive(testset_answer, prefix, answer, testsetitem, add_context, min_no_funder_confidence, predictions)
             elif testsetitem["Funder-Phrase lt. PDF"] is not None and (
                     unidecode(testsetitem["Funder-Phrase lt. PDF"]).lower() in unidecode(answer['answer']).lower() or
                     unidecode(answer['answer']).lower() in unidecode(testsetitem["Funder-Phrase lt. PDF"]).lower() or
                     check_similarity_of_answers(answer['answer'], testsetitem["Funder-Phrase lt. PDF"])
                     ):
-                prediction = predict(answer['context'])
+                prediction = predictions[answer['context']]
                 testset_answer[f"{prefix}_context_prediction"] = prediction['intent']['value']
                 testset_answer[f"{prefix}_context_confidence"] = prediction['intent']['confidence']
                 if((prediction['intent']['value'] == 'no_funder') and (prediction['intent']['confidence'] > min_no_funder_confidence)):
                     testset_answer = check_testet_false_negative(testset_answer, prefix, testsetitem, add_context)
                 else:
                     testset_answer[f"{prefix}_check"] = 'match'
-                    testset_answer[f"{prefix}_found_funder_id"] = find_funder_from_list(answer['answer'], funder)
+                    with metrics.timer('funder_match'):
+                        match = find_funder_from_list(answer['answer'], funder)
+                    testset_answer[f"{prefix}_found_funder_id"] = format_funder_match(match)
+                    testset_answer[f"{prefix}_found_funder_doi"] = match.id if match is not None else ''
             else:
-                testset_answer = check_testset_false_positive(testset_answer, prefix, answer, testsetitem, add_context, min_no_funder_confidence)
+                testset_answer = check_testset_false_positive(testset_answer, prefix, answer, testsetitem, add_context, min_no_funder_confidence, predictions)
             if add_context:
                 testset_answer[f"{prefix}_context"] = answer['context']
     else:
@@ -272,8 +265,9 @@ def update_testset_answer(question: str, valid_score: bool, valid_score_probabil
     return testset_answer
 
 
-def check_testset_false_positive(testset_answer: dict, prefix: str, answer: dict, testsetitem: dict, add_context: bool, min_no_funder_confidence: float) -> dict:
-    prediction = predict(answer['context'])
+def check_testset_false_positive(testset_answer: dict, prefix: str, answer: dict, testsetitem: dict, add_context: bool, min_no_funder_confidence: float,
+                                    predictions: dict) -> dict:
+    prediction = predictions[answer['context']]
     testset_answer[f"{prefix}_context_prediction"] = prediction['intent']['value']
     testset_answer[f"{prefix}_context_confidence"] = prediction['intent']['confidence']
     if((prediction['intent']['value'] == 'no_funder') and (prediction['intent']['confidence'] > min_no_funder_confidence)):
@@ -281,6 +275,7 @@ def check_testset_false_positive(testset_answer: dict, prefix: str, answer: dict
     else:
         testset_answer[f"{prefix}_check"] = 'false positive'
         testset_answer[f"{prefix}_found_funder_id"] = ''
+        testset_answer[f"{prefix}_found_funder_doi"] = ''
     
     return testset_answer
 
@@ -289,9 +284,11 @@ def check_testet_false_negative(testset_answer: dict, prefix: str, testsetitem:
     if testsetitem["keine Funder-Angabe im PDF"] is None or testsetitem["keine Funder-Angabe im PDF"] == '':
         testset_answer[f"{prefix}_check"] = 'false negative'
         testset_answer[f"{prefix}_found_funder_id"] = ''
+        testset_answer[f"{prefix}_found_funder_doi"] = ''
     else:
         testset_answer[f"{prefix}_check"] = 'no funder'
         testset_answer[f"{prefix}_found_funder_id"] = ''
+        testset_answer[f"{prefix}_found_funder_doi"] = ''
     if add_context:
         testset_answer[f"{prefix}_context"] = ''
 
@@ -307,6 +304,221 @@ def is_open_access_funding(given_answer: str , given_answer_context: str) -> boo
         return False
 
 
+# settings and texts of process_answer_sets, set by main before the workers are forked
+processing = {}
+
+
+def load_answer_sets(texts: list) -> list:
+    """Read the answer sets of texts from the answer store (processing['answer_store_dir'])
+       or from the json answer files (processing['doc_dir_answers']).
+
+    Args:
+        texts (list): tuples of model, handle and text name
+
+    Returns:
+        list: tuples of model, handle and answers by question, in the order of texts
+    """
+
+    if processing['answer_store_dir']:
+        with metrics.timer('load_answers'):
+            return AnswerStore(processing['answer_store_dir']).read_texts(texts)
+
+    answer_sets = []
+    for modelname, _, text_name in texts:
+        answer_file_json = f"{text_name}_{modelname}.json"
+        try:
+            with metrics.timer('load_answers', answer_file_json):
+                answer_sets.append(read_answer_file(os.path.join(processing['doc_dir_answers'], answer_file_json)))
+        except Exception as e:
+            print("\nException :", e)
+
+    return answer_sets
+
+
+def process_answer_sets(start: int, end: int, n_process: int = None) -> list:
+    """Read, normalize, classify and match the answers of the texts start to end (processing['texts']).
+       The answers are only read here, so only the answers of the chunks in process are in memory.
+       The contexts of the answer sets are classified in one batch.
+
+    Args:
+        start (int): the first answer set
+        end (int): the end of the answer sets (exclusive)
+        n_process (int, optional): processes of the context classifier. Defaults to None (PREDICT_N_PROCESS).
+
+    Returns:
+        list: tuples of model, testset row (None if no testset item or merged into the row of an earlier
+              answer set of the model and handle) and valid answer rows per answer set
+    """
+
+    args = processing['args']
+    testset = processing['testset']
+    funder = processing['funder']
+    filter_questions = processing['filter_questions']
+    min_score = processing['min_score']
+    min_prob_score = processing['min_prob_score']
+    min_no_funder_confidence = processing['min_no_funder_confidence']
+    answer_sets = load_answer_sets(processing['texts'][start:end])
+
+    contexts = {}
+    for modelname, item_handle, answers_from_file in answer_sets:
+        classify = args.p or args.f or (args.t and item_handle in testset)
+        for question, answers in answers_from_file.items():
+            for answer in answers:
+                if question not in filter_questions:
+                    if answer['answer'] is not None:
+                        answer['answer'] = regex.sub(subpattern, " ", answer['answer'])
+                    if answer['context'] is not None:
+                        answer['context'] = regex.sub(subpattern, " ", answer['context'])
+                    if (classify and (answer['answer'] is not None) and
+                            ((answer['score'] >= min_score) or (answer['score']*answer['probability'] >= min_prob_score)) and
+                            not(is_open_access_funding(answer['answer'], answer['context']))):
+                        contexts[answer['context']] = None
+
+    print(f"classify {len(contexts)} answer contexts: {dt.datetime.now():%Y-%m-%d %H:%M:%S}")
+    with metrics.timer('classify'):
+        predictions = dict(zip(contexts, predict_batch(list(contexts), n_process=n_process)))
+    metrics.count('contexts', len(contexts))
+    if cache_info() is not None:
+        print(f"context prediction cache: {cache_info()}")
+
+    results = []
+    # the answer sets of a model and handle (answer files of the same text) are merged into one testset row,
+    # it is returned with the first of them
+    testset_answers = {}
+    for modelname, item_handle, answers_from_file in answer_sets:
+        testset_answer = None
+        merged = False
+        valid_answers = []
+        try:
+            if args.t and item_handle in testset:
+                if (modelname, item_handle) in testset_answers:
+                    testset_answer = testset_answers[(modelname, item_handle)]
+                    merged = True
+                else:
+                    testset_answer = dict(testset[item_handle])
+                    testset_answer['model'] = modelname
+                    testset_answers[(modelname, item_handle)] = testset_answer
+            for question, answers in answers_from_file.items():
+                answerno = 0
+                for answer in answers:
+                    if question not in filter_questions:
+                        answerno = answerno + 1
+                        valid_score = (answer['score'] >= min_score)
+                        valid_score_probability = (answer['score']*answer['probability'] >= min_prob_score)
+                        if testset_answer is not None:
+                            testset_answer.update(update_testset_answer(question, valid_score,
+                                                                        valid_score_probability, min_no_funder_confidence,
+                                                                        answer, answerno, testset[item_handle], funder, args.c,
+                                                                        predictions))
+                        if (answer['answer'] is not None) and (args.p or args.f) and (valid_score or valid_score_probability):
+                            if not(is_open_access_funding(answer['answer'], answer['context'])):
+                                prediction = predictions[answer['context']]
+                                if ((prediction['intent']['value'] == 'funder') or (prediction['intent']['confidence'] <= min_no_funder_confidence)):
+                                    valid_answer = {}
+                                    valid_answer['handle'] = item_handle
+                                    valid_answer['question'] = question
+                                    valid_answer['score_ge_12'] = valid_score
+                                    valid_answer['score_x_probability_ge_5'] = valid_score_probability
+                                    valid_answer["context_prediction"] = prediction['intent']['value']
+                                    valid_answer["context_confidence"] = prediction['intent']['confidence']
+                                    valid_answer['model'] = modelname
+                                    valid_answer.update(answer)
+                                    with metrics.timer('funder_match'):
+                                        match = find_funder_from_list(answer['answer'], funder)
+                                    valid_answer["found_funder_id"] = format_funder_match(match)
+                                    valid_answer["found_funder_doi"] = match.id if match is not None else ''
+                                    valid_answers.append(valid_answer)
+        except Exception as e:
+            print("\nException :", e)
+        results.append((modelname, None if merged else testset_answer, valid_answers))
+
+    return results
+
+
+def process_chunk(start: int, end: int, n_process: int = None) -> tuple:
+    """process_answer_sets with the stage durations and counts recorded instead of observed,
+       so the metrics of a worker process reach the parent (see metrics.Recorder)
+
+    Returns:
+        tuple: the result of process_answer_sets and the metrics.Recorder of the chunk
+    """
+
+    with metrics.recording() as recorder:
+        results = process_answer_sets(start, end, n_process)
+
+    return results, recorder
+
+
+# max. number of answer sets processed together, the rows of a chunk are kept until the chunk is written
+max_chunk_answer_sets = 500
+
+
+def group_answer_sets(texts: list) -> list:
+    """Put the texts of a model and handle next to each other (in the order of their first text),
+       e.g. those of the answer files 10419-123456_1_roberta.json and 10419-123456_2_roberta.json
+
+    Args:
+        texts (list): tuples of model, handle and text name
+
+    Returns:
+        list: the grouped texts
+    """
+
+    groups = {}
+    for text in texts:
+        groups.setdefault((text[0], text[1]), []).append(text)
+
+    return [text for group in groups.values() for text in group]
+
+
+def answer_set_chunks(texts: list, workers: int) -> list:
+    """Split the grouped texts (see group_answer_sets) into chunks (about 8 per worker, at most
+       max_chunk_answer_sets texts each). The texts of a model and handle stay in one chunk,
+       so process_answer_sets can merge their answer sets into one testset row.
+
+    Args:
+        texts (list): tuples of model, handle and text name
+        workers (int): the number of worker processes
+
+    Returns:
+        list: the start and end (exclusive) of every chunk
+    """
+
+    chunk_size = max(1, min(max_chunk_answer_sets, math.ceil(len(texts) / (workers * 8))))
+    chunks = []
+    start = 0
+    while start < len(texts):
+        end = min(start + chunk_size, len(texts))
+        while end < len(texts) and texts[end][:2] == texts[end - 1][:2]:
+            end += 1
+        chunks.append((start, end))
+        start = end
+
+    return chunks
+
+
+def process_chunks_in_order(executor: ProcessPoolExecutor, chunks: list, max_pending: int):
+    """Process the chunks in the worker processes of executor, at most max_pending chunks are submitted
+       and not yet returned, so the rows of finished chunks do not pile up ahead of the csv files
+
+    Args:
+        executor (ProcessPoolExecutor): the worker processes
+        chunks (list): the start and end of every chunk (see answer_set_chunks)
+        max_pending (int): max. number of submitted chunks
+
+    Yields:
+        tuple: the result of process_chunk per chunk, in the order of the chunks
+    """
+
+    pending = collections.deque()
+    for start, end in chunks:
+        pending.append(executor.submit(process_chunk, start, end, 1))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+
 sprint = functools.partial(print, end="")
 subpattern = regex.compile(r"\s+")
 
@@ -319,6 +531,7 @@ def main():
         config = yaml.safe_load(cfgin)
 
     logging.getLogger().setLevel(config['logging_level'])
+    metrics.setup('extract_answers_from_files', config)
 
     # min score for an answer to be accepted as valid
     min_score = 12.0
@@ -335,19 +548,24 @@ def main():
     # Path of the directory where the extracted answers in json files are stored
     doc_dir_answers = config['doc_dir_answers']
 
+    # Path of the answer store directory, read instead of the json files if set
+    answer_store_dir = config['answer_store']
+
     # Path of the excel tab csv-file with the human checked test data sets
     test_csv_file = config['test_csv_file']
 
     # Path of the excel tab csv-file with the complete crossref funderlist
     funder_csv_file = config['funder_csv_file']
 
+    # Path of the file the funder matching index built from funder_csv_file is stored in
+    funder_index_file = config['funder_index_file']
+
+    # Path of the memory-mapped funder registry file built from funder_csv_file
+    funder_registry_file = config['funder_registry_file']
+
     # blacklist to remove questions and their answers
     filter_questions = ['Has there been a grant by a funding agency?', 'Was some funding granted?']
     
-    valid_model_answers = {}
-    testset_model_answers = {}
-    all_valid_answers = []
-
     parser = argparse.ArgumentParser(description="extract_answers_from_files.py\n" +
                                     "Extracts the most likeliest answers from the json files for each model (roberta, electra, ...).\n" +
                                     "The questions and answers along with their score and probability are saved.\n")
@@ -371,6 +589,12 @@ def main():
                         help='use answers from DensePassageRetriever.',
                         dest='d',
                         action="store_true")
+    parser.add_argument('-w', '--workers',
+                        help='post-process the answers in N worker processes (default: 1).',
+                        metavar='N',
+                        dest='w',
+                        type=int,
+                        default=1)
     parser.add_argument('-?', help='print this help message', dest='h', action="store_true")
     args = parser.parse_args()
  
@@ -391,87 +615,92 @@ def main():
         out_dir_csv = config['doc_dir_csv_dpr']
         # Path of the directory where the extracted answers in json files are stored
         doc_dir_answers = config['doc_dir_answers_dpr']
+        answer_store_dir = config['answer_store_dpr']
 
     testset = load_testset_from_csv_file(test_csv_file)
-    funder = load_funder_from_csv_file(funder_csv_file)
+    with metrics.timer('funder_index'):
+        funder = load_funder_index(funder_csv_file, funder_index_file, funder_registry_file)
 
     print(f"start extraction: {dt.datetime.now():%Y-%m-%d %H:%M:%S}")
 
-    answer_files_json = os.listdir(doc_dir_answers)
-    for answer_file_json in answer_files_json:
-        try:
-            if answer_file_json.lower().endswith(f".json"):
-                with open(f"{doc_dir_answers}/{answer_file_json}", "r", encoding="utf-8") as answer_file:
-                    answers_from_file = json.load(answer_file)
-                modelname = get_modelname_from_filename(answer_file_json)
-                item_handle = get_handle_from_filename(answer_file_json)
-                if modelname not in valid_model_answers:
-                    valid_model_answers[modelname] = []
-                if modelname not in testset_model_answers:
-                    testset_model_answers[modelname] = {}
-                if item_handle in testset and item_handle not in testset_model_answers[modelname]:
-                    testset_model_answers[modelname][item_handle] = {}
-                    if testset[item_handle]["Funder-Phrase lt. PDF"] is not None:
-                        testset[item_handle]["Funder-Phrase lt. PDF"] = regex.sub(subpattern, " ", testset[item_handle]["Funder-Phrase lt. PDF"])
-                    testset_model_answers[modelname][item_handle].update(testset[item_handle])
-                    testset_model_answers[modelname][item_handle]['model'] = modelname
-                for question, answers in answers_from_file.items():
-                    answerno = 0
-                    for answer in answers:
-                        if question not in filter_questions:
-                            answerno = answerno + 1
-                            valid_score = (answer['score'] >= min_score)
-                            valid_score_probability = (answer['score']*answer['probability'] >= min_prob_score)
-                            if answer['answer'] is not None:
-                                answer['answer'] = regex.sub(subpattern, " ", answer['answer'])
-                            if answer['context'] is not None:
-                                answer['context'] = regex.sub(subpattern, " ", answer['context'])
-                            if args.t and item_handle in testset:
-                                testset_model_answers[modelname][item_handle].update(update_testset_answer(question, valid_score,
-                                                                            valid_score_probability, min_no_funder_confidence,
-                                                                            answer, answerno, testset[item_handle], funder, args.c))
-                            if (answer['answer'] is not None) and (args.p or args.f) and (valid_score or valid_score_probability):
-                                if not(is_open_access_funding(answer['answer'], answer['context'])):
-                                    prediction = predict(answer['context'])
-                                    if ((prediction['intent']['value'] == 'funder') or (prediction['intent']['confidence'] <= min_no_funder_confidence)):
-                                        valid_answer = {}
-                                        valid_answer['handle'] = item_handle
-                                        valid_answer['question'] = question
-                                        valid_answer['score_ge_12'] = valid_score
-                                        valid_answer['score_x_probability_ge_5'] = valid_score_probability
-                                        valid_answer["context_prediction"] = prediction['intent']['value']
-                                        valid_answer["context_confidence"] = prediction['intent']['confidence']
-                                        valid_answer['model'] = modelname
-                                        valid_answer.update(answer)
-                                        valid_answer[f"found_funder_id"] = find_funder_from_list(answer['answer'], funder)
-                                        valid_model_answers[modelname].append(valid_answer)
-                                        all_valid_answers.append(valid_answer)
-        except Exception as e:
-            print("\nException :", e)
-
-    if args.p:
-        for modelname in valid_model_answers:
-            if len(valid_model_answers[modelname]) > 0:
-                fieldnames = valid_model_answers[modelname][0].keys()
-                write_excel_tab_csv_file(filename=f"{out_dir_csv}/{modelname}_answers_{dt.datetime.now():%Y-%m-%d}.csv",
-                                            fieldnames=fieldnames, records=valid_model_answers[modelname])
-
-    if args.f and len(all_valid_answers) > 0:
-        fieldnames = all_valid_answers[0].keys()
-        write_excel_tab_csv_file(filename=f"{out_dir_csv}/all_answers_{dt.datetime.now():%Y-%m-%d}.csv",
-                                    fieldnames=fieldnames, records=all_valid_answers)
-
-    if args.t:
-        for modelname in testset_model_answers:
-            if len(testset_model_answers[modelname]) > 0:
-                model_items = testset_model_answers[modelname]
-                model_answers = list(model_items.values())
-                fieldnames = model_answers[0].keys()
-                print(f"Writing testset answers for model:'{modelname}' no. if items: {len(model_items)}")
-                write_excel_tab_csv_file(filename=f"{out_dir_csv}/{modelname}_testset_answers_{dt.datetime.now():%Y-%m-%d}.csv",
-                                            fieldnames=fieldnames, records=model_answers)
+    # only the names of the texts are listed here, the answers are read chunk by chunk (see process_answer_sets)
+    # without -p and -f only the answers of the testset items are needed
+    handles = None if (args.p or args.f) else list(testset)
+    if answer_store_dir:
+        texts = AnswerStore(answer_store_dir).texts(handles=handles)
+    else:
+        texts = [(modelname, handle_from_text_name(text_name), text_name)
+                    for text_name, modelname in map(answer_file_key, answer_file_names(doc_dir_answers))]
+        texts = [text for text in texts if handles is None or text[1] in testset]
+
+    metrics.count('answer_sets', len(texts))
+    texts = group_answer_sets(texts)
+
+    for item_handle in testset:
+        if testset[item_handle]["Funder-Phrase lt. PDF"] is not None:
+            testset[item_handle]["Funder-Phrase lt. PDF"] = regex.sub(subpattern, " ", testset[item_handle]["Funder-Phrase lt. PDF"])
+
+    # the declared columns of the testset files: testset columns, model and the columns of every question and answer
+    testset_columns = list(next(iter(testset.values())).keys()) if len(testset) > 0 else []
+    testset_answer_fieldnames = testset_fieldnames(testset_columns, [question for question in questions if question not in filter_questions],
+                                                    top_k_reader, args.c)
+
+    processing.update({'args': args, 'testset': testset, 'funder': funder, 'texts': texts,
+                        'answer_store_dir': answer_store_dir, 'doc_dir_answers': doc_dir_answers,
+                        'filter_questions': filter_questions, 'min_score': min_score, 'min_prob_score': min_prob_score,
+                        'min_no_funder_confidence': min_no_funder_confidence})
+
+    # the rows are written as they are produced, a file is created with its first row
+    date = f"{dt.datetime.now():%Y-%m-%d}"
+    all_answers_writer = ExcelTabCsvWriter(f"{out_dir_csv}/all_answers_{date}.csv", valid_answer_fieldnames) if args.f else None
+    model_answers_writers = {}
+    testset_answers_writers = {}
+    executor = None
+    try:
+        chunks = answer_set_chunks(texts, args.w)
+        if args.w > 1:
+            # forked workers share the texts, testset, funder index and context classifier of this process (read only),
+            # each reads the answers of its chunks and opens its own prediction cache. The chunks are returned in order, so the output
+            # is the same as without workers
+            print(f"process {len(texts)} answer sets in {len(chunks)} chunks with {args.w} workers")
+            load_context_classifier()
+            executor = ProcessPoolExecutor(max_workers=args.w, mp_context=multiprocessing.get_context('fork'))
+            chunk_results = process_chunks_in_order(executor, chunks, args.w * 2)
+        else:
+            chunk_results = (process_chunk(start, end) for start, end in chunks)
+
+        for results, recorder in chunk_results:
+            metrics.merge(recorder)
+            for modelname, testset_answer, valid_answers in results:
+                with metrics.timer('write_csv'):
+                    if args.p and len(valid_answers) > 0:
+                        if modelname not in model_answers_writers:
+                            model_answers_writers[modelname] = ExcelTabCsvWriter(f"{out_dir_csv}/{modelname}_answers_{date}.csv",
+                                                                                    valid_answer_fieldnames)
+                        for valid_answer in valid_answers:
+                            model_answers_writers[modelname].write(valid_answer)
+                    if args.f:
+                        for valid_answer in valid_answers:
+                            all_answers_writer.write(valid_answer)
+                    if testset_answer is not None:
+                        if modelname not in testset_answers_writers:
+                            testset_answers_writers[modelname] = ExcelTabCsvWriter(f"{out_dir_csv}/{modelname}_testset_answers_{date}.csv",
+                                                                                    testset_answer_fieldnames)
+                        testset_answers_writers[modelname].write(testset_answer)
+                metrics.count('valid_answers', len(valid_answers))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for writer in [all_answers_writer] + list(model_answers_writers.values()) + list(testset_answers_writers.values()):
+            if writer is not None:
+                writer.close()
+
+    for modelname, writer in testset_answers_writers.items():
+        if writer.rows > 0:
+            print(f"Written testset answers for model:'{modelname}' no. of items: {writer.rows}")
 
     print(f"finished extraction: {dt.datetime.now():%Y-%m-%d %H:%M:%S}")
+    metrics.finish()
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,16 @@
 #!/bin/env python
+import argparse
+import collections
 import csv
 import datetime as dt
+import functools
+import itertools
+import json
 import os
 import pycountry
 import logging
+import sys
+import xml.etree.ElementTree as ElementTree
 from typing import List
 import rdflib
 from rdflib import Graph, Literal, RDF, URIRef, plugins
@@ -12,6 +19,9 @@ from rdflib.namespace import SKOS
 from rdflib.namespace import Namespace
 from rdflib.plugins import sparql
 import yaml
+from funder_index import load_funder_index
+from funder_registry import FunderRegistry, csv_fingerprint
+from funder_update import funder_delta, patch_funder_rows, answer_csv_files, answers_to_reresolve, reresolve_fieldnames
 
 
 def search_for_label(graph: Graph, label: str, language: str = None) -> List[rdflib.query.ResultRow]:
@@ -40,46 +50,163 @@ def search_for_label(graph: Graph, label: str, language: str = None) -> List[rdf
     return results
 
 
-def return_all_pref_label(graph: Graph) -> List[rdflib.query.ResultRow]:
-    """[summary]
+def tag(namespace: Namespace, name: str) -> str:
+    """The tag of an element in ElementTree's Clark notation ({namespace}name)"""
+
+    return f"{{{namespace}}}{name}"
+
+
+def rdf_node(element, typed: bool = True) -> dict:
+    """Properties of a node element of an RDF/XML file (the description of a resource).
 
     Args:
-        graph (Graph): [description]
+        element (Element): the node element (e.g. skos:Concept, skosxl:Label or rdf:Description)
+        typed (bool, optional): the tag of the element is the rdf:type of the node, False for
+                                property elements with rdf:parseType="Resource". Defaults to True.
 
     Returns:
-        [type]: [description]
+        dict: the values by property (tag in Clark notation), strings for literals and resources,
+              dicts for nested nodes
     """
 
-    respref = graph.query(
-    """SELECT ?a ?label ?region ?country ?clink WHERE {
-            ?a skosxl:prefLabel/skosxl:literalForm ?label .
-            ?a svf:region ?region .
-            ?a schema:address/ schema:addressCountry ?country .
-            ?a svf:country ?clink .
-        }""")
+    node = {}
+    if element.get(RDF_NS + 'about') is not None:
+        node[RDF_NS + 'about'] = [element.get(RDF_NS + 'about')]
+    if typed and element.tag != RDF_NS + 'Description':
+        node[RDF_NS + 'type'] = [element.tag]
+    for attribute, value in element.attrib.items():
+        if not attribute.startswith((RDF_NS, XML_NS)):
+            node.setdefault(attribute, []).append(value)
+    for prop in element:
+        if prop.get(RDF_NS + 'resource') is not None:
+            value = prop.get(RDF_NS + 'resource')
+        elif prop.get(RDF_NS + 'parseType') == 'Resource':
+            value = rdf_node(prop, typed=False)
+        elif len(prop) > 0:
+            value = rdf_node(prop[0])
+        else:
+            value = prop.text or ''
+        values = node.setdefault(prop.tag, [])
+        # like in a graph, a statement is only kept once (nested nodes are the same if they have the same URI)
+        if value not in values or (isinstance(value, dict) and RDF_NS + 'about' not in value):
+            values.append(value)
+
+    return node
 
-    return respref
 
+def path_values(node: dict, path: list) -> list:
+    """The literals and resources at the end of a property path, like ?a prop1/prop2 ?value in SPARQL"""
 
-def return_all_alt_label(graph: Graph) -> List[rdflib.query.ResultRow]:
-    """[summary]
+    values = [node]
+    for prop in path:
+        values = [value for current in values if isinstance(current, dict) for value in current.get(prop, [])]
+
+    return [value for value in values if isinstance(value, str)]
+
+
+def concept_rows(about: str, node: dict, label_kind: str) -> list:
+    """The rows of the labels of a kind of a funder concept, one for every combination of
+       label, region, country code and country link (like the former SPARQL queries).
 
     Args:
-        graph (Graph): [description]
+        about (str): the URI of the concept
+        node (dict): the properties of the concept (see rdf_node)
+        label_kind (str): 'prefLabel' or 'altLabel'
 
     Returns:
-        [type]: [description]
+        list: tuples (concept, label, region, country code, country link)
     """
 
-    respref = graph.query(
-    """SELECT ?a ?label ?region ?country ?clink WHERE {
-            ?a skosxl:altLabel/skosxl:literalForm ?label .
-            ?a svf:region ?region .
-            ?a schema:address/ schema:addressCountry ?country .
-            ?a svf:country ?clink .
-        }""")
+    return [(about, *values) for values in itertools.product(path_values(node, [tag(SKOSXL, label_kind), tag(SKOSXL, 'literalForm')]),
+                                                                path_values(node, [tag(SVF, 'region')]),
+                                                                path_values(node, [tag(SCHEMA, 'address'), tag(SCHEMA, 'addressCountry')]),
+                                                                path_values(node, [tag(SVF, 'country')]))]
+
+
+def resolve_labels(node: dict, label_forms: dict) -> tuple:
+    """Replace the references of a concept to top level skosxl:Label nodes (prefLabel or altLabel
+       with rdf:resource) by nested labels with their literal forms.
+
+    Args:
+        node (dict): the properties of the concept (see rdf_node)
+        label_forms (dict): the literal forms of the top level labels by URI
+
+    Returns:
+        tuple: the properties with the resolved labels and the references not (yet) resolved
+    """
+
+    resolved = dict(node)
+    unresolved = []
+    for label_kind in ['prefLabel', 'altLabel']:
+        values = []
+        for value in node.get(tag(SKOSXL, label_kind), []):
+            if isinstance(value, str) and value in label_forms:
+                value = {tag(SKOSXL, 'literalForm'): label_forms[value]}
+            elif isinstance(value, str):
+                unresolved.append(value)
+            values.append(value)
+        if len(values) > 0:
+            resolved[tag(SKOSXL, label_kind)] = values
+
+    return resolved, unresolved
 
-    return respref
+
+def funder_rows(about: str, node: dict):
+    """Yields True for a preflabel, False for an altlabel and the row (see concept_rows) of every label of a concept"""
+
+    for is_pref, label_kind in [(True, 'prefLabel'), (False, 'altLabel')]:
+        for row in concept_rows(about, node, label_kind):
+            yield is_pref, row
+
+
+def read_funder_rows(rdf_file: str):
+    """Stream the label rows of the funders from the crossref funder registry (RDF/XML).
+       The file is parsed incrementally, one top level description after the other,
+       instead of loading the complete graph. Only the literal forms of top level skosxl:Label
+       nodes are kept, for the concepts referring to them. A concept referring to a label
+       described later in the file is resolved after the whole file is read.
+
+    Args:
+        rdf_file (str): the crossref funder registry rdf-file
+
+    Yields:
+        tuple: True for a preflabel, False for an altlabel and the row (see concept_rows)
+    """
+
+    label_forms = {}
+    pending = []
+    depth = 0
+    root = None
+    for event, element in ElementTree.iterparse(rdf_file, events=('start', 'end')):
+        if event == 'start':
+            if depth == 0:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            about = element.get(RDF_NS + 'about')
+            if about is not None:
+                node = rdf_node(element)
+                if tag(SKOSXL, 'literalForm') in node:
+                    label_forms[about] = [value for value in node[tag(SKOSXL, 'literalForm')] if isinstance(value, str)]
+                node, unresolved = resolve_labels(node, label_forms)
+                if len(unresolved) > 0:
+                    pending.append((about, node))
+                else:
+                    yield from funder_rows(about, node)
+            # the processed descriptions aren't needed anymore
+            root.clear()
+
+    unresolved_count = 0
+    for about, node in pending:
+        node, unresolved = resolve_labels(node, label_forms)
+        if len(unresolved) > 0:
+            logging.warning(f"unresolved label references of {about}: {unresolved}")
+            unresolved_count += len(unresolved)
+        yield from funder_rows(about, node)
+    if unresolved_count > 0:
+        print(f"{unresolved_count} label references could not be resolved (see log)")
 
 
 def write_excel_tab_csv_file(filename: str, fieldnames: list, records: list) -> None:
@@ -91,11 +218,13 @@ def write_excel_tab_csv_file(filename: str, fieldnames: list, records: list) ->
         records (list): The rows of data to save in the file
     """
 
-    with open(filename, 'w', newline='', encoding='utf-8') as csvoutfile:
+    # the previous file stays complete until the new one is written
+    with open(f"{filename}.tmp", 'w', newline='', encoding='utf-8') as csvoutfile:
         csvwriter = csv.DictWriter(csvoutfile, fieldnames=fieldnames, dialect='excel-tab')
         csvwriter.writeheader()
         for record in records:
             csvwriter.writerow(record)
+    os.replace(f"{filename}.tmp", filename)
 
 
 def canonical_funder_id(doi: str) -> str:
@@ -118,6 +247,16 @@ def canonical_funder_id(doi: str) -> str:
     return doi
 
 
+@functools.lru_cache(maxsize=None)
+def country_name(code: str) -> str:
+    """The name of a country by its ISO 3166-1 alpha-3 code, None if there is no such country.
+       Cached, the rows of the registry share a few hundred codes.
+    """
+
+    country = pycountry.countries.get(alpha_3=code.upper())
+    return country.name if country else None
+
+
 def map_row(is_pref: bool, row: list) -> dict:
     """[summary]
 
@@ -129,14 +268,14 @@ def map_row(is_pref: bool, row: list) -> dict:
         dict: [description]
     """
 
-    country = pycountry.countries.get(alpha_3=row[3].upper())
+    country = country_name(row[3])
     funder = {}
     funder['ispref'] = is_pref
     funder['id'] = canonical_funder_id(row[0])
     if country:
-        logging.debug(f"{row[3]}: {country.name}")
-        #funder['name'] = f"{row[1]} ({row[2]}, {country.name})" # Funder Name (Region, Country)
-        funder['name'] = f"{row[1]} ({country.name})" # Name (Country)
+        logging.debug("%s: %s", row[3], country)
+        #funder['name'] = f"{row[1]} ({row[2]}, {country})" # Funder Name (Region, Country)
+        funder['name'] = f"{row[1]} ({country})" # Name (Country)
     else:
         logging.warning(f"No country in ISO 3166-1 alpha-3 for code: {row[3]}")
         #funder['name'] = f"{row[1]} ({row[2]}, {row[3]})" # Name (Region, Country Code)
@@ -151,6 +290,8 @@ def map_row(is_pref: bool, row: list) -> dict:
 SKOSXL = Namespace("http://www.w3.org/2008/05/skos-xl#")
 SVF = Namespace("http://data.crossref.org/fundingdata/xml/schema/grant/grant-1.2/")
 SCHEMA = Namespace("http://schema.org/")
+RDF_NS = tag(RDF, '')
+XML_NS = "{http://www.w3.org/XML/1998/namespace}"
 
 
 def main():
@@ -162,25 +303,81 @@ def main():
 
     logging.getLogger().setLevel(config['logging_level'])
 
+    parser = argparse.ArgumentParser(description="extract_funders_from_rdf.py\n" +
+                                    "Build the flat excel tab csv file of the funder labels from the crossref funder registry rdf-file.\n")
     # filename and path of crossref funder registry rdf-file (v1.32)
     # https://gitlab.com/crossref/open_funder_registry
-    rdf_funder_registry = './rdf-funder/registry.rdf'    
-
-    g = Graph()
-    g.parse(rdf_funder_registry)
-
-    respref = return_all_pref_label(g)
-
-    resalt = return_all_alt_label(g)
+    parser.add_argument('-i', '--input',
+                        help='the crossref funder registry rdf-file (default: ./rdf-funder/registry.rdf).',
+                        metavar='RDF',
+                        dest='i',
+                        default='./rdf-funder/registry.rdf')
+    parser.add_argument('-o', '--output',
+                        help='the csv file (default: funder_csv_file in config.yaml).',
+                        metavar='CSV',
+                        dest='o')
+    parser.add_argument('-r', '--registry',
+                        help='also write the funder registry file (funder_registry_file in config.yaml) for the csv file.',
+                        dest='r',
+                        action="store_true")
+    parser.add_argument('-u', '--update',
+                        help='update the csv file of the previous build, the funder registry and the funder index with the changes ' +
+                             'of the rdf-file instead of rebuilding them, write the changes by funder to this json file.',
+                        metavar='DELTA',
+                        dest='u')
+    parser.add_argument('-a', '--answers',
+                        help='with -u, list the answers of this answer csv file (or of the csv files of this directory) ' +
+                             'whose funder match can change in DELTA_reresolve.csv, can be repeated.',
+                        metavar='CSV',
+                        dest='a',
+                        action='append')
+    parser.add_argument('-?', help='print this help message', dest='h', action="store_true")
+    args = parser.parse_args()
+
+    if args.h:
+        parser.print_help()
+        sys.exit(0)
+
+    funder_csv_file = args.o if args.o else config['funder_csv_file']
 
     record_labels = ['ispref', 'id', 'name']
-    complete_funder_label_list = []
-
-    complete_funder_label_list = list(map(lambda row: map_row(True, row), respref))
-
-    complete_funder_label_list.extend(list(map(lambda row: map_row(False, row), resalt)))
+    complete_funder_label_list = (map_row(is_pref, row) for is_pref, row in read_funder_rows(args.i))
+    if args.r or args.u:
+        # the rows are also needed for the registry, they are small compared to the rdf-file
+        complete_funder_label_list = [dict(record, ispref=str(record['ispref'])) for record in complete_funder_label_list]
+
+    if args.u:
+        with open(funder_csv_file, 'r', newline='', encoding='utf-8') as csvinfile:
+            previous_funder_label_list = list(csv.DictReader(csvinfile, dialect='excel-tab'))
+        # the index of the previous build is patched
+        funder_index = load_funder_index(funder_csv_file, config['funder_index_file'], config['funder_registry_file'])
+        delta = funder_delta(previous_funder_label_list, complete_funder_label_list)
+        complete_funder_label_list = patch_funder_rows(previous_funder_label_list, complete_funder_label_list)
+
+    write_excel_tab_csv_file(funder_csv_file, fieldnames=record_labels, records=complete_funder_label_list)
+
+    if args.r or args.u:
+        # the registry is built for this csv file, so load_funder_registry doesn't rebuild it
+        registry = FunderRegistry.from_rows(complete_funder_label_list, csv_fingerprint(funder_csv_file))
+        registry.dump(config['funder_registry_file'])
+        print(f"funder registry with {len(registry)} funders written to: {config['funder_registry_file']}")
+
+    if args.u:
+        changes = funder_index.update(FunderRegistry.load(config['funder_registry_file']))
+        funder_index.dump(config['funder_index_file'])
+        print(f"funder index updated: {changes}")
+
+        with open(args.u, 'w', encoding='utf-8') as delta_file:
+            json.dump(delta, delta_file, ensure_ascii=False, indent=4)
+        statuses = collections.Counter(change['status'] for change in delta.values())
+        print(f"funders added: {statuses['added']}, removed: {statuses['removed']}, changed: {statuses['changed']}, written to: {args.u}")
+
+        if args.a:
+            reresolve_file = f"{os.path.splitext(args.u)[0]}_reresolve.csv"
+            answers = list(answers_to_reresolve(answer_csv_files(args.a), delta))
+            write_excel_tab_csv_file(reresolve_file, fieldnames=reresolve_fieldnames, records=answers)
+            print(f"{len(answers)} answers to resolve again written to: {reresolve_file}")
 
-    write_excel_tab_csv_file("complete_funder_list.csv", fieldnames=record_labels, records=complete_funder_label_list)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
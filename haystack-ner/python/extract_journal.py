@@ -0,0 +1,56 @@
+#!/bin/env python
+import datetime as dt
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+def question_set_hash(questions: list) -> str:
+    """Short sha1 hex digest identifying a list of questions"""
+
+    return hashlib.sha1('\n'.join(questions).encode('utf-8')).hexdigest()[:16]
+
+
+class ExtractJournal:
+    """Journal of the units extracted by extract_top_hits.py (sqlite).
+
+    A unit is a text, model and question set written to an output (answers directory or answer store).
+    A unit is recorded after its answers have been written completely, so a restarted
+    run can skip the recorded units without reading the answers again.
+    """
+
+    def __init__(self, filename: str):
+        self.run = f"{dt.datetime.now():%Y-%m-%d %H:%M:%S} {os.getpid()}"
+        self.lock = threading.Lock()
+        # the model worker processes of a run share the journal
+        self.db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS units '
+                        '(output TEXT, model TEXT, question_set TEXT, text_name TEXT, run TEXT, updated TEXT, '
+                        'PRIMARY KEY (output, model, question_set, text_name))')
+        self.db.commit()
+
+    def completed(self, output: str, model: str, question_set: str) -> set:
+        """Returns the names of the texts recorded for an output, model and question set"""
+
+        with self.lock:
+            rows = self.db.execute('SELECT text_name FROM units WHERE output = ? AND model = ? AND question_set = ?',
+                                    (output, model, question_set)).fetchall()
+        return set(row[0] for row in rows)
+
+    def complete(self, output: str, model: str, question_set: str, text_names: list) -> None:
+        """Record the units of texts whose answers have been written"""
+
+        now = f"{dt.datetime.now():%Y-%m-%d %H:%M:%S}"
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?)',
+                                [(output, model, question_set, text_name, self.run, now) for text_name in text_names])
+            self.db.commit()
+
+    def info(self) -> dict:
+        """Returns the number of recorded units by output and model"""
+
+        with self.lock:
+            rows = self.db.execute('SELECT output, model, COUNT(*) FROM units GROUP BY output, model').fetchall()
+        return {f"{output} {model}": count for output, model, count in rows}
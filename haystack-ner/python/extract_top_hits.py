@@ -1,18 +1,33 @@
 #!/bin/env python
 import argparse
+import collections
+import copy
 import functools
+import hashlib
 import logging
+import multiprocessing
 import os
 import json
+import signal
 import yaml
 import sys
+import torch
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from haystack.reader.farm import FARMReader
 from haystack.reader.transformers import TransformersReader
 from haystack.utils import print_answers
 from haystack.retriever.sparse import ElasticsearchRetriever
 from haystack.retriever.dense import DensePassageRetriever
-from haystack.pipeline import ExtractiveQAPipeline
 from haystack.document_store.elasticsearch import ElasticsearchDocumentStore
+from retrieval_cache import RetrievalCache, CachedRetriever
+from split_store import SplitStore, SplitStoreRetriever
+from funding_cues import prefilter_passages, no_answer_results
+from reader_backend import READER_BACKENDS, load_reader
+from funder_questions import questions, top_k_reader
+from answer_store import AnswerStore
+from ingest_manifest import IngestManifest
+from extract_journal import ExtractJournal, question_set_hash
+import metrics
 
 
 def extract_relevant_data_from_answer(prediction_answer: dict) -> dict:
@@ -38,53 +53,237 @@ def extract_relevant_data_from_answer(prediction_answer: dict) -> dict:
     
     return result
 
-sprint = functools.partial(print, end="")
+# FARMReader.predict_batch expects label-like objects with the question text as attribute
+ReaderQuery = collections.namedtuple('ReaderQuery', ['question'])
 
-# store haystack log output in logfile
-logging.basicConfig(filename='extract_top_hits.log', format='%(asctime)s %(message)s', level=logging.INFO)
 
-def main():
+def retrieve_passages(retriever, text_name: str, questions: list, top_k_retriever: int = 10, sections: list = None) -> dict:
+    """Retrieve the candidate passages of one document for every question.
 
-    parser = argparse.ArgumentParser(description="extract_top_hits.py\n" +
-                                    "Extract top 2 Answers for all supported moddels and questions for all PDF files.\n" +
-                                    "Iterate over PDF filenames in doc_dir_pdf to extract item handles for retrieval.\n"+
-                                    "You can also use a DensePassageRetriever if you have done the preprocessing in load_docs_into_elasticsearch_split_pdf_lang.py.\n")
-    parser.add_argument('-d', '--DPR',
-                        help='use DensePassageRetriever for retrieval.',
-                        dest='d',
-                        action="store_true")
-    parser.add_argument('-?', help='print this help message', dest='h', action="store_true")
-    args = parser.parse_args()
- 
-    if args.h:
-        parser.print_help()
-        sys.exit(0)
+    Args:
+        retriever: ElasticsearchRetriever or DensePassageRetriever
+        text_name (str): name of the document (filter on the 'name' meta field)
+        questions (list): the questions
+        top_k_retriever (int, optional): number of passages per question. Defaults to 10.
+        sections (list, optional): retrieve only splits of these sections (filter on the 'section' meta field). Defaults to None (all).
 
-    if args.d:
-        print('Use DensePassageRetriever!')
+    Returns:
+        dict: list of retrieved documents by question
+    """
 
-    with open('config.yaml', 'r') as cfgin:
-            config = yaml.safe_load(cfgin)
+    filters = {'name': [text_name]}
+    if sections is not None:
+        filters['section'] = sections
+    return {question: retriever.retrieve(query=question, filters=filters, top_k=top_k_retriever)
+                for question in questions}
 
-    use_gpu = config['use_gpu']
-    es = config['elastic']
 
-    if args.d:
-        document_store = ElasticsearchDocumentStore(host=es['host'], port=es['port'], username=es['username'], password=es['password'], index=es['dprindex'])
+def retrieve_text_passages(retriever, text_name: str, questions: list, funding_sections: bool = False,
+                            top_k_retriever: int = 10, funding_splits: int = None) -> dict:
+    """Retrieve the candidate passages of one document, from its funding splits if requested, else from its body splits
+       (the funding splits repeat the text of body splits).
+
+    Args:
+        retriever: ElasticsearchRetriever or DensePassageRetriever
+        text_name (str): name of the document
+        questions (list): the questions
+        funding_sections (bool, optional): retrieve from the funding splits (see load_docs_into_elasticsearch_split_pdf_lang.py),
+                                           else from the body splits. From all splits if the document has none of these
+                                           (e.g. ingested without funding_sections). Defaults to False.
+        top_k_retriever (int, optional): number of passages per question. Defaults to 10.
+        funding_splits (int, optional): number of funding splits of the document recorded in the ingest manifest,
+                                        -1 if ingested without funding_sections (see ingested_funding_splits).
+                                        Defaults to None (unknown, the sections are tried one after another).
+
+    Returns:
+        dict: list of retrieved documents by question
+    """
+
+    if funding_splits is not None:
+        # the splits to retrieve from are known, a single request per question
+        if funding_sections and funding_splits > 0:
+            return retrieve_passages(retriever, text_name, questions, top_k_retriever, sections=['funding'])
+        if not funding_sections and funding_splits >= 0:
+            return retrieve_passages(retriever, text_name, questions, top_k_retriever, sections=['body'])
+        return retrieve_passages(retriever, text_name, questions, top_k_retriever)
+
+    passages = retrieve_passages(retriever, text_name, questions, top_k_retriever, sections=['funding' if funding_sections else 'body'])
+    if any(len(documents) > 0 for documents in passages.values()):
+        return passages
+    return retrieve_passages(retriever, text_name, questions, top_k_retriever)
+
+
+def ingested_funding_splits(config: dict, args) -> dict:
+    """The number of funding splits by text name recorded in the ingest manifest of the index
+       the passages are retrieved from (empty without a manifest)
+
+    Args:
+        config (dict): the configuration (config.yaml)
+        args: the command line arguments
+
+    Returns:
+        dict: number of funding splits (-1 if ingested without funding_sections) by text name
+    """
+
+    if not config['ingest_manifest'] or not os.path.exists(config['ingest_manifest']):
+        return {}
+    index = config['elastic']['dprindex'] if args.d else config['elastic']['index']
+    return IngestManifest(config['ingest_manifest'], index).funding_splits()
+
+
+def predict_answers_batched(reader: FARMReader, passages_by_text: dict, top_k_reader: int = 2, batch_size: int = 64) -> dict:
+    """Score all question x passage pairs of several documents in one reader pass.
+       The answers are the same as those of ExtractiveQAPipeline.run for each question and document.
+
+    Args:
+        reader (FARMReader): the reader
+        passages_by_text (dict): retrieved passages by question by document name (see retrieve_passages)
+        top_k_reader (int, optional): number of answers per question. Defaults to 2.
+        batch_size (int, optional): number of samples the model receives in one inference batch. Defaults to 64.
+
+    Returns:
+        dict: results (relevant answer data by question) by document name
+    """
+
+    query_doc_list = []
+    keys = []
+    results = {}
+    for text_name, passages in passages_by_text.items():
+        results[text_name] = {}
+        for question, documents in passages.items():
+            # like the pipeline, a question without passages has no answers
+            results[text_name][question] = []
+            if len(documents) > 0:
+                query_doc_list.append({'question': ReaderQuery(question), 'docs': documents})
+                keys.append((text_name, question))
+
+    if len(query_doc_list) == 0:
+        return results
+
+    predictions = reader.predict_batch(query_doc_list, top_k=top_k_reader, batch_size=batch_size)
+    for (text_name, question), query_docs, prediction in zip(keys, query_doc_list, predictions):
+        # add the meta data of the passage as BaseReader.run does
+        meta_by_id = {doc.id: doc.meta for doc in query_docs['docs']}
+        for answer in prediction['answers']:
+            answer['meta'] = copy.deepcopy(meta_by_id.get(answer['document_id'], {}))
+        results[text_name][question] = list(map(extract_relevant_data_from_answer, prediction['answers']))
+
+    return results
+
+
+def answers_filename(doc_dir_answers: str, text_name: str, model_name: str) -> str:
+    return doc_dir_answers +'/'+text_name+'_'+model_name+'.json'
+
+
+def answers_file_valid(filename: str, questions: list) -> bool:
+    """Check if an answers file exists and contains the answers to all questions.
+
+    Args:
+        filename (str): the json file with the answers of a text and model
+        questions (list): the questions
+
+    Returns:
+        bool: True if the file is complete
+    """
+
+    try:
+        with open(filename, 'r', encoding="utf-8") as json_file:
+            results = json.load(json_file)
+        return isinstance(results, dict) and all(isinstance(results.get(question), list) for question in questions)
+    except (OSError, ValueError):
+        return False
+
+
+def answers_output(doc_dir_answers: str, answer_store: AnswerStore = None) -> str:
+    """The output the answers are written to, the answer store or the answers directory"""
+
+    return answer_store.directory if answer_store is not None else doc_dir_answers
+
+
+def write_answers(doc_dir_answers: str, text_name: str, model_name: str, results: dict, answer_store: AnswerStore = None,
+                    journal: ExtractJournal = None, question_set: str = '') -> None:
+    """Write the answers of a text and record the written units in the journal.
+       A json file is written to a temporary file first and renamed, so it is complete or missing.
+
+    Args:
+        doc_dir_answers (str): the directory of the json answer files
+        text_name (str): name of the text
+        model_name (str): short name of the model
+        results (dict): relevant answer data by question
+        answer_store (AnswerStore, optional): write to the answer store instead of a json file. Defaults to None.
+        journal (ExtractJournal, optional): the journal of the run. Defaults to None.
+        question_set (str, optional): hash of the questions (see question_set_hash). Defaults to ''.
+    """
+
+    written = []
+    if answer_store is not None:
+        # buffered, the texts are written to a part file together
+        with metrics.timer('write', text_name):
+            written = answer_store.add(model_name, text_name, results)
     else:
-        document_store = ElasticsearchDocumentStore(host=es['host'], port=es['port'], username=es['username'], password=es['password'], index=es['index'])
+        filename = answers_filename(doc_dir_answers, text_name, model_name)
+        try:
+            with metrics.timer('write', text_name), open(filename + '.tmp', 'w', encoding="utf-8") as json_file:
+                json.dump(results, json_file, ensure_ascii=False, indent=4)
+            os.replace(filename + '.tmp', filename)
+            written = [text_name]
+        except Exception as e:
+            print("\nException writing file!", e)
+    if journal is not None and len(written) > 0:
+        journal.complete(answers_output(doc_dir_answers, answer_store), model_name, question_set, written)
 
 
-    # Path of the directory where the extracted source TXT files are stored in
-    #doc_dir_txt = config['doc_dir_txt']
+def exit_on_sigterm() -> None:
+    """Exit on SIGTERM (e.g. preemption) like on Ctrl-C, so the buffered answers are written"""
 
-    # Path of the directory where the source PDF files are stored in
-    doc_dir_pdf = config['doc_dir_pdf']
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
 
-    # Path of the directory where the DSpace json files with the metadata of the source PDF/TXT files are stored in
-    #doc_dir_json = config['doc_dir_json']
 
-    if args.d:
+def parse_shard(shard: str) -> tuple:
+    """Parse a shard specification 'i/N' (0 <= i < N)"""
+
+    try:
+        shard, shards = (int(part) for part in shard.split('/'))
+    except ValueError:
+        raise ValueError(f"invalid shard '{shard}', expected i/N")
+    if not 0 <= shard < shards:
+        raise ValueError(f"invalid shard '{shard}/{shards}', expected 0 <= i < N")
+    return shard, shards
+
+
+def shard_of(text_name: str, shards: int) -> int:
+    """The shard of a text, the same on every host (md5 of the name, not the salted hash())"""
+
+    return int(hashlib.md5(text_name.encode('utf-8')).hexdigest(), 16) % shards
+
+
+def create_retriever(config: dict, args) -> tuple:
+    """Create the retriever selected by the command line arguments.
+
+    Args:
+        config (dict): the configuration (config.yaml)
+        args: the command line arguments
+
+    Returns:
+        tuple: the retriever, the directory to store the answers in and the retrieval cache (or None)
+    """
+
+    use_gpu = config['use_gpu']
+    es = config['elastic']
+
+    if args.o:
+        document_store = None
+    elif args.d:
+        document_store = ElasticsearchDocumentStore(host=es['host'], port=es['port'], username=es['username'], password=es['password'], index=es['dprindex'])
+    else:
+        document_store = ElasticsearchDocumentStore(host=es['host'], port=es['port'], username=es['username'], password=es['password'], index=es['index'])
+
+    if args.o:
+        print('use BM25 on the split store')
+        el_retriever = SplitStoreRetriever(SplitStore(config['split_store']), es['index'])
+        # Path of the directory where to store json files with extracted answers in
+        doc_dir_answers = config['doc_dir_answers']
+    elif args.d:
         print('use DensePsssageRetriever')
         el_retriever = DensePassageRetriever(document_store=document_store,
                                     query_embedding_model="facebook/dpr-question_encoder-single-nq-base",
@@ -103,41 +302,286 @@ def main():
         # Path of the directory where to store json files with extracted answers in
         doc_dir_answers = config['doc_dir_answers']
 
+    # the retrieved passages of a document and question are the same for all models
+    if config['retrieval_cache'] and not args.o:
+        retrieval_cache = RetrievalCache(config['retrieval_cache'])
+        el_retriever = CachedRetriever(el_retriever, retrieval_cache)
+    else:
+        retrieval_cache = None
 
-    models = [('roberta', 'deepset/roberta-base-squad2'),
-                ('xlm-roberta', 'deepset/xlm-roberta-large-squad2'),
-                ('electra', 'deepset/electra-base-squad2'),
-                ('mfeb-albert-xxl-v2', 'mfeb/albert-xxlarge-v2-squad2'),
-                ('minilm-uncased', 'deepset/minilm-uncased-squad2')]
+    return el_retriever, doc_dir_answers, retrieval_cache
 
-    questions = ['Who funded the article?', 'Who funded the work?', 'Who gives financial support?',
-                    'By whom was the study funded?', 'Whose financial support do you acknowledge?',
-                    'Who provided funding?', 'Who provided financial support?',
-                    'By which grant was this research supported?']
 
-    for model_name, model in models:
-        print(f'Load model: {model_name}, {model}')
-        reader = FARMReader(model_name_or_path=model, use_gpu=use_gpu, no_ans_boost=1, return_no_answer=True)
-        pipe = ExtractiveQAPipeline(reader, el_retriever)
-        pdf_files = os.listdir(doc_dir_pdf)
-        for pdf_file in pdf_files:
-            try:
-                if pdf_file.lower().endswith(".pdf"):
-                    text_name=pdf_file[:-4]
+def extract_model_answers(model_name: str, model: str, text_names: list, questions: list, config: dict, args, threads: int = None) -> int:
+    """Extract the top answers of one model for all texts and write them to json files.
+       Texts with a valid answers file of the model are skipped (unless --overwrite).
+
+    Args:
+        model_name (str): short name of the model used in the file names
+        model (str): name or path of the model
+        text_names (list): names of the texts
+        questions (list): the questions
+        config (dict): the configuration (config.yaml)
+        args: the command line arguments
+        threads (int, optional): number of intra-op threads of torch. Defaults to None (torch default).
+
+    Returns:
+        int: the number of texts answers were extracted for
+    """
+
+    if args.m > 1:
+        # every model worker process exports its own metrics
+        metrics.setup('extract_top_hits', config, instance=model_name)
+        exit_on_sigterm()
+    if threads is not None:
+        torch.set_num_threads(threads)
+    el_retriever, doc_dir_answers, retrieval_cache = create_retriever(config, args)
+    funding_splits = ingested_funding_splits(config, args)
+    answer_store_dir = config['answer_store_dpr'] if args.d else config['answer_store']
+    answer_store = AnswerStore(answer_store_dir) if answer_store_dir else None
+    journal = ExtractJournal(config['extract_journal']) if config['extract_journal'] else None
+    question_set = question_set_hash(questions)
+    output = answers_output(doc_dir_answers, answer_store)
+
+    if not args.r:
+        total = len(text_names)
+        # units in the journal are complete, the other texts are checked in the output
+        done = journal.completed(output, model_name, question_set) if journal is not None else set()
+        pending = [text_name for text_name in text_names if text_name not in done]
+        if answer_store is not None:
+            complete = answer_store.complete_texts(model_name, questions) if len(pending) > 0 else set()
+            valid = [text_name for text_name in pending if text_name in complete]
+        else:
+            valid = [text_name for text_name in pending
+                        if answers_file_valid(answers_filename(doc_dir_answers, text_name, model_name), questions)]
+        if journal is not None and len(valid) > 0:
+            # answers written before the journal was used
+            journal.complete(output, model_name, question_set, valid)
+        valid = set(valid)
+        text_names = [text_name for text_name in pending if text_name not in valid]
+        print(f'Model {model_name}: skip {total - len(text_names)} texts with answers')
+    if len(text_names) == 0:
+        if args.m > 1:
+            metrics.finish()
+        return 0
+
+    backend = args.e if args.e is not None else config['reader_backend']
+    print(f'Load model: {model_name}, {model} ({backend})')
+    reader_args = {'no_ans_boost': 1, 'return_no_answer': True}
+    if threads is not None:
+        # the threads are pinned, don't start a pool of preprocessing processes on top
+        reader_args['num_processes'] = 0
+    reader = load_reader(model, backend, use_gpu=config['use_gpu'], models_cache=config['models_cache'], **reader_args)
+
+    try:
+        if args.b:
+            for start in range(0, len(text_names), args.n):
+                passages_by_text = {}
+                for text_name in text_names[start:start+args.n]:
+                    try:
+                        print(f'Retrieve passages for text: {text_name}')
+                        with metrics.timer('retrieve', text_name):
+                            passages = retrieve_text_passages(el_retriever, text_name, questions, args.g, top_k_retriever=10,
+                                                              funding_splits=funding_splits.get(text_name))
+                        if args.p:
+                            passages, has_cues = prefilter_passages(passages, fallback=args.k)
+                            if not has_cues:
+                                print(f'No funding cues in text: {text_name}')
+                                metrics.count('no_cue_texts')
+                                write_answers(doc_dir_answers, text_name, model_name, no_answer_results(passages), answer_store, journal, question_set)
+                                continue
+                        passages_by_text[text_name] = passages
+                    except Exception as e:
+                        print("\nException ", e)
+                try:
+                    print(f'Predict answers for {len(passages_by_text)} texts')
+                    with metrics.timer('read_batch'):
+                        results_by_text = predict_answers_batched(reader, passages_by_text, top_k_reader=top_k_reader, batch_size=args.s)
+                except Exception as e:
+                    print("\nException ", e)
+                    continue
+                for text_name, results in results_by_text.items():
+                    write_answers(doc_dir_answers, text_name, model_name, results, answer_store, journal, question_set)
+                    metrics.count('texts')
+        else:
+            for text_name in text_names:
+                try:
                     print(f'Predict answers for text: {text_name}')
+                    # retrieved and read one after another like ExtractiveQAPipeline.run, the splits are selected by section
+                    with metrics.timer('retrieve', text_name):
+                        passages = retrieve_text_passages(el_retriever, text_name, questions, args.g, top_k_retriever=10,
+                                                          funding_splits=funding_splits.get(text_name))
+                    if args.p:
+                        passages, has_cues = prefilter_passages(passages, fallback=args.k)
+                        if not has_cues:
+                            print(f'No funding cues in text: {text_name}')
+                            metrics.count('no_cue_texts')
+                            write_answers(doc_dir_answers, text_name, model_name, no_answer_results(passages), answer_store, journal, question_set)
+                            continue
                     results = {}
                     for question in questions:
                         print(f'Predict answers for question: {question}')
-                        prediction = pipe.run(query=question, filters={'name': [text_name]}, top_k_retriever=10, top_k_reader=2)
+                        if len(passages[question]) == 0:
+                            # like the pipeline, a question without passages has no answers
+                            results[question] = []
+                            continue
+                        with metrics.timer('read', text_name):
+                            prediction, _ = reader.run(query=question, documents=passages[question], top_k_reader=top_k_reader)
                         results[question] = []
                         results[question] = list(map(extract_relevant_data_from_answer, prediction['answers']))
-                    try:
-                        with open(doc_dir_answers +'/'+text_name+'_'+model_name+'.json', 'w', encoding="utf-8") as json_file:
-                            json.dump(results, json_file, ensure_ascii=False, indent=4)
-                    except Exception as e:
-                        print("\nException writing file!", e)
+                    write_answers(doc_dir_answers, text_name, model_name, results, answer_store, journal, question_set)
+                    metrics.count('texts')
+                except Exception as e:
+                    print("\nException ", e)
+    finally:
+        # also when the run is interrupted, the buffered answers are complete
+        if answer_store is not None:
+            written = answer_store.flush()
+            if journal is not None and len(written) > 0:
+                journal.complete(output, model_name, question_set, written)
+
+    if retrieval_cache is not None:
+        print(f'retrieval cache: {retrieval_cache.info()}')
+    if args.m > 1:
+        metrics.finish()
+
+    return len(text_names)
+
+
+models = [('roberta', 'deepset/roberta-base-squad2'),
+            ('xlm-roberta', 'deepset/xlm-roberta-large-squad2'),
+            ('electra', 'deepset/electra-base-squad2'),
+            ('mfeb-albert-xxl-v2', 'mfeb/albert-xxlarge-v2-squad2'),
+            ('minilm-uncased', 'deepset/minilm-uncased-squad2')]
+
+sprint = functools.partial(print, end="")
+
+# store haystack log output in logfile
+logging.basicConfig(filename='extract_top_hits.log', format='%(asctime)s %(message)s', level=logging.INFO)
+
+def main():
+
+    parser = argparse.ArgumentParser(description="extract_top_hits.py\n" +
+                                    "Extract top 2 Answers for all supported moddels and questions for all PDF files.\n" +
+                                    "Iterate over PDF filenames in doc_dir_pdf to extract item handles for retrieval.\n"+
+                                    "You can also use a DensePassageRetriever if you have done the preprocessing in load_docs_into_elasticsearch_split_pdf_lang.py.\n")
+    parser.add_argument('-d', '--DPR',
+                        help='use DensePassageRetriever for retrieval.',
+                        dest='d',
+                        action="store_true")
+    parser.add_argument('-o', '--offline',
+                        help='read the splits from the split store written at ingest and rank them in-process, without elasticsearch.',
+                        dest='o',
+                        action="store_true")
+    parser.add_argument('-b', '--batch',
+                        help='batched extraction: score all questions x passages of several documents in one reader pass.',
+                        dest='b',
+                        action="store_true")
+    parser.add_argument('-n', '--docs-per-batch',
+                        help='number of documents scored together in batched extraction (default: 8).',
+                        dest='n',
+                        type=int,
+                        default=8)
+    parser.add_argument('-s', '--batch-size',
+                        help='number of samples per reader inference batch in batched extraction (default: 64).',
+                        dest='s',
+                        type=int,
+                        default=64)
+    parser.add_argument('-p', '--prefilter',
+                        help='pass only retrieved passages with acknowledgement/funding cues (plus a fallback) to the reader, skip the reader for documents without cues.',
+                        dest='p',
+                        action="store_true")
+    parser.add_argument('-k', '--fallback',
+                        help='number of passages without cues per question passed to the reader with --prefilter (default: 1).',
+                        dest='k',
+                        type=int,
+                        default=1)
+    parser.add_argument('-g', '--funding-sections',
+                        help='retrieve the passages from the funding splits of the documents (ingested with splitting: funding_sections in config.yaml), from all splits if a document has none.',
+                        dest='g',
+                        action="store_true")
+    parser.add_argument('-e', '--backend',
+                        help='reader backend (default: reader_backend in config.yaml).',
+                        dest='e',
+                        choices=READER_BACKENDS)
+    parser.add_argument('-i', '--shard',
+                        help='process only the texts of shard I of N (I/N, 0 <= I < N), texts are assigned by a hash of their name.',
+                        metavar='I/N',
+                        dest='i')
+    parser.add_argument('-m', '--model-workers',
+                        help='number of models extracting answers in parallel worker processes (default: 1).',
+                        metavar='N',
+                        dest='m',
+                        type=int,
+                        default=1)
+    parser.add_argument('-t', '--threads',
+                        help='number of torch intra-op threads per model (default: cores / model workers with -m, else torch default).',
+                        metavar='N',
+                        dest='t',
+                        type=int)
+    parser.add_argument('-r', '--overwrite',
+                        help='extract answers again, also if a valid answers file of the text and model exists.',
+                        dest='r',
+                        action="store_true")
+    parser.add_argument('-?', help='print this help message', dest='h', action="store_true")
+    args = parser.parse_args()
+ 
+    if args.h:
+        parser.print_help()
+        sys.exit(0)
+
+    if args.d and args.o:
+        print('The offline mode only supports BM25, not the DensePassageRetriever!')
+        sys.exit(1)
+
+    if args.d:
+        print('Use DensePassageRetriever!')
+
+    with open('config.yaml', 'r') as cfgin:
+            config = yaml.safe_load(cfgin)
+    metrics.setup('extract_top_hits', config)
+    exit_on_sigterm()
+
+    # Path of the directory where the extracted source TXT files are stored in
+    #doc_dir_txt = config['doc_dir_txt']
+
+    # Path of the directory where the source PDF files are stored in
+    doc_dir_pdf = config['doc_dir_pdf']
+
+    # Path of the directory where the DSpace json files with the metadata of the source PDF/TXT files are stored in
+    #doc_dir_json = config['doc_dir_json']
+
+    pdf_files = os.listdir(doc_dir_pdf)
+    text_names = [pdf_file[:-4] for pdf_file in pdf_files if pdf_file.lower().endswith(".pdf")]
+    if args.i is not None:
+        try:
+            shard, shards = parse_shard(args.i)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        text_names = [text_name for text_name in text_names if shard_of(text_name, shards) == shard]
+        print(f'Shard {shard}/{shards}: {len(text_names)} texts')
+
+    if args.m > 1:
+        threads = args.t if args.t is not None else max(1, (os.cpu_count() or 1) // args.m)
+        print(f'Extract answers with {args.m} model worker processes, {threads} threads each')
+        # spawn: torch and the elasticsearch client don't survive a fork
+        with ProcessPoolExecutor(max_workers=args.m, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(extract_model_answers, model_name, model, text_names, questions, config, args, threads): model_name
+                        for model_name, model in models}
+            for future in as_completed(futures):
+                try:
+                    print(f'Model {futures[future]}: answers for {future.result()} texts extracted')
+                except Exception as e:
+                    print(f"\nException model {futures[future]}: ", e)
+    else:
+        for model_name, model in models:
+            try:
+                with metrics.timer('model'):
+                    extract_model_answers(model_name, model, text_names, questions, config, args, args.t)
             except Exception as e:
-                print("\nException ", e)
+                print(f"\nException model {model_name}: ", e)
+        metrics.finish()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,445 @@
+#!/bin/env python
+import hashlib
+import logging
+import math
+import struct
+import numpy as np
+import rapidfuzz as fuzz
+from funder_registry import FunderRegistry, StringArray, dump_arrays, label_kinds, load_arrays, load_funder_registry
+
+
+# bump when the file layout of FunderIndex changes
+INDEX_VERSION = 4
+INDEX_MAGIC = b'FUNDIDX\x00'
+
+
+def label_tokens(normalized: str) -> list:
+    """Split a normalized label into its distinct tokens.
+
+    Args:
+        normalized (str): label processed by fuzz.utils.default_process
+
+    Returns:
+        list: the distinct tokens of the label
+    """
+
+    return list(dict.fromkeys(normalized.split()))
+
+
+def label_trigrams(tokens: list) -> list:
+    """Build the distinct character trigrams of the tokens, padded with a blank on both sides.
+
+    Args:
+        tokens (list): tokens of a normalized label
+
+    Returns:
+        list: the distinct trigrams of all tokens
+    """
+
+    trigrams = {}
+    for token in tokens:
+        padded = f" {token} "
+        for pos in range(len(padded) - 2):
+            trigrams[padded[pos:pos+3]] = None
+
+    return list(trigrams)
+
+
+def feature_hash(feature: str) -> int:
+    """Stable 64 bit hash of a token or trigram, the key its postings list is found by"""
+
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def collect_postings(normalized: list, labelnos) -> tuple:
+    """Returns the token, the trigram and the whole label postings lists (label numbers by feature) of the labels labelnos"""
+
+    token_postings = {}
+    trigram_postings = {}
+    label_postings = {}
+    for labelno in labelnos:
+        label_postings.setdefault(normalized[labelno], []).append(labelno)
+        tokens = label_tokens(normalized[labelno])
+        for token in tokens:
+            token_postings.setdefault(token, []).append(labelno)
+        for trigram in label_trigrams(tokens):
+            trigram_postings.setdefault(trigram, []).append(labelno)
+
+    return token_postings, trigram_postings, label_postings
+
+
+class Postings:
+    """Postings lists of tokens or trigrams in compressed sparse row layout with the idf weight of each feature.
+
+    The label numbers of feature i are labelnos[offsets[i]:offsets[i+1]]. The features are sorted
+    by their hash, a feature is found by binary search over the hashes and checked against its string.
+    """
+
+    def __init__(self, arrays: dict):
+        self.arrays = arrays
+        self.hashes = arrays['hashes']
+        self.features = StringArray(arrays['features'], arrays['features_offsets'])
+        self.offsets = arrays['offsets']
+        self.labelnos = arrays['labelnos']
+        self.idf = arrays['idf']
+
+    @classmethod
+    def from_lists(cls, postings: dict, no_of_labels: int) -> 'Postings':
+        """Build the postings from the label numbers by feature of a block of no_of_labels labels"""
+
+        keyed = sorted((feature_hash(feature), feature) for feature in postings)
+        features = [feature for _, feature in keyed]
+        lengths = [len(postings[feature]) for feature in features]
+        offsets = np.zeros(len(features) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        labelnos = np.concatenate([np.asarray(postings[feature], dtype=np.int32) for feature in features]) \
+                    if len(features) > 0 else np.empty(0, dtype=np.int32)
+        string_array = StringArray.from_strings(features)
+
+        return cls({'hashes': np.array([key for key, _ in keyed], dtype=np.int64),
+                    'features': string_array.data, 'features_offsets': string_array.offsets,
+                    'offsets': offsets, 'labelnos': labelnos,
+                    'idf': np.array([math.log(1.0 + max(no_of_labels, 1) / length) for length in lengths], dtype=np.float64)})
+
+    def get(self, feature: str) -> tuple:
+        """Returns the label numbers and the idf weight of a feature, None if no label has it"""
+
+        key = feature_hash(feature)
+        pos = int(np.searchsorted(self.hashes, key))
+        while pos < len(self.hashes) and self.hashes[pos] == key:
+            if self.features[pos] == feature:
+                return self.labelnos[self.offsets[pos]:self.offsets[pos+1]], self.idf[pos]
+            pos += 1
+
+        return None
+
+    def find(self, features: list) -> np.ndarray:
+        """Returns the label numbers of all features of the list any label has (one binary search for all)"""
+
+        keys = np.array([feature_hash(feature) for feature in features], dtype=np.int64)
+        positions = np.searchsorted(self.hashes, keys)
+        labelnos = []
+        for feature, key, pos in zip(features, keys.tolist(), positions.tolist()):
+            while pos < len(self.hashes) and self.hashes[pos] == key:
+                if self.features[pos] == feature:
+                    labelnos.append(self.labelnos[self.offsets[pos]:self.offsets[pos+1]])
+                pos += 1
+
+        return np.concatenate(labelnos) if len(labelnos) > 0 else np.empty(0, dtype=np.int32)
+
+    def items(self):
+        """Yields every feature with its label numbers"""
+
+        offsets = self.offsets.tolist()
+        for pos, feature in enumerate(self.features):
+            yield feature, self.labelnos[offsets[pos]:offsets[pos+1]]
+
+
+class LabelBlock:
+    """Normalized labels of one kind (preflabel or altlabel) with their token, trigram and whole label postings.
+    All of it is kept in arrays, so the block is stored in the index file and memory-mapped.
+    """
+
+    def __init__(self, normalized: StringArray, normalized_lines: np.ndarray, token_postings: Postings, trigram_postings: Postings,
+                    label_postings: Postings):
+        self.normalized = normalized
+        # the normalized labels separated by newlines (default_process leaves none in a label),
+        # a full scan decodes and splits them at once instead of label by label
+        self.normalized_lines = normalized_lines
+        self.token_postings = token_postings
+        self.trigram_postings = trigram_postings
+        self.label_postings = label_postings
+        # the number of distinct tokens of every label (a label is posted once for each of them)
+        self.token_counts = np.bincount(token_postings.labelnos, minlength=len(normalized))
+
+    @classmethod
+    def from_normalized(cls, normalized: list, token_postings: dict, trigram_postings: dict, label_postings: dict) -> 'LabelBlock':
+        return cls(StringArray.from_strings(normalized), np.frombuffer('\n'.join(normalized).encode('utf-8'), dtype=np.uint8),
+                    Postings.from_lists(token_postings, len(normalized)), Postings.from_lists(trigram_postings, len(normalized)),
+                    Postings.from_lists(label_postings, len(normalized)))
+
+    @classmethod
+    def from_labels(cls, labels: StringArray) -> 'LabelBlock':
+        """Normalize the labels and post their tokens and trigrams"""
+
+        normalized = [fuzz.utils.default_process(name) for name in labels]
+        return cls.from_normalized(normalized, *collect_postings(normalized, range(len(normalized))))
+
+    def to_arrays(self, prefix: str) -> dict:
+        """The arrays of the block by name (prefixed with the label kind) for dump_arrays"""
+
+        arrays = {f"{prefix}_normalized": self.normalized.data, f"{prefix}_normalized_offsets": self.normalized.offsets,
+                    f"{prefix}_normalized_lines": self.normalized_lines}
+        for postings_name, postings in [('token', self.token_postings), ('trigram', self.trigram_postings), ('label', self.label_postings)]:
+            arrays.update({f"{prefix}_{postings_name}_{name}": array for name, array in postings.arrays.items()})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, prefix: str) -> 'LabelBlock':
+        """The block of the arrays written by to_arrays"""
+
+        postings = {}
+        for postings_name in ['token', 'trigram', 'label']:
+            start = f"{prefix}_{postings_name}_"
+            postings[postings_name] = Postings({name[len(start):]: array for name, array in arrays.items() if name.startswith(start)})
+        return cls(StringArray(arrays[f"{prefix}_normalized"], arrays[f"{prefix}_normalized_offsets"]),
+                    arrays[f"{prefix}_normalized_lines"], postings['token'], postings['trigram'], postings['label'])
+
+    def all_normalized(self) -> list:
+        """All normalized labels, in label number order"""
+
+        if len(self.normalized) == 0:
+            return []
+        return self.normalized_lines.tobytes().decode('utf-8').split('\n')
+
+    def patched(self, normalized: list, mapping: np.ndarray, added: list) -> 'LabelBlock':
+        """The block for a new version of its labels, only the added labels are posted.
+
+        Args:
+            normalized (list): the normalized labels of the new version
+            mapping (np.ndarray): the new label number of every old label number, -1 for removed labels
+            added (list): the label numbers of the labels not in the old version
+
+        Returns:
+            LabelBlock: the new block (in memory)
+        """
+
+        token_postings, trigram_postings, label_postings = collect_postings(normalized, added)
+        return LabelBlock.from_normalized(normalized, self.renumber_postings(self.token_postings, mapping, token_postings),
+                                            self.renumber_postings(self.trigram_postings, mapping, trigram_postings),
+                                            self.renumber_postings(self.label_postings, mapping, label_postings))
+
+    def renumber_postings(self, postings: Postings, mapping: np.ndarray, added_postings: dict) -> dict:
+        """Map the label numbers of the postings to the new version and add the postings of the added labels"""
+
+        renumbered = {}
+        old_postings = dict(postings.items())
+        for feature in old_postings.keys() | added_postings.keys():
+            labelnos = mapping[old_postings[feature]] if feature in old_postings else np.empty(0, dtype=np.int32)
+            labelnos = labelnos[labelnos >= 0]
+            if feature in added_postings:
+                labelnos = np.concatenate([labelnos, np.array(added_postings[feature], dtype=np.int32)])
+            if len(labelnos) > 0:
+                renumbered[feature] = np.sort(labelnos)
+
+        return renumbered
+
+    def shortlist(self, normalized_query: str, shortlist_size: int) -> np.ndarray:
+        """Select the labels sharing the most (idf weighted) tokens and trigrams with the query.
+
+        Args:
+            normalized_query (str): query processed by fuzz.utils.default_process
+            shortlist_size (int): maximum number of candidates to return
+
+        Returns:
+            np.ndarray: label numbers of the candidates in ascending order
+        """
+
+        weights = np.zeros(len(self.normalized), dtype=np.float32)
+        tokens = label_tokens(normalized_query)
+        for token in tokens:
+            posting = self.token_postings.get(token)
+            if posting is not None:
+                # a shared token counts more than the trigrams it consists of
+                weights[posting[0]] += 2.0 * posting[1]
+        for trigram in label_trigrams(tokens):
+            posting = self.trigram_postings.get(trigram)
+            if posting is not None:
+                weights[posting[0]] += posting[1]
+
+        candidates = np.flatnonzero(weights)
+        if len(candidates) > shortlist_size:
+            best = np.argsort(-weights[candidates], kind='stable')[:shortlist_size]
+            candidates = np.sort(candidates[best])
+
+        return candidates
+
+    def contained_labels(self, normalized_query: str) -> np.ndarray:
+        """Find the labels contained in the query or containing it, as a substring or as a set of tokens.
+
+        WRatio scores a label that is a substring of the query (or the other way round) 90 as soon as
+        the lengths differ by a factor of 1.5 (partial_ratio 100, scaled), and a label whose tokens are
+        a subset of the query tokens (or the other way round) 95 otherwise (token_set_ratio 100, scaled).
+        The first of these tied labels is the match, but blocking ranks them below the labels sharing
+        more tokens with the query, so they are looked up exactly instead of relying on the shortlist.
+
+        Args:
+            normalized_query (str): query processed by fuzz.utils.default_process
+
+        Returns:
+            np.ndarray: label numbers of the labels in ascending order
+        """
+
+        # a substring is a label only if a label token starts with its first and one ends with its last two characters
+        padded = f" {normalized_query} "
+        starts = [pos for pos in range(1, len(padded) - 1) if padded[pos] != ' ' and self.trigram_postings.get(' ' + padded[pos:pos+2]) is not None]
+        ends = [pos for pos in range(1, len(padded) - 1) if padded[pos] != ' ' and self.trigram_postings.get(padded[pos-1:pos+1] + ' ') is not None]
+        # a label less than an eighth of the query long scores at most 60
+        min_length = max(1, len(normalized_query) // 8)
+        substrings = list({padded[start:end + 1] for start in starts for end in ends if end + 1 - start >= min_length})
+        labelnos = [self.label_postings.find(substrings)]
+
+        lines = self.normalized_lines.tobytes()
+        query = normalized_query.encode('utf-8')
+        positions = []
+        pos = lines.find(query)
+        while pos >= 0:
+            positions.append(pos)
+            pos = lines.find(query, pos + 1)
+        if len(positions) > 0:
+            # label i starts at offsets[i] + i in the newline separated labels
+            line_starts = self.normalized.offsets[:-1] + np.arange(len(self.normalized))
+            labelnos.append(np.searchsorted(line_starts, positions, side='right') - 1)
+
+        tokens = label_tokens(normalized_query)
+        shared = np.zeros(len(self.normalized), dtype=np.int64)
+        for token in tokens:
+            posting = self.token_postings.get(token)
+            if posting is not None:
+                shared[posting[0]] += 1
+        labelnos.append(np.flatnonzero((shared > 0) & ((shared == self.token_counts) | (shared == len(tokens)))))
+
+        return np.unique(np.concatenate(labelnos)).astype(np.int32)
+
+
+class FunderIndex:
+    """Matching index over the crossref funder authority records.
+
+    The labels are normalized once when the index is built. A query only is compared
+    with fuzz.fuzz.WRatio to the shortlist of labels picked by token/trigram blocking and to the
+    labels contained in the query or containing it, instead of scanning every label of the registry.
+    The index refers to the labels by their number in the FunderRegistry. Like the registry
+    it is written to a single file whose arrays are memory-mapped when loaded, so worker
+    processes share the normalized labels and postings instead of each holding its own copy.
+    """
+
+    def __init__(self, registry: FunderRegistry, shortlist_size: int = 256, blocks: dict = None, buffer=None):
+        self.fingerprint = registry.fingerprint
+        self.shortlist_size = shortlist_size
+        self.registry = registry
+        # the mmap the arrays of the blocks are views of (None for an index built in memory)
+        self.buffer = buffer
+        if blocks is None:
+            blocks = {label_kind: LabelBlock.from_labels(registry.labels[label_kind]) for label_kind in label_kinds}
+        self.blocks = blocks
+
+    def extract(self, possible_funder: str, label_kind: str, limit: int = 5) -> list:
+        """Match a name against the labels of a kind like fuzz.process.extract(possible_funder, labels, scorer=fuzz.fuzz.WRatio)
+
+        Args:
+            possible_funder (str): fundername to look up in authority records
+            label_kind (str): 'preflabel' or 'altlabel'
+            limit (int, optional): maximum number of results. Defaults to 5.
+
+        Returns:
+            list: tuples (label, similarity, funder number in the registry) sorted by similarity
+        """
+
+        block = self.blocks[label_kind]
+        normalized_query = fuzz.utils.default_process(possible_funder)
+        if not normalized_query:
+            return []
+
+        if ' ' not in normalized_query:
+            # WRatio scores a single word >= 90 for every label containing it,
+            # blocking can't rank these ties, so compare it to all labels
+            choices = block.all_normalized()
+        else:
+            candidates = np.union1d(block.shortlist(normalized_query, self.shortlist_size), block.contained_labels(normalized_query))
+            choices = dict(zip(candidates.tolist(), block.normalized.take(candidates)))
+        results = fuzz.process.extract(normalized_query, choices, scorer=fuzz.fuzz.WRatio, processor=None, limit=limit)
+
+        labels = self.registry.labels[label_kind]
+        label_funder = self.registry.label_funder[label_kind]
+        return [(labels[labelno], similarity, int(label_funder[labelno])) for _, similarity, labelno in results]
+
+    def update(self, registry: FunderRegistry) -> dict:
+        """Patch the index for a new version of the registry instead of building it again:
+           the postings of the kept labels are renumbered, only the added labels are normalized and posted.
+
+        Args:
+            registry (FunderRegistry): the new version of the registry
+
+        Returns:
+            dict: the number of kept, removed and added labels by label kind
+        """
+
+        changes = {}
+        for label_kind, block in self.blocks.items():
+            old_labelnos = {key: labelno for labelno, key in enumerate(self.registry.label_keys(label_kind))}
+            mapping = np.full(len(block.normalized), -1, dtype=np.int32)
+            old_normalized = block.all_normalized()
+            normalized = []
+            added = []
+            for labelno, key in enumerate(registry.label_keys(label_kind)):
+                old_labelno = old_labelnos.get(key)
+                if old_labelno is None:
+                    added.append(labelno)
+                    normalized.append(fuzz.utils.default_process(key[1]))
+                else:
+                    mapping[old_labelno] = labelno
+                    normalized.append(old_normalized[old_labelno])
+            self.blocks[label_kind] = block.patched(normalized, mapping, added)
+            kept = len(normalized) - len(added)
+            changes[label_kind] = {'kept': kept, 'removed': len(mapping) - kept, 'added': len(added)}
+
+        self.registry = registry
+        self.fingerprint = registry.fingerprint
+        return changes
+
+    def dump(self, filepath: str) -> None:
+        """Write the index as a single file (see funder_registry.dump_arrays)"""
+
+        arrays = {}
+        for label_kind, block in self.blocks.items():
+            arrays.update(block.to_arrays(label_kind))
+        dump_arrays(filepath, INDEX_MAGIC, {'version': INDEX_VERSION, 'fingerprint': self.fingerprint,
+                                            'shortlist_size': self.shortlist_size}, arrays)
+
+    @classmethod
+    def load(cls, filepath: str, registry: FunderRegistry) -> 'FunderIndex':
+        """Memory-map an index file written by dump, the index uses the labels of registry.
+           The fingerprint of the index is the one of the registry it was built from."""
+
+        header, arrays, buffer = load_arrays(filepath, INDEX_MAGIC, INDEX_VERSION)
+        funder_index = cls(registry, header['shortlist_size'],
+                            {label_kind: LabelBlock.from_arrays(arrays, label_kind) for label_kind in label_kinds}, buffer)
+        funder_index.fingerprint = tuple(header['fingerprint']) if header['fingerprint'] is not None else None
+
+        return funder_index
+
+
+def load_funder_index(funder_csv_file: str, index_file: str, registry_file: str) -> FunderIndex:
+    """Load the funder matching index from index_file and the registry from registry_file (both memory-mapped).
+       Both are (re)built from funder_csv_file if they are missing or the csv file changed.
+
+    Args:
+        funder_csv_file (str): the excel tab csv-file with the complete crossref funderlist
+        index_file (str): the file the index is persisted in
+        registry_file (str): the file the registry is persisted in (see funder_registry.py)
+
+    Returns:
+        FunderIndex: the funder matching index
+    """
+
+    registry = load_funder_registry(funder_csv_file, registry_file)
+    try:
+        funder_index = FunderIndex.load(index_file, registry)
+        if funder_index.fingerprint == registry.fingerprint:
+            return funder_index
+        logging.info(f"funder index '{index_file}' is outdated")
+    except FileNotFoundError:
+        logging.info(f"no funder index '{index_file}'")
+    except (ValueError, KeyError, struct.error) as e:
+        logging.warning(f"could not load funder index '{index_file}': {e}")
+
+    print(f"build funder index from: {funder_csv_file}")
+    funder_index = FunderIndex(registry)
+    try:
+        funder_index.dump(index_file)
+        # map the written file, so the processes share it
+        funder_index = FunderIndex.load(index_file, registry)
+    except OSError as e:
+        print(e)
+
+    return funder_index
@@ -0,0 +1,10 @@
+#!/bin/env python
+
+# the questions asked for every text by extract_top_hits.py
+questions = ['Who funded the article?', 'Who funded the work?', 'Who gives financial support?',
+                'By whom was the study funded?', 'Whose financial support do you acknowledge?',
+                'Who provided funding?', 'Who provided financial support?',
+                'By which grant was this research supported?']
+
+# number of answers extracted per question
+top_k_reader = 2
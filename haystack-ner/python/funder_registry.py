@@ -0,0 +1,254 @@
+#!/bin/env python
+import bisect
+import csv
+import json
+import logging
+import mmap
+import os
+import struct
+import numpy as np
+
+
+# bump when the file layout of FunderRegistry changes
+REGISTRY_VERSION = 1
+REGISTRY_MAGIC = b'FUNDREG\x00'
+
+label_kinds = ['preflabel', 'altlabel']
+
+
+class StringArray:
+    """Strings stored contiguously as utf-8 bytes, string i is data[offsets[i]:offsets[i+1]]."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: list) -> 'StringArray':
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, pos: int) -> str:
+        if pos < 0:
+            pos += len(self)
+        return self.data[self.offsets[pos]:self.offsets[pos+1]].tobytes().decode('utf-8')
+
+    def take(self, positions: np.ndarray) -> list:
+        """The strings at positions (an integer array)"""
+
+        data = memoryview(self.data)
+        return [str(data[start:end], 'utf-8') for start, end in zip(self.offsets[positions].tolist(), self.offsets[positions + 1].tolist())]
+
+    def __iter__(self):
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield data[start:end].decode('utf-8')
+
+
+class FunderRegistry:
+    """The crossref funder authority records of the funder list written by extract_funders_from_rdf.py.
+
+    The funders are numbered in the order of their crossref ids, so a funder number is
+    an index into the arrays and the number of an id is found by binary search.
+    The labels of each kind are kept in one contiguous array together with the number
+    of the funder they belong to. The registry is written to a single file whose arrays
+    are memory-mapped when loaded, so worker processes share the pages of the file
+    instead of each holding its own copy.
+    """
+
+    def __init__(self, arrays: dict, fingerprint: tuple = None, buffer=None):
+        self.arrays = arrays
+        self.fingerprint = fingerprint
+        # the mmap the arrays are views of (None for a registry built in memory)
+        self.buffer = buffer
+        self.ids = StringArray(arrays['ids'], arrays['ids_offsets'])
+        self.preflabel = StringArray(arrays['names'], arrays['names_offsets'])
+        self.labels = {kind: StringArray(arrays[kind], arrays[f'{kind}_offsets']) for kind in label_kinds}
+        self.label_funder = {kind: arrays[f'{kind}_funder'] for kind in label_kinds}
+
+    @classmethod
+    def from_rows(cls, rows, fingerprint: tuple = None) -> 'FunderRegistry':
+        """Build the registry from the rows (dicts with ispref, id and name) of the funder list.
+           Like the former dicts of the funder list, the last preflabel of a funder wins and
+           duplicate labels of a funder are kept once, in the order of their first row.
+        """
+
+        preflabels = {}
+        labels = {kind: {} for kind in label_kinds}
+        for row in rows:
+            kind = 'preflabel' if row['ispref'] == 'True' else 'altlabel'
+            if kind == 'preflabel':
+                preflabels[row['id']] = row['name']
+                labels[kind][(row['id'], None)] = row['name']
+            else:
+                labels[kind][(row['id'], row['name'])] = row['name']
+
+        ids = sorted(set(funder_id for kind in label_kinds for funder_id, _ in labels[kind]))
+        funder_nos = {funder_id: funder_no for funder_no, funder_id in enumerate(ids)}
+        arrays = {}
+        for name, strings in [('ids', ids), ('names', [preflabels.get(funder_id, '') for funder_id in ids])]:
+            string_array = StringArray.from_strings(strings)
+            arrays[name], arrays[f'{name}_offsets'] = string_array.data, string_array.offsets
+        for kind in label_kinds:
+            string_array = StringArray.from_strings(list(labels[kind].values()))
+            arrays[kind], arrays[f'{kind}_offsets'] = string_array.data, string_array.offsets
+            arrays[f'{kind}_funder'] = np.array([funder_nos[funder_id] for funder_id, _ in labels[kind]], dtype=np.int32)
+
+        return cls(arrays, fingerprint)
+
+    @classmethod
+    def from_csv_file(cls, filename: str, fingerprint: tuple = None) -> 'FunderRegistry':
+        """load the funder registry from the excel tab csv file written by extract_funders_from_rdf.py
+
+        Args:
+            filename (str): the name of the file containing the serialized rdf crossref funder list
+            fingerprint (tuple, optional): size and mtime of the csv file. Defaults to None.
+
+        Returns:
+            FunderRegistry: the funder registry
+        """
+
+        rows = []
+        try:
+            with open(filename, 'r', newline='', encoding='utf-8') as csvinfile:
+                rows = list(csv.DictReader(csvinfile, dialect='excel-tab'))
+        except Exception as e:
+            print(e)
+
+        return cls.from_rows(rows, fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def label_keys(self, label_kind: str) -> list:
+        """The (crossref id, label) of the labels of a kind, they identify a label across versions of the registry"""
+
+        ids = list(self.ids)
+        return [(ids[funder_no], label) for funder_no, label in zip(self.label_funder[label_kind].tolist(), self.labels[label_kind])]
+
+    def funder_no(self, funder_id: str) -> int:
+        """Returns the number of a funder by its crossref id, None if it isn't registered"""
+
+        funder_no = bisect.bisect_left(self.ids, funder_id)
+        if funder_no < len(self.ids) and self.ids[funder_no] == funder_id:
+            return funder_no
+        return None
+
+    def dump(self, filepath: str) -> None:
+        """Write the registry as a single file (see dump_arrays)"""
+
+        dump_arrays(filepath, REGISTRY_MAGIC, {'version': REGISTRY_VERSION, 'fingerprint': self.fingerprint}, self.arrays)
+
+    @classmethod
+    def load(cls, filepath: str) -> 'FunderRegistry':
+        """Memory-map a registry file written by dump, the arrays are read only views of the file"""
+
+        header, arrays, buffer = load_arrays(filepath, REGISTRY_MAGIC, REGISTRY_VERSION)
+        fingerprint = tuple(header['fingerprint']) if header['fingerprint'] is not None else None
+
+        return cls(arrays, fingerprint, buffer)
+
+
+def dump_arrays(filepath: str, magic: bytes, header: dict, arrays: dict) -> None:
+    """Write numpy arrays as a single file: magic, header length, json header (with the layout of the arrays)
+       and the 8 byte aligned arrays. The file is written to a temporary file and renamed.
+
+    Args:
+        filepath (str): the name of the file
+        magic (bytes): 8 bytes identifying the kind of file
+        header (dict): json serializable values stored with the arrays (e.g. version and fingerprint)
+        arrays (dict): the one dimensional numpy arrays by name
+    """
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // 8) * 8
+    header = json.dumps(dict(header, arrays=layout)).encode('utf-8')
+    header += b' ' * (-(len(magic) + 8 + len(header)) % 8)
+
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, 'wb') as fs:
+        fs.write(magic + struct.pack('<Q', len(header)) + header)
+        for array in arrays.values():
+            fs.write(np.ascontiguousarray(array).tobytes())
+            fs.write(b'\x00' * (-array.nbytes % 8))
+    os.replace(tmp_filepath, filepath)
+
+
+def load_arrays(filepath: str, magic: bytes, version: int) -> tuple:
+    """Memory-map a file written by dump_arrays.
+
+    Args:
+        filepath (str): the name of the file
+        magic (bytes): 8 bytes identifying the kind of file
+        version (int): the expected version of the file layout (header['version'])
+
+    Raises:
+        ValueError: the file isn't of the kind or has another version
+
+    Returns:
+        tuple: the header, the arrays by name (read only views of the file) and the mmap
+    """
+
+    with open(filepath, 'rb') as fs:
+        buffer = mmap.mmap(fs.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(magic)] != magic:
+        raise ValueError(f"'{filepath}' does not start with {magic!r}")
+    header_length, = struct.unpack_from('<Q', buffer, len(magic))
+    start = len(magic) + 8
+    header = json.loads(buffer[start:start+header_length].decode('utf-8'))
+    if header['version'] != version:
+        raise ValueError(f"'{filepath}' has version {header['version']}, expected {version}")
+    start += header_length
+    arrays = {name: np.frombuffer(buffer, dtype=np.dtype(dtype), count=count, offset=start + offset)
+                for name, (dtype, offset, count) in header['arrays'].items()}
+
+    return header, arrays, buffer
+
+
+def csv_fingerprint(filename: str) -> tuple:
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def load_funder_registry(funder_csv_file: str, registry_file: str) -> FunderRegistry:
+    """Load the funder registry from registry_file (memory-mapped).
+       The registry file is (re)built from funder_csv_file if it is missing or the csv file changed.
+
+    Args:
+        funder_csv_file (str): the excel tab csv-file with the complete crossref funderlist
+        registry_file (str): the file the registry is persisted in
+
+    Returns:
+        FunderRegistry: the funder registry
+    """
+
+    fingerprint = csv_fingerprint(funder_csv_file)
+    try:
+        registry = FunderRegistry.load(registry_file)
+        if registry.fingerprint == fingerprint:
+            return registry
+        logging.info(f"funder registry '{registry_file}' is outdated")
+    except FileNotFoundError:
+        logging.info(f"no funder registry '{registry_file}'")
+    except (ValueError, struct.error) as e:
+        logging.warning(f"could not load funder registry '{registry_file}': {e}")
+
+    print(f"build funder registry from: {funder_csv_file}")
+    registry = FunderRegistry.from_csv_file(funder_csv_file, fingerprint)
+    try:
+        registry.dump(registry_file)
+        # map the written file, so the processes share it
+        registry = FunderRegistry.load(registry_file)
+    except OSError as e:
+        print(e)
+
+    return registry
@@ -0,0 +1,158 @@
+#!/bin/env python
+import collections
+import csv
+import os
+import rapidfuzz as fuzz
+from merge_answers import extract_doi_from_funder
+
+
+reresolve_fieldnames = ['file', 'line', 'handle', 'column', 'answer', 'found_funder_doi', 'reason', 'new_funder_doi']
+
+
+def row_key(row: dict) -> tuple:
+    return (row['ispref'], row['id'], row['name'])
+
+
+def funder_labels(rows: list) -> dict:
+    """The labels of every funder of a funder list.
+
+    Args:
+        rows (list): the rows of the funder list (dicts with ispref, id and name)
+
+    Returns:
+        dict: the labels (tuples of kind and name, in row order) by crossref id
+    """
+
+    labels = {}
+    for row in rows:
+        label_kind = 'preflabel' if row['ispref'] == 'True' else 'altlabel'
+        labels.setdefault(row['id'], {})[(label_kind, row['name'])] = None
+
+    return labels
+
+
+def preflabel_of(labels: dict) -> str:
+    """The preflabel of a funder, like in the registry the last one wins"""
+
+    preflabels = [name for label_kind, name in labels if label_kind == 'preflabel']
+    return preflabels[-1] if len(preflabels) > 0 else None
+
+
+def funder_delta(old_rows: list, new_rows: list) -> dict:
+    """Compare the funder list of the previous build with a new version.
+
+    Args:
+        old_rows (list): the rows of the previous funder list (dicts with ispref, id and name)
+        new_rows (list): the rows of the new funder list
+
+    Returns:
+        dict: the changes by crossref id of the changed funders: status ('added', 'removed' or 'changed'),
+              the added and removed labels ([kind, name]) and the old and new preflabel if it changed
+    """
+
+    old_labels = funder_labels(old_rows)
+    new_labels = funder_labels(new_rows)
+    delta = {}
+    for funder_id in sorted(old_labels.keys() | new_labels.keys()):
+        old = old_labels.get(funder_id, {})
+        new = new_labels.get(funder_id, {})
+        added = [list(label) for label in new if label not in old]
+        removed = [list(label) for label in old if label not in new]
+        if len(added) == 0 and len(removed) == 0:
+            continue
+        status = 'added' if len(old) == 0 else 'removed' if len(new) == 0 else 'changed'
+        delta[funder_id] = {'status': status, 'added': added, 'removed': removed}
+        if preflabel_of(old) != preflabel_of(new):
+            delta[funder_id]['preflabel'] = [preflabel_of(old), preflabel_of(new)]
+
+    return delta
+
+
+def patch_funder_rows(old_rows: list, new_rows: list) -> list:
+    """The rows of the new funder list in the order of the previous one: kept rows stay in place,
+       removed rows are dropped and added rows are appended. So the labels of the registry keep
+       their order and FunderIndex.update only renumbers them.
+
+    Args:
+        old_rows (list): the rows of the previous funder list (dicts with ispref, id and name)
+        new_rows (list): the rows of the new funder list
+
+    Returns:
+        list: the rows of the new funder list
+    """
+
+    new_counts = collections.Counter(row_key(row) for row in new_rows)
+    patched = []
+    for row in old_rows + new_rows:
+        key = row_key(row)
+        if new_counts[key] > 0:
+            new_counts[key] -= 1
+            patched.append(row)
+
+    return patched
+
+
+def answer_csv_files(paths: list) -> list:
+    """The answer csv files (see extract_answers_from_files.py and merge_answers.py) of files and directories"""
+
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += sorted(os.path.join(path, filename) for filename in os.listdir(path) if filename.lower().endswith('.csv'))
+        else:
+            filenames.append(path)
+
+    return filenames
+
+
+def answers_to_reresolve(answer_files: list, delta: dict, min_similarity: float = 90.0):
+    """Find the answers of answer csv files whose funder match can change with the delta of the funder list:
+       answers matched to a funder with removed labels (also removed funders and changed preflabels)
+       and answers similar to an added label (as similar as find_funder_from_list requires for a match).
+
+    Args:
+        answer_files (list): the answer csv files, every column *found_funder_id with its *answer and
+                             *found_funder_doi columns is checked
+        delta (dict): the changes of the funder list (see funder_delta)
+        min_similarity (float, optional): the similarity of a match. Defaults to 90.0.
+
+    Yields:
+        dict: the answer to resolve again (see reresolve_fieldnames)
+    """
+
+    affected = set(funder_id for funder_id, change in delta.items() if len(change['removed']) > 0)
+    added = {}
+    for funder_id, change in delta.items():
+        for _, name in change['added']:
+            normalized = fuzz.utils.default_process(name)
+            if normalized:
+                added.setdefault(normalized, funder_id)
+    choices = list(added)
+    # the same answers are found in many texts and files
+    new_matches = {}
+
+    for filename in answer_files:
+        with open(filename, 'r', newline='', encoding='utf-8') as csvinfile:
+            csvreader = csv.DictReader(csvinfile, dialect='excel-tab')
+            prefixes = [column[:-len('found_funder_id')] for column in (csvreader.fieldnames or []) if column.endswith('found_funder_id')]
+            for row in csvreader:
+                for prefix in prefixes:
+                    answer = row.get(f"{prefix}answer") or ''
+                    found_funder_id = row.get(f"{prefix}found_funder_id") or ''
+                    doi = row.get(f"{prefix}found_funder_doi") or (extract_doi_from_funder(found_funder_id) or '' if found_funder_id else '')
+                    reason = None
+                    new_funder_doi = ''
+                    if doi in affected:
+                        reason = 'labels removed'
+                    elif answer and len(choices) > 0:
+                        if answer not in new_matches:
+                            match = fuzz.process.extractOne(fuzz.utils.default_process(answer), choices, scorer=fuzz.fuzz.WRatio,
+                                                            processor=None, score_cutoff=min_similarity)
+                            new_matches[answer] = added[match[0]] if match is not None else None
+                        if new_matches[answer] is not None and new_matches[answer] != doi:
+                            reason = 'new label'
+                            new_funder_doi = new_matches[answer]
+                    if reason is not None:
+                        yield {'file': filename, 'line': csvreader.line_num, 'handle': row.get('handle') or row.get('Handle') or '',
+                                'column': prefix, 'answer': answer, 'found_funder_doi': doi, 'reason': reason,
+                                'new_funder_doi': new_funder_doi}
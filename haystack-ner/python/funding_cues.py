@@ -0,0 +1,145 @@
+#!/bin/env python
+import regex
+
+
+# acknowledgement and funding cues (english and german), matched case insensitive
+funding_cue_pattern = regex.compile(r"""
+    acknowledg | \bthank | \bgrate | \bfund(?:s|ed|ing|er|ers)?\b | \bgrant | financial(?:ly)?\s+support
+    | \bsupported\s+by | \bsponsor | fellowship | scholarship | \bDFG\b | \bBMBF\b | \bERC\b | research\s+council
+    | \bdank | \bförder | finanzier | \bunterstütz | \bstiftung | drittmittel | projektträger
+    """, regex.IGNORECASE | regex.VERBOSE)
+
+
+# header of an acknowledgement or funding section (english and german): on a line of its own
+# or followed by a colon and the statement, optionally numbered (e.g. "5. Acknowledgements")
+funding_header_pattern = regex.compile(r"""
+    ^[ \t]*(?:\d+(?:\.\d+)*\.?[ \t]+)?
+    (?:acknowledge?ments?|funding(?:[ \t]+(?:information|sources?|statement))?|financial[ \t]+support|grant[ \t]+information
+        |danksagung(?:en)?|förderhinweise?|förderung|finanzierung)
+    [ \t]*(?::|\.?[ \t]*$)
+    """, regex.IGNORECASE | regex.VERBOSE | regex.MULTILINE)
+
+# a short line without final punctuation starting a paragraph, the header of the next section (e.g. "References", "2 Data")
+section_header_pattern = regex.compile(r"^[ \t]*(?:\d+(?:\.\d+)*\.?[ \t]+)?\p{Lu}[^\n.:;,]{0,60}$")
+
+# footnote marker at the start of a line (e.g. "*", "†", "1 ", "¹")
+footnote_pattern = regex.compile(r"^[ \t]*(?:[*†‡§¶]+|\d{1,2}(?=[ \t)])|[¹²³⁴⁵⁶⁷⁸⁹])")
+
+
+def has_funding_cue(text: str) -> bool:
+    """Check if a text contains an acknowledgement or funding cue
+
+    Args:
+        text (str): the text of a split
+
+    Returns:
+        bool: True if a cue was found
+    """
+
+    return funding_cue_pattern.search(text) is not None
+
+
+def prefilter_passages(passages: dict, fallback: int = 1) -> tuple:
+    """Prune the retrieved passages of a document to the passages with funding cues
+       plus the best `fallback` passages without cues per question.
+
+    Args:
+        passages (dict): retrieved documents by question, best first
+        fallback (int, optional): number of passages without cue kept per question. Defaults to 1.
+
+    Returns:
+        tuple: the pruned passages by question and whether any passage of the document has a cue
+    """
+
+    flags = {}
+    for documents in passages.values():
+        for document in documents:
+            if document.id not in flags:
+                flags[document.id] = has_funding_cue(document.text)
+
+    pruned = {}
+    for question, documents in passages.items():
+        kept = []
+        no_cue = 0
+        for document in documents:
+            if flags[document.id]:
+                kept.append(document)
+            elif no_cue < fallback:
+                kept.append(document)
+                no_cue += 1
+        pruned[question] = kept
+
+    return pruned, any(flags.values())
+
+
+def no_answer_results(passages: dict) -> dict:
+    """Results of a document without any funding cue, the reader is skipped.
+       Every question gets a single 'no answer' (a question without passages gets none).
+
+    Args:
+        passages (dict): retrieved documents by question
+
+    Returns:
+        dict: relevant answer data by question
+    """
+
+    results = {}
+    for question, documents in passages.items():
+        results[question] = []
+        if len(documents) > 0:
+            results[question].append({'answer': None, 'score': 0.0, 'probability': 0.0, 'context': None,
+                                        'lang': documents[0].meta.get('lang', '')})
+
+    return results
+
+
+def limit_words(text: str, max_words: int) -> str:
+    """Normalize the whitespace of a text and cut it after max_words words"""
+
+    return ' '.join(text.split()[:max_words])
+
+
+def funding_sections(text: str, max_words: int = 200) -> list:
+    """Find the acknowledgement and funding statements of a document: the sections under
+       an acknowledgement or funding header and the footnotes with funding cues on the title page.
+
+    Args:
+        text (str): the text of the document, pages separated by form feeds
+        max_words (int, optional): max. number of words of a statement. Defaults to 200.
+
+    Returns:
+        list: the statements (whitespace normalized), in order of occurrence
+    """
+
+    sections = []
+    for match in funding_header_pattern.finditer(text):
+        words = 0
+        paragraphs = []
+        # the statement continues on the header line (after a colon) or in the next paragraphs
+        for paragraph in regex.split(r"\n[ \t]*\n", text[match.end():]):
+            # blank lines after the header, the first line of the statement can look like a header (a short wrapped line)
+            if len(paragraph.strip()) == 0:
+                continue
+            if len(paragraphs) > 0 and section_header_pattern.match(paragraph.strip('\n').split('\n', 1)[0]):
+                break
+            paragraphs.append(paragraph)
+            words += len(paragraph.split())
+            if words >= max_words:
+                break
+        section = limit_words(' '.join(paragraphs), max_words)
+        if len(section) > 0:
+            sections.append(section)
+
+    if '\f' in text:
+        # footnotes of the title page (e.g. "* We thank ... for financial support")
+        footnotes = []
+        for line in text[:text.index('\f')].split('\n'):
+            if footnote_pattern.match(line):
+                footnotes.append(line)
+            elif len(footnotes) > 0 and footnotes[-1] is not None and len(line.strip()) > 0:
+                footnotes[-1] += ' ' + line
+            elif len(footnotes) > 0:
+                footnotes.append(None)
+        sections += [footnote for footnote in footnotes if footnote is not None and has_funding_cue(footnote)]
+
+    return list(dict.fromkeys(limit_words(section, max_words) for section in sections))
@@ -0,0 +1,141 @@
+#!/bin/env python
+import datetime as dt
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+def file_content_hash(file_path: str) -> str:
+    """sha1 hex digest of the content of a file
+
+    Args:
+        file_path (str): the file to hash
+
+    Returns:
+        str: the hex digest
+    """
+
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as fs:
+        for chunk in iter(lambda: fs.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class IngestManifest:
+    """Manifest of the files ingested into an elasticsearch index (sqlite).
+
+    For every file the size, mtime, content hash, number of splits, language and
+    status are recorded. A file is 'pending' while it is converted and written,
+    it is 'done' after all its splits have been written to elasticsearch.
+    The number of funding splits (meta section 'funding') is -1 for files ingested without
+    funding sections and NULL for files ingested before the manifest recorded it.
+    """
+
+    def __init__(self, filename: str, index: str):
+        self.index = index
+        self.lock = threading.Lock()
+        # rows are marked 'done' by the elasticsearch writer thread
+        self.db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files '
+                        '(idx TEXT, path TEXT, size INTEGER, mtime INTEGER, content_hash TEXT, '
+                        'splits INTEGER, lang TEXT, status TEXT, updated TEXT, funding_splits INTEGER, PRIMARY KEY (idx, path))')
+        # manifests written before the funding splits were recorded
+        if 'funding_splits' not in [column[1] for column in self.db.execute('PRAGMA table_info(files)')]:
+            self.db.execute('ALTER TABLE files ADD COLUMN funding_splits INTEGER')
+        self.db.commit()
+
+    def entries(self, doc_dir: str) -> dict:
+        """Returns the manifest rows of the files in doc_dir by file path"""
+
+        prefix = doc_dir + '/'
+        with self.lock:
+            rows = self.db.execute('SELECT path, size, mtime, content_hash, status FROM files WHERE idx = ? AND substr(path, 1, ?) = ?',
+                                    (self.index, len(prefix), prefix)).fetchall()
+        return {row[0]: {'size': row[1], 'mtime': row[2], 'content_hash': row[3], 'status': row[4]} for row in rows}
+
+    def plan(self, file_paths: list, doc_dir: str, full: bool = False) -> tuple:
+        """Compare the files with the manifest.
+
+        Args:
+            file_paths (list): the files currently in the source directory
+            doc_dir (str): the source directory
+            full (bool, optional): ingest all files, not only new or changed ones. Defaults to False.
+
+        Returns:
+            tuple: files to ingest (new, changed or interrupted), the subset of those
+                   already (partly) in the index and files removed from the source directory
+        """
+
+        entries = self.entries(doc_dir)
+        to_ingest = []
+        to_replace = []
+        for file_path in file_paths:
+            entry = entries.pop(file_path, None)
+            if entry is None:
+                to_ingest.append(file_path)
+                continue
+            stat = os.stat(file_path)
+            if entry['status'] == 'done' and not full:
+                if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                    continue
+                # touched, but the content did not change
+                if entry['size'] == stat.st_size and entry['content_hash'] == file_content_hash(file_path):
+                    with self.lock:
+                        self.db.execute('UPDATE files SET mtime = ? WHERE idx = ? AND path = ?', (stat.st_mtime_ns, self.index, file_path))
+                        self.db.commit()
+                    continue
+            to_ingest.append(file_path)
+            to_replace.append(file_path)
+
+        return to_ingest, to_replace, list(entries.keys())
+
+    def start(self, file_paths: list) -> None:
+        """Record the files as 'pending' before they are ingested."""
+
+        rows = []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            rows.append((self.index, file_path, stat.st_size, stat.st_mtime_ns, file_content_hash(file_path),
+                         0, '', 'pending', f"{dt.datetime.now():%Y-%m-%d %H:%M:%S}", None))
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.db.commit()
+
+    def done(self, files: list) -> None:
+        """Mark files as 'done'.
+
+        Args:
+            files (list): tuples of file path, number of splits, language and number of funding splits
+                          (-1 if ingested without funding sections)
+        """
+
+        now = f"{dt.datetime.now():%Y-%m-%d %H:%M:%S}"
+        with self.lock:
+            self.db.executemany("UPDATE files SET splits = ?, lang = ?, status = 'done', updated = ?, funding_splits = ? "
+                                "WHERE idx = ? AND path = ?",
+                                [(splits, lang, now, funding_splits, self.index, file_path)
+                                    for file_path, splits, lang, funding_splits in files])
+            self.db.commit()
+
+    def funding_splits(self) -> dict:
+        """Returns the number of funding splits (-1 if ingested without funding sections) of the done files
+           by text name (the file name without extension), files ingested before it was recorded are left out
+        """
+
+        with self.lock:
+            rows = self.db.execute("SELECT path, funding_splits FROM files WHERE idx = ? AND status = 'done' AND funding_splits IS NOT NULL",
+                                    (self.index,)).fetchall()
+        return {os.path.basename(path)[:-4]: funding_splits for path, funding_splits in rows}
+
+    def failed(self, file_path: str) -> None:
+        with self.lock:
+            self.db.execute("UPDATE files SET status = 'failed', updated = ? WHERE idx = ? AND path = ?",
+                            (f"{dt.datetime.now():%Y-%m-%d %H:%M:%S}", self.index, file_path))
+            self.db.commit()
+
+    def remove(self, file_paths: list) -> None:
+        with self.lock:
+            self.db.executemany('DELETE FROM files WHERE idx = ? AND path = ?', [(self.index, file_path) for file_path in file_paths])
+            self.db.commit()
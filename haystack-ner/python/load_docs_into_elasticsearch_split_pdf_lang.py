@@ -4,8 +4,14 @@ import functools
 import os
 import pycld2 as cld2
 import json
+import regex
 import yaml
 import sys
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from haystack.preprocessor.cleaning import clean_wiki_text
 from haystack.preprocessor.utils import convert_files_to_dicts, fetch_archive_from_http, PDFToTextConverter, TextConverter
 from haystack.reader.farm import FARMReader
@@ -15,6 +21,11 @@ from haystack.utils import print_answers
 from haystack.preprocessor.preprocessor import PreProcessor
 
 from haystack.document_store.elasticsearch import ElasticsearchDocumentStore
+from ingest_manifest import IngestManifest
+from retrieval_cache import RetrievalCache
+from split_store import SplitStore
+from funding_cues import funding_sections
+import metrics
 
 
 def extract_metadata_from_json(json_obj: dict, doc_meta: dict) -> dict:
@@ -42,137 +53,358 @@ def extract_metadata_from_json(json_obj: dict, doc_meta: dict) -> dict:
     return doc_meta
 
 
-def read_docs_from_PDFs(doc_dir_pdf: str, doc_dir_json: str) -> list:
-    """Prepare ingest of text content from PDFs stored in doc_dir_pdf
-       by using Haystack PDFToTextConverter.
+def cld2_sample(text: str, sample_size: int = 16384) -> str:
+    """Build the input for cld2 from a bounded sample of the text (start and middle of the document).
+       Characters cld2 rejects as invalid UTF-8 (control characters, surrogates, non-characters) are replaced by blanks.
 
     Args:
-        doc_dir_pdf (str): The directory containing the PDFs to ingest
-        doc_dir_json (str): The directory containing the item metadata from DSpace
+        text (str): The converted text of a document
+        sample_size (int, optional): The maximum number of characters to sample. Defaults to 16384.
 
     Returns:
-        list: The converted documents
-    """    
-    
-    preprocessor_pdf = PreProcessor(
+        str: The sample to detect the language from
+    """
+
+    if len(text) > sample_size:
+        half = sample_size // 2
+        middle = len(text) // 2
+        text = text[:half] + ' ' + text[middle:middle+half]
+    return regex.sub(cld2_invalid_chars, ' ', text)
+
+
+def detect_language(text: str) -> tuple:
+    """Detect the language of the text with cld2. Defaults to 'en' if detection fails.
+
+    Args:
+        text (str): The converted text of a document
+
+    Returns:
+        tuple: The ISO 639-1 language code and a message describing the detection result
+    """
+
+    try:
+        sReliable, textBytesFound, details = cld2.detect(cld2_sample(text))
+        try:
+            return details[0][1], f" - {details[0]}"
+        except KeyError:
+            # if detect failed - default to en
+            return 'en', " - language detection failed - set 'en'"
+    except cld2.error as e:
+        # if encoding error - default to en
+        return 'en', " - language detection failed error - set 'en'"
+
+
+def create_converter(file_type: str):
+    """Create the Haystack converter for PDF ('pdf') or plain text files ('txt')."""
+
+    if file_type == 'pdf':
+        return PDFToTextConverter(remove_numeric_tables=True) # , valid_languages=["en", "de"])
+    return TextConverter(remove_numeric_tables=True) # , valid_languages=["en", "de"])
+
+
+def create_preprocessor(file_type: str, splitting: dict = None) -> PreProcessor:
+    """Create the Haystack PreProcessor for PDF ('pdf') or plain text files ('txt')."""
+
+    if splitting is None:
+        splitting = default_splitting
+    return PreProcessor(
         clean_empty_lines=True,
         clean_whitespace=True,
-        clean_header_footer=True,
+        clean_header_footer=(file_type == 'pdf'),
         split_by="word",
-        split_length=100,
+        split_length=splitting['split_length'],
+        split_overlap=splitting['split_overlap'],
         split_respect_sentence_boundary=True
     )
 
-    converter = PDFToTextConverter(remove_numeric_tables=True) # , valid_languages=["en", "de"])
 
-    all_docs = []
-    count = 0
-    pdf_files = os.listdir(doc_dir_pdf)
-    for pdf_file in pdf_files:
-        try:
-            if pdf_file.lower().endswith(".pdf"):
-                lang = 'en'
-                sprint(f"{count:4} Convert doc: {pdf_file}" )
-                doc = converter.convert(file_path= doc_dir_pdf + '/' + pdf_file, meta={"name": pdf_file[:-4], "lang" : ""}, encoding="UTF-8")
-                # cld2 chokes on some utf-8 encondings need to use Latin1
-                doc_lang_detection = converter.convert(file_path= doc_dir_pdf + '/' + pdf_file, meta={"name": pdf_file[:-4], "lang" : ""}, encoding="Latin1")
-                try:
-                    sReliable, textBytesFound, details = cld2.detect(doc_lang_detection['text'])
+def init_worker(file_type: str, splitting: dict = None) -> None:
+    """Build the converter and preprocessor once per (worker) process.
+
+    Args:
+        file_type (str): 'pdf' or 'txt'
+        splitting (dict, optional): the splitting settings (see default_splitting). Defaults to None (default_splitting).
+    """
+
+    worker['converter'] = create_converter(file_type)
+    worker['preprocessor'] = create_preprocessor(file_type, splitting)
+    worker['splitting'] = splitting if splitting is not None else default_splitting
+
+
+def convert_file(file_path: str) -> tuple:
+    """Convert a file, detect its language and split it with the converter and preprocessor of this process.
+
+    Args:
+        file_path (str): The PDF or text file to convert
+
+    Returns:
+        tuple: The language detection message, the splits of the document and the seconds per stage
+    """
+
+    timings = {}
+    start = time.perf_counter()
+    doc = worker['converter'].convert(file_path=file_path, meta={"name": os.path.basename(file_path)[:-4], "lang" : ""}, encoding="UTF-8")
+    timings['convert'] = time.perf_counter() - start
+    start = time.perf_counter()
+    lang, lang_info = detect_language(doc['text'])
+    timings['lang_detect'] = time.perf_counter() - start
+    #try:
+    #    json_fn = doc_dir_json + '/' + os.path.basename(file_path)[:-4] + '.json'
+    #    sprint(f" - {json_fn}")
+    #    with open(json_fn, "r", encoding="utf-8") as fp:
+    #        my_json_obj = json.load(fp)
+    #    doc['meta'] = extract_metadata_from_json(my_json_obj, doc['meta'])
+    #except Exception as e:
+    #    sprint(" - Exception", e)
+    doc['meta']['lang'] = lang
+    start = time.perf_counter()
+    splitting = worker['splitting']
+    # detected before the cleaning, which removes the page breaks
+    sections = funding_sections(doc['text'], splitting['funding_split_length']) if splitting['funding_sections'] else []
+    doc_parts = worker['preprocessor'].process(doc)
+    if splitting['funding_sections']:
+        for doc_part in doc_parts:
+            doc_part['meta']['section'] = 'body'
+        # the acknowledgement and funding statements as dedicated splits after the splits of the text
+        for section in sections:
+            doc_parts.append({'text': section, 'meta': dict(doc['meta'], section='funding', _split_id=len(doc_parts))})
+    timings['split'] = time.perf_counter() - start
+    return f"{lang_info} - {lang}", doc_parts, timings
+
+
+def convert_files(file_paths: list, file_type: str, workers: int = 1, max_pending: int = None, splitting: dict = None):
+    """Convert and split the files, with a pool of worker processes if workers > 1.
+       At most max_pending files are handed to the pool at once, so results
+       are not piling up in memory if the consumer falls behind.
+
+    Args:
+        file_paths (list): The files to convert
+        file_type (str): 'pdf' or 'txt'
+        workers (int, optional): The number of worker processes. Defaults to 1.
+        max_pending (int, optional): The maximum number of files in the pool. Defaults to 2 * workers.
+        splitting (dict, optional): The splitting settings (see default_splitting). Defaults to None (default_splitting).
+
+    Yields:
+        tuple: file path, language detection message, splits of a document and seconds per stage, in order of completion.
+               If the conversion failed the exception is returned instead of the message, splits and seconds are None.
+    """
+
+    if workers <= 1:
+        init_worker(file_type, splitting)
+        for file_path in file_paths:
+            try:
+                lang_info, doc_parts, timings = convert_file(file_path)
+                yield file_path, lang_info, doc_parts, timings
+            except Exception as e:
+                yield file_path, e, None, None
+    else:
+        if max_pending is None:
+            max_pending = 2 * workers
+        file_paths = iter(file_paths)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(file_type, splitting)) as executor:
+            pending = {executor.submit(convert_file, file_path): file_path for file_path in itertools.islice(file_paths, max_pending)}
+            while len(pending) > 0:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = pending.pop(future)
+                    # refill the pool before handing out the result, so the workers stay busy
+                    for next_file_path in itertools.islice(file_paths, 1):
+                        pending[executor.submit(convert_file, next_file_path)] = next_file_path
                     try:
-                        lang = details[0][1]
-                        sprint(f" - {details[0]}")
-                    except KeyError:
-                        # if detect failed - default to en
-                        sprint(" - language detection failed - set 'en'")
-                        lang = 'en'
-                except cld2.error as e:
-                    # if encoding error - default to en
-                    sprint(" - language detection failed error - set 'en'")
-                    lang = 'en'
-                #try:
-                #    json_fn = doc_dir_json + '/' + pdf_file[:-4] + '.json'
-                #    sprint(f" - {json_fn}")
-                #    with open(json_fn, "r", encoding="utf-8") as fp:
-                #        my_json_obj = json.load(fp)
-                #    doc['meta'] = extract_metadata_from_json(my_json_obj, doc['meta'])
-                #except Exception as e:
-                #    sprint(" - Exception", e)
-                doc['meta']['lang'] = lang
-                print(f" - {lang}")
-                doc_parts = preprocessor_pdf.process(doc)
-                all_docs.extend(doc_parts)
-                count = count + 1
-        except Exception as e:
-            print("\nException ", e)
-
-    return all_docs
-
-
-def read_docs_from_TXTs(doc_dir_txt: str, doc_dir_json: str) -> list:
-    """Prepare ingest of plain text files stored in doc_dir_txt
-       by using Haystack TextConverter.
+                        lang_info, doc_parts, timings = future.result()
+                        yield file_path, lang_info, doc_parts, timings
+                    except Exception as e:
+                        yield file_path, e, None, None
+
+
+class IngestProgress:
+    """Counts the converted documents, splits and bytes and the splits written to elasticsearch."""
+
+    def __init__(self, report_every: int = 100):
+        self.report_every = report_every
+        self.start = time.time()
+        self.docs = 0
+        self.splits = 0
+        self.bytes = 0
+        self.written = 0
+
+    def add_doc(self, file_bytes: int, splits: int) -> None:
+        self.docs = self.docs + 1
+        self.splits = self.splits + splits
+        self.bytes = self.bytes + file_bytes
+        if self.docs % self.report_every == 0:
+            self.report()
+
+    def add_written(self, splits: int) -> None:
+        self.written = self.written + splits
+
+    def report(self) -> None:
+        elapsed = max(time.time() - self.start, 1e-6)
+        mbytes = self.bytes / (1024 * 1024)
+        print(f"progress: {self.docs} docs ({self.docs / elapsed:.2f} docs/s), "
+              f"{self.splits} splits ({self.splits / elapsed:.1f} splits/s), "
+              f"{mbytes:.1f} MB ({mbytes / elapsed:.2f} MB/s), "
+              f"{self.written} splits written, {elapsed:.0f} s")
+
+
+def list_source_files(doc_dir: str, file_type: str) -> list:
+    """List the PDF ('pdf') or plain text files ('txt') in doc_dir.
 
     Args:
-        doc_dir_txt (str): The directory containing the plain text files to ingest
-        doc_dir_json (str): The directory containing the item metadata from DSpace
+        doc_dir (str): The directory containing the files to ingest
+        file_type (str): 'pdf' or 'txt'
 
     Returns:
-        list: The converted documents
-    """    
-    
-    preprocessor_txt = PreProcessor(
-        clean_empty_lines=True,
-        clean_whitespace=True,
-        clean_header_footer=False,
-        split_by="word",
-        split_length=100,
-        split_respect_sentence_boundary=True
-    )
+        list: The paths of the files
+    """
 
-    converter = TextConverter(remove_numeric_tables=True) # , valid_languages=["en", "de"])
+    return sorted(doc_dir + '/' + filename for filename in os.listdir(doc_dir) if filename.lower().endswith(f".{file_type}"))
+
+
+def read_docs(file_paths: list, file_type: str, workers: int = 1, progress: IngestProgress = None,
+                manifest: IngestManifest = None, splitting: dict = None):
+    """Prepare ingest of the files: PDFs by using Haystack PDFToTextConverter,
+       plain text files by using Haystack TextConverter.
+
+    Args:
+        file_paths (list): The files to convert
+        file_type (str): 'pdf' or 'txt'
+        workers (int, optional): The number of worker processes. Defaults to 1.
+        progress (IngestProgress, optional): Progress counters to update. Defaults to None.
+        manifest (IngestManifest, optional): Manifest to mark failed files in. Defaults to None.
+        splitting (dict, optional): The splitting settings (see default_splitting). Defaults to None (default_splitting).
+
+    Yields:
+        tuple: The file path and the splits of a converted document
+    """
 
-    all_docs = []
     count = 0
-    txt_files = os.listdir(doc_dir_txt)
-    for txt_file in txt_files:
-        try:
-            if txt_file.lower().endswith(".txt"):
-                lang = "en"
-                sprint(f"{count:4} Convert doc: {txt_file}" )
-                doc = converter.convert(file_path= doc_dir_txt + '/' + txt_file, meta={"name": txt_file[:-4], "lang" : ""}, encoding="UTF-8")
+    for file_path, lang_info, doc_parts, timings in convert_files(file_paths, file_type, workers, splitting=splitting):
+        if doc_parts is None:
+            print(f"\nException {os.path.basename(file_path)}: ", lang_info)
+            metrics.count('failed')
+            if manifest is not None:
+                manifest.failed(file_path)
+        else:
+            print(f"{count:4} Convert doc: {os.path.basename(file_path)}{lang_info}")
+            # the stages ran in a worker process, record them here
+            for stage, seconds in timings.items():
+                metrics.observe(stage, seconds, os.path.basename(file_path))
+            metrics.count('documents')
+            metrics.count('splits', len(doc_parts))
+            if progress is not None:
+                progress.add_doc(os.path.getsize(file_path), len(doc_parts))
+            yield file_path, doc_parts
+            count = count + 1
+
+
+def write_docs_to_elasticsearch(document_store: ElasticsearchDocumentStore, docs, batch_size: int = 1000,
+                                queue_depth: int = 4, progress: IngestProgress = None, manifest: IngestManifest = None,
+                                split_store: SplitStore = None) -> int:
+    """Write the splits of the documents to the document store in bulk batches of at least batch_size splits.
+       A document is never spread over two batches, it is marked 'done' in the manifest after its batch is written.
+       The batches are written by a separate thread, so indexing overlaps with the conversion.
+       If queue_depth batches are waiting for the writer, reading the documents blocks until
+       the writer caught up (backpressure), so memory stays bounded.
+
+    Args:
+        document_store (ElasticsearchDocumentStore): The document store to write to
+        docs (iterable): The file paths and splits of the documents to write
+        batch_size (int, optional): The number of splits per bulk request. Defaults to 1000.
+        queue_depth (int, optional): The maximum number of batches waiting to be written. Defaults to 4.
+        progress (IngestProgress, optional): Progress counters to update. Defaults to None.
+        manifest (IngestManifest, optional): Manifest to mark written files in. Defaults to None.
+        split_store (SplitStore, optional): Local store the splits are also written to. Defaults to None.
+
+    Returns:
+        int: The number of splits written
+    """
+
+    batches = queue.Queue(maxsize=queue_depth)
+    written = []
+    errors = []
+
+    def writer():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if len(errors) == 0:
+                splits, files = batch
                 try:
-                    sReliable, textBytesFound, details = cld2.detect(doc['text'])
-                    try:
-                        lang = details[0][1]
-                        sprint(f" - {details[0]}")
-                    except KeyError:
-                        # if detect failed - default to en
-                        sprint(" - language detection failed - set 'en'")
-                        lang = 'en'
-                except cld2.error as e:
-                    # if encoding error - default to en
-                    sprint(" - language detection failed error - set 'en'")
-                    lang = 'en'
-                #try:
-                #    json_fn = doc_dir_json + '/' + txt_file[:-4] + '.json'
-                #    sprint(f" - {json_fn}")
-                #    with open(json_fn, "r", encoding="utf-8") as fp:
-                #        my_json_obj = json.load(fp)
-                #    doc['meta'] = extract_metadata_from_json(my_json_obj, doc['meta'])
-                #except Exception as e:
-                #    sprint(" - Exception", e)
-                doc['meta']['lang'] = lang
-                print(f" - {lang}")
-                doc_parts = preprocessor_txt.process(doc)
-                all_docs.extend(doc_parts)
-                count = count + 1
-        except Exception as e:
-            print("\nException ", e)
-
-    return all_docs
+                    with metrics.timer('es_write'):
+                        document_store.write_documents(splits)
+                    metrics.count('splits_written', len(splits))
+                    if split_store is not None:
+                        # the splits of the batch are in the order of the files
+                        store_docs = []
+                        start = 0
+                        for file_path, no_of_splits, _, _ in files:
+                            store_docs.append((os.path.basename(file_path)[:-4], splits[start:start+no_of_splits]))
+                            start += no_of_splits
+                        with metrics.timer('split_store_write'):
+                            split_store.write(document_store.index, store_docs)
+                    written.append(len(splits))
+                    if progress is not None:
+                        progress.add_written(len(splits))
+                    if manifest is not None:
+                        manifest.done(files)
+                except Exception as e:
+                    errors.append(e)
+
+    writer_thread = threading.Thread(target=writer, name='es-writer', daemon=True)
+    writer_thread.start()
+    try:
+        splits = []
+        files = []
+        for file_path, doc_parts in docs:
+            if len(errors) > 0:
+                break
+            splits.extend(doc_parts)
+            lang = doc_parts[0]['meta']['lang'] if len(doc_parts) > 0 else ''
+            # only the splits of documents ingested with funding sections have a section
+            sections = [doc_part['meta'].get('section') for doc_part in doc_parts]
+            funding_splits = sections.count('funding') if any(section is not None for section in sections) else -1
+            files.append((file_path, len(doc_parts), lang, funding_splits))
+            if len(splits) >= batch_size:
+                batches.put((splits, files))
+                splits = []
+                files = []
+        if len(files) > 0 and len(errors) == 0:
+            batches.put((splits, files))
+    finally:
+        batches.put(None)
+        writer_thread.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    return sum(written)
+
+
+def delete_docs_from_elasticsearch(document_store: ElasticsearchDocumentStore, file_paths: list, chunk_size: int = 500) -> None:
+    """Delete the splits of the files from the document store.
+
+    Args:
+        document_store (ElasticsearchDocumentStore): The document store to delete from
+        file_paths (list): The files whose splits are deleted
+        chunk_size (int, optional): The number of files per delete request. Defaults to 500.
+    """
+
+    names = [os.path.basename(file_path)[:-4] for file_path in file_paths]
+    for start in range(0, len(names), chunk_size):
+        document_store.delete_all_documents(filters={'name': names[start:start+chunk_size]})
 
 
 sprint = functools.partial(print, end="")
+# split length and overlap in words, dedicated splits (meta section 'funding') of the acknowledgement
+# and funding statements with at most funding_split_length words
+default_splitting = {'split_length': 100, 'split_overlap': 0, 'funding_sections': False, 'funding_split_length': 200}
+
+# converter and preprocessor of the current process, see init_worker
+worker = {}
+# C0/C1 control characters (except tab and newlines), surrogates and non-characters make cld2 fail
+cld2_invalid_chars = regex.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f\p{Cs}\p{Noncharacter_Code_Point}]")
 
 def main():
 
@@ -193,6 +425,22 @@ def main():
                         help='do post processing for DensePassageRetriever.',
                         dest='d',
                         action="store_true")
+    parser.add_argument('-w', '--workers',
+                        help='number of worker processes converting and splitting the documents (default 1).',
+                        metavar='N',
+                        dest='w', type=int, default=1)
+    parser.add_argument('-f', '--full',
+                        help='ingest all files again, not only new or changed files.',
+                        dest='f',
+                        action="store_true")
+    parser.add_argument('-b', '--batch-size',
+                        help='number of splits written to elasticsearch per bulk request (default 1000).',
+                        metavar='N',
+                        dest='b', type=int, default=1000)
+    parser.add_argument('-q', '--queue-depth',
+                        help='max. number of batches waiting to be written before the conversion pauses (default 4).',
+                        metavar='N',
+                        dest='q', type=int, default=4)
     parser.add_argument('-?', help='print this help message', dest='h', action="store_true")
     args = parser.parse_args()
  
@@ -212,6 +460,7 @@ def main():
 
     es = config['elastic']
     use_gpu = config['use_gpu']
+    metrics.setup('load_docs_into_elasticsearch', config)
 
     if args.d:
         document_store = ElasticsearchDocumentStore(host=es['host'], port=es['port'], username=es['username'], password=es['password'], index=es['dprindex'])
@@ -228,16 +477,48 @@ def main():
     # Path of the directory where the DSpace json files with the metadata of the source PDF/TXT files are stored in
     doc_dir_json = config['doc_dir_json']
 
-    all_docs = []
+    # Path of the sqlite file the manifest of ingested files is stored in
+    ingest_manifest = config['ingest_manifest']
+
+    # Path of the sqlite file extract_top_hits.py caches retrieved passages in
+    retrieval_cache = config['retrieval_cache']
+
+    # Path of the directory the splits are stored in for the offline mode of extract_top_hits.py
+    split_store = SplitStore(config['split_store']) if config['split_store'] else None
 
     if args.p:
-        all_docs = read_docs_from_PDFs(doc_dir_pdf=doc_dir_pdf, doc_dir_json=doc_dir_json)
+        file_type, doc_dir = 'pdf', doc_dir_pdf
     elif args.t:
-        all_docs = read_docs_from_TXTs(doc_dir_txt=doc_dir_txt, doc_dir_json=doc_dir_json)
-
-    if len(all_docs) > 0:
-        print(f"write all {len(all_docs)} docs to elasticsearch")
-        document_store.write_documents(all_docs)
+        file_type, doc_dir = 'txt', doc_dir_txt
+
+    file_paths = list_source_files(doc_dir, file_type)
+    index = es['dprindex'] if args.d else es['index']
+    manifest = IngestManifest(ingest_manifest, index)
+    file_paths, to_replace, removed = manifest.plan(file_paths, doc_dir, full=args.f)
+    print(f"{len(file_paths)} new or changed files, {len(to_replace)} of them already (partly) in the index, {len(removed)} removed files")
+    if len(to_replace) + len(removed) > 0:
+        print(f"delete splits of {len(to_replace) + len(removed)} changed or removed files from elasticsearch")
+        delete_docs_from_elasticsearch(document_store, to_replace + removed)
+        manifest.remove(removed)
+        if split_store is not None:
+            split_store.remove(index, [os.path.basename(file_path)[:-4] for file_path in to_replace + removed])
+    manifest.start(file_paths)
+    if retrieval_cache and len(file_paths) + len(removed) > 0:
+        # cached passages of new, changed or removed documents are stale
+        RetrievalCache(retrieval_cache).invalidate(index, [os.path.basename(file_path)[:-4] for file_path in file_paths + removed])
+
+    progress = IngestProgress()
+    docs = read_docs(file_paths, file_type, workers=args.w, progress=progress, manifest=manifest, splitting=config['splitting'])
+
+    print(f"write docs to elasticsearch in batches of {args.b} splits")
+    written = write_docs_to_elasticsearch(document_store, docs, batch_size=args.b, queue_depth=args.q,
+                                            progress=progress, manifest=manifest, split_store=split_store)
+    progress.report()
+    if split_store is not None and split_store.garbage() * 2 > os.path.getsize(split_store.data_filename):
+        print(f"compact split store, freed {split_store.compact()} bytes")
+
+    if written > 0:
+        print(f"wrote {written} splits to elasticsearch")
         if args.d:
             print('init DensePsssageRetriever')
             retriever = DensePassageRetriever(document_store=document_store,
@@ -250,7 +531,10 @@ def main():
                                         embed_title=True,
                                         use_fast_tokenizers=True)
             print('update elasticsearch with DPR')
-            document_store.update_embeddings(retriever)
+            with metrics.timer('dpr_embeddings'):
+                document_store.update_embeddings(retriever, update_existing_embeddings=args.f)
+
+    metrics.finish()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -10,6 +10,7 @@ import regex
 import yaml
 import sys
 import rapidfuzz as fuzz
+import metrics
 
 
 def load_testset_answers_from_csv_file(filename: str) -> dict:
@@ -64,8 +65,10 @@ def extract_questions(keys: list, known_questions = None) -> list:
 
 
 def check_similarity_of_answers(given_answer: str, expected_answer: str) -> bool:
-    fuzz_conf = fuzz.fuzz.partial_ratio(fuzz.utils.default_process(given_answer), fuzz.utils.default_process(expected_answer))
-    logging.debug(f"\nfuzz.fuzz.partial_ratio('{fuzz.utils.default_process(given_answer)}', '{fuzz.utils.default_process(expected_answer)}') -> {fuzz_conf}")
+    given_processed = fuzz.utils.default_process(given_answer)
+    expected_processed = fuzz.utils.default_process(expected_answer)
+    fuzz_conf = fuzz.fuzz.partial_ratio(given_processed, expected_processed)
+    logging.debug("fuzz.fuzz.partial_ratio(%r, %r) -> %s", given_processed, expected_processed, fuzz_conf)
     if  fuzz_conf >= 90.0:
         return True
     else:
@@ -84,6 +87,10 @@ def not_yet_included(test_for: str, in_values: list) -> bool:
 
 
 def extract_doi_from_funder(funder_with_doi: str) -> str:
+    """Parse the crossref id from a found_funder_id column ('funder name; crossref id; similarity'),
+       only needed for csv files written before the found_funder_doi column was added
+    """
+
     fpos2 = funder_with_doi.rfind(';')
     if fpos2 > 0:
         fpos1 = funder_with_doi.rfind(';',0,fpos2)
@@ -140,7 +147,9 @@ def merge_answers(merge_into: dict, merge: dict, min_score: float, multiply_with
                     elif answers[f'{question}?_1_check'] == 'false positive':
                         merge_into[item]['false_positive'] = merge_into[item]['false_positive'] + 1
                     if len(answers[f'{question}?_1_found_funder_id']) > 0 :
-                        doi = extract_doi_from_funder(answers[f'{question}?_1_found_funder_id'])
+                        doi = answers.get(f'{question}?_1_found_funder_doi')
+                        if doi is None:
+                            doi = extract_doi_from_funder(answers[f'{question}?_1_found_funder_id'])
                         #if answers[f'{question}?_1_found_funder_id'] not in merge_into[item]['found_funder_ids']:
                         if doi not in merge_into[item]['funder_dois']:
                             merge_into[item]['funder_dois'].append(doi)
@@ -153,7 +162,7 @@ def merge_answers(merge_into: dict, merge: dict, min_score: float, multiply_with
 
 
 common_rowheaders = ['Handle', 'Funder Identifier lt. CrossRef', 'Funder-Info lt. CrossRef', 'Funder-Phrase lt. PDF', 'keine Funder-Angabe im PDF', 'model']
-header_per_question = ['?_1_score_ge_12', '?_1_score_x_probability_ge_5', '?_1_answer', '?_1_score', '?_1_probability', '?_1_check', '?_1_found_funder_id']
+header_per_question = ['?_1_score_ge_12', '?_1_score_x_probability_ge_5', '?_1_answer', '?_1_score', '?_1_probability', '?_1_check', '?_1_found_funder_id', '?_1_found_funder_doi']
 detect_question = '?_1_'
 csv_rows = ['Handle', 'Funder Identifier lt. CrossRef', 'Funder-Info lt. CrossRef', 'Funder-Phrase lt. PDF', 'keine Funder-Angabe im PDF', 'model',
             'answers', 'found_funder_ids', 'funder_dois', 'min_score', 'max_score', 'distinct_matches', 'match', 'false_positive', 'no_funder', 'funder_ids']
@@ -173,6 +182,7 @@ def main():
         config = yaml.safe_load(cfgin)
 
     logging.getLogger().setLevel(config['logging_level'])
+    metrics.setup('merge_answers', config)
 
     # Path of the directory where the excel tab csv-files with the valid answers are stored
     out_dir_csv = config['doc_dir_csv']
@@ -243,11 +253,17 @@ def main():
     print('Merging results from the following files:', args.csvfilenames)
     for csvfilename in args.csvfilenames:
         print("load file: " + out_dir_csv + '/' + csvfilename)
-        answers = load_testset_answers_from_csv_file(out_dir_csv + '/' + csvfilename)
-        merged_answers = merge_answers(merged_answers, answers, min_score, multiply_with_probability, min_prob_score)
+        with metrics.timer('load_csv', csvfilename):
+            answers = load_testset_answers_from_csv_file(out_dir_csv + '/' + csvfilename)
+        with metrics.timer('merge', csvfilename):
+            merged_answers = merge_answers(merged_answers, answers, min_score, multiply_with_probability, min_prob_score)
+        metrics.count('rows', len(answers))
     
-    write_excel_tab_csv_file(filename=f"{outfilename}",
-                                fieldnames=csv_rows, records=merged_answers.values())
+    with metrics.timer('write_csv'):
+        write_excel_tab_csv_file(filename=f"{outfilename}",
+                                    fieldnames=csv_rows, records=merged_answers.values())
+    metrics.count('items', len(merged_answers))
+    metrics.finish()
 
 
 if __name__ == "__main__":
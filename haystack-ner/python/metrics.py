@@ -0,0 +1,217 @@
+#!/bin/env python
+import contextlib
+import datetime as dt
+import json
+import os
+import threading
+import time
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, write_to_textfile
+
+
+# latency buckets in seconds, from a single split to a whole model pass
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0, float('inf'))
+
+
+class Metrics:
+    """Timers, counters and latency histograms of the stages of a script.
+
+    The values are kept in a prometheus registry, they can be written to a textfile
+    for the node exporter textfile collector. Every timed document can also be
+    appended as json line to an event log.
+    """
+
+    def __init__(self, script: str, instance: str = '', textfile_dir: str = '', jsonl_file: str = ''):
+        self.script = script
+        self.instance = instance
+        self.textfile_dir = textfile_dir
+        self.jsonl_file = jsonl_file
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.registry = CollectorRegistry()
+        self.stage_seconds = Histogram('funder_ner_stage_seconds', 'Duration of a pipeline stage (per document or batch)',
+                                        ['script', 'instance', 'stage'], registry=self.registry, buckets=BUCKETS)
+        self.items = Counter('funder_ner_items', 'Items processed by a pipeline script',
+                                ['script', 'instance', 'name'], registry=self.registry)
+        self.last_run = Gauge('funder_ner_last_run_timestamp_seconds', 'End of the last run of a pipeline script',
+                                ['script', 'instance'], registry=self.registry)
+        self.jsonl = open(jsonl_file, 'a', encoding='utf-8') if jsonl_file else None
+
+    def observe(self, stage: str, seconds: float, document: str = None) -> None:
+        """Record the duration of a stage, for a document if given"""
+
+        self.stage_seconds.labels(self.script, self.instance, stage).observe(seconds)
+        if self.jsonl is not None and document is not None:
+            event = {'time': f"{dt.datetime.now():%Y-%m-%d %H:%M:%S.%f}", 'script': self.script, 'instance': self.instance,
+                        'stage': stage, 'document': document, 'seconds': seconds}
+            with self.lock:
+                self.jsonl.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, document: str = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, document)
+
+    def count(self, name: str, value: float = 1) -> None:
+        self.items.labels(self.script, self.instance, name).inc(value)
+
+    def stages(self) -> dict:
+        """Returns count, total, mean, median and 95th percentile (upper bucket bounds) and max. bucket of every stage"""
+
+        stages = {}
+        for metric in self.registry.collect():
+            if metric.name != 'funder_ner_stage_seconds':
+                continue
+            buckets = {}
+            for sample in metric.samples:
+                stage = stages.setdefault(sample.labels['stage'], {'count': 0, 'seconds': 0.0})
+                if sample.name.endswith('_count'):
+                    stage['count'] = int(sample.value)
+                elif sample.name.endswith('_sum'):
+                    stage['seconds'] = sample.value
+                elif sample.name.endswith('_bucket'):
+                    buckets.setdefault(sample.labels['stage'], []).append((float(sample.labels['le']), sample.value))
+            for name, stage in stages.items():
+                stage['mean'] = stage['seconds'] / stage['count'] if stage['count'] > 0 else 0.0
+                for quantile, key in [(0.5, 'p50'), (0.95, 'p95'), (1.0, 'max')]:
+                    stage[key] = next((le for le, cumulative in sorted(buckets.get(name, []))
+                                        if cumulative >= quantile * stage['count']), 0.0)
+
+        return stages
+
+    def counters(self) -> dict:
+        counters = {}
+        for metric in self.registry.collect():
+            if metric.name == 'funder_ner_items':
+                for sample in metric.samples:
+                    if sample.name.endswith('_total'):
+                        counters[sample.labels['name']] = sample.value
+        return counters
+
+    def summary(self) -> None:
+        """Print the stages and counters of the run"""
+
+        elapsed = time.time() - self.started
+        print(f"\n{self.script}{' ' + self.instance if self.instance else ''}: {elapsed:.1f}s")
+        print(f"{'stage':20} {'count':>8} {'total s':>10} {'mean s':>9} {'p50 s <=':>9} {'p95 s <=':>9} {'share':>6}")
+        for name, stage in sorted(self.stages().items(), key=lambda item: -item[1]['seconds']):
+            share = stage['seconds'] / elapsed if elapsed > 0 else 0.0
+            print(f"{name:20} {stage['count']:8} {stage['seconds']:10.2f} {stage['mean']:9.4f} "
+                  f"{stage['p50']:9.3f} {stage['p95']:9.3f} {share:6.1%}")
+        for name, value in sorted(self.counters().items()):
+            print(f"{name:20} {value:8.0f} ({value / elapsed if elapsed > 0 else 0.0:.1f}/s)")
+
+    def export(self) -> None:
+        """Write the prometheus textfile and the summary json line (if configured)"""
+
+        self.last_run.labels(self.script, self.instance).set_to_current_time()
+        if self.textfile_dir:
+            os.makedirs(self.textfile_dir, exist_ok=True)
+            name = f"{self.script}_{self.instance}" if self.instance else self.script
+            # write_to_textfile writes a temporary file and renames it
+            write_to_textfile(os.path.join(self.textfile_dir, f"{name}.prom"), self.registry)
+        if self.jsonl is not None:
+            run = {'time': f"{dt.datetime.now():%Y-%m-%d %H:%M:%S.%f}", 'script': self.script, 'instance': self.instance,
+                    'seconds': time.time() - self.started, 'stages': self.stages(), 'counters': self.counters()}
+            with self.lock:
+                self.jsonl.write(json.dumps(run, ensure_ascii=False) + '\n')
+                self.jsonl.flush()
+
+    def merge(self, recorder: 'Recorder') -> None:
+        """Add the stage durations and counts recorded by a Recorder (e.g. in a worker process)"""
+
+        for stage, seconds, document in recorder.observations:
+            self.observe(stage, seconds, document)
+        for name, value in recorder.counts.items():
+            self.count(name, value)
+
+    def finish(self) -> None:
+        """Print the summary and export the metrics at the end of a run"""
+
+        self.summary()
+        self.export()
+
+
+class Recorder:
+    """Stage durations and counts recorded in a worker process. Observations of a forked worker
+    are lost with its copy of the metrics, so the recorder is returned with the result of the
+    worker and merged into the metrics of the parent (see recording and merge).
+    """
+
+    def __init__(self):
+        self.observations = []
+        self.counts = {}
+
+    def observe(self, stage: str, seconds: float, document: str = None) -> None:
+        self.observations.append((stage, seconds, document))
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, document: str = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, document)
+
+    def count(self, name: str, value: float = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + value
+
+
+# metrics of the running script, replaced by setup
+current = Metrics('')
+
+
+def setup(script: str, config: dict, instance: str = '') -> Metrics:
+    """Create the metrics of the running script.
+
+    Args:
+        script (str): the name of the script (e.g. extract_top_hits)
+        config (dict): the configuration (config.yaml) with metrics_textfile_dir and metrics_jsonl_file
+        instance (str, optional): distinguishes processes of a script running in parallel (e.g. the model). Defaults to ''.
+
+    Returns:
+        Metrics: the metrics
+    """
+
+    global current
+    current = Metrics(script, instance, config['metrics_textfile_dir'], config['metrics_jsonl_file'])
+    return current
+
+
+@contextlib.contextmanager
+def recording():
+    """Record the stages and counts of a block in a Recorder instead of the metrics of the script.
+
+    Yields:
+        Recorder: the recorder, to be merged with merge
+    """
+
+    global current
+    previous = current
+    current = Recorder()
+    try:
+        yield current
+    finally:
+        current = previous
+
+
+def merge(recorder: Recorder) -> None:
+    current.merge(recorder)
+
+
+def timer(stage: str, document: str = None):
+    return current.timer(stage, document)
+
+
+def observe(stage: str, seconds: float, document: str = None) -> None:
+    current.observe(stage, seconds, document)
+
+
+def count(name: str, value: float = 1) -> None:
+    current.count(name, value)
+
+
+def finish() -> None:
+    current.finish()
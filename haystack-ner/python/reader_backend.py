@@ -0,0 +1,114 @@
+#!/bin/env python
+import os
+import shutil
+from pathlib import Path
+import torch
+from haystack.reader.farm import FARMReader
+from transformers import AutoConfig
+
+
+# pytorch: fp32 (default), pytorch-int8: linear layers dynamically quantized to int8 when the model is loaded,
+# onnx / onnx-int8: model exported once to ONNX (quantized to int8) and run with onnxruntime
+READER_BACKENDS = ['pytorch', 'pytorch-int8', 'onnx', 'onnx-int8']
+
+# model types FARMReader.convert_to_onnx (FARM 0.7) can export, e.g. not electra or albert
+ONNX_MODEL_TYPES = ['bert', 'roberta', 'xlm-roberta']
+
+# backend used for a model the onnx backends can't export
+ONNX_FALLBACK_BACKEND = 'pytorch-int8'
+
+
+def model_backend(model: str, backend: str) -> str:
+    """The backend a model is run with: the onnx backends fall back to ONNX_FALLBACK_BACKEND
+       for models whose architecture can't be exported to ONNX
+
+    Args:
+        model (str): name or path of the model
+        backend (str): one of READER_BACKENDS
+
+    Returns:
+        str: the backend
+    """
+
+    if backend.startswith('onnx'):
+        model_type = AutoConfig.from_pretrained(model).model_type
+        if model_type not in ONNX_MODEL_TYPES:
+            print(f'Reader backend {backend} does not support {model_type} model {model}, use {ONNX_FALLBACK_BACKEND}')
+            return ONNX_FALLBACK_BACKEND
+    return backend
+
+
+def onnx_model_path(models_cache: str, model: str, quantize: bool) -> str:
+    """The directory the ONNX export of a model is cached in
+
+    Args:
+        models_cache (str): the models cache directory
+        model (str): name or path of the model (e.g. deepset/roberta-base-squad2)
+        quantize (bool): int8 quantized export
+
+    Returns:
+        str: the directory of the export
+    """
+
+    name = model.strip('/').replace('/', '--')
+    return os.path.join(models_cache, 'onnx', f"{name}-int8" if quantize else name)
+
+
+def export_onnx_model(model: str, export_path: str, quantize: bool) -> None:
+    """Export a model to ONNX, unless the export exists already.
+       The export is written to a temporary directory first, so an existing export directory is always complete.
+
+    Args:
+        model (str): name or path of the model
+        export_path (str): the directory of the export
+        quantize (bool): quantize the exported model to int8
+    """
+
+    if os.path.isdir(export_path):
+        return
+
+    print(f'Export model {model} to ONNX: {export_path}')
+    tmp_path = f"{export_path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(os.path.dirname(export_path), exist_ok=True)
+    FARMReader.convert_to_onnx(model_name=model, output_path=Path(tmp_path), quantize=quantize)
+    os.replace(tmp_path, export_path)
+
+
+def load_reader(model: str, backend: str = 'pytorch', use_gpu: bool = False, models_cache: str = None, **reader_args) -> FARMReader:
+    """Load a FARMReader for a model with the given backend (see model_backend for models the onnx backends can't export).
+       The readers of all backends return answers in the same structure.
+
+    Args:
+        model (str): name or path of the model
+        backend (str, optional): one of READER_BACKENDS. Defaults to 'pytorch'.
+        use_gpu (bool, optional): use the gpu (only the pytorch backend). Defaults to False.
+        models_cache (str, optional): directory of the ONNX exports. Defaults to None.
+        **reader_args: further arguments of FARMReader (e.g. no_ans_boost, return_no_answer)
+
+    Returns:
+        FARMReader: the reader
+    """
+
+    if backend not in READER_BACKENDS:
+        raise ValueError(f"unknown reader backend '{backend}', expected one of {READER_BACKENDS}")
+    backend = model_backend(model, backend)
+
+    if backend == 'pytorch':
+        return FARMReader(model_name_or_path=model, use_gpu=use_gpu, **reader_args)
+
+    # the int8 kernels and onnxruntime are used for CPU inference
+    if use_gpu:
+        print(f'Reader backend {backend} runs on the CPU')
+
+    if backend == 'pytorch-int8':
+        reader = FARMReader(model_name_or_path=model, use_gpu=False, **reader_args)
+        torch.quantization.quantize_dynamic(reader.inferencer.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return reader
+
+    if models_cache is None:
+        raise ValueError(f"reader backend {backend} needs a models cache directory")
+    quantize = backend == 'onnx-int8'
+    export_path = onnx_model_path(models_cache, model, quantize)
+    export_onnx_model(model, export_path, quantize)
+    return FARMReader(model_name_or_path=export_path, use_gpu=False, **reader_args)
@@ -0,0 +1,151 @@
+#!/bin/env python
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+from haystack import Document
+
+
+def retrieval_key(retriever_kind: str, index: str, filters: dict, query: str, top_k: int) -> str:
+    """sha256 hex digest identifying a retrieval
+
+    Args:
+        retriever_kind (str): class name of the retriever
+        index (str): the elasticsearch index
+        filters (dict): the meta data filters
+        query (str): the query
+        top_k (int): the number of documents retrieved
+
+    Returns:
+        str: the hex digest
+    """
+
+    content = json.dumps([retriever_kind, index, filters, query, top_k], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class RetrievalCache:
+    """Persistent cache of retrieved documents (sqlite) with an in-memory LRU in front.
+
+    Entries are keyed by retriever, index, filters, query and top_k. The name of the
+    filtered document is stored with each entry, so the entries of re-ingested documents
+    can be invalidated (see invalidate).
+    """
+
+    def __init__(self, filename: str, lru_size: int = 10000):
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS retrievals '
+                        '(key TEXT PRIMARY KEY, idx TEXT, name TEXT, documents TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS retrievals_name ON retrievals (idx, name)')
+        self.db.commit()
+
+    def remember(self, key: str, documents: list) -> None:
+        self.lru[key] = documents
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def get(self, key: str) -> list:
+        """Returns the cached documents of the retrieval or None"""
+
+        documents = self.lru.get(key)
+        if documents is not None:
+            self.lru.move_to_end(key)
+            self.memory_hits += 1
+            return list(documents)
+
+        row = self.db.execute('SELECT documents FROM retrievals WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        documents = [Document.from_dict(doc) for doc in json.loads(row[0])]
+        self.remember(key, documents)
+        self.disk_hits += 1
+        return list(documents)
+
+    def put(self, key: str, index: str, name: str, documents: list) -> None:
+        self.remember(key, documents)
+        # embeddings are not needed by the reader
+        serialized = [{k: v for k, v in doc.to_dict().items() if k != 'embedding'} for doc in documents]
+        self.db.execute('INSERT OR REPLACE INTO retrievals VALUES (?, ?, ?, ?)',
+                        (key, index, name, json.dumps(serialized, ensure_ascii=False)))
+        self.db.commit()
+
+    def invalidate(self, index: str, names: list, chunk_size: int = 500) -> None:
+        """Drop the cached retrievals of the documents, e.g. after they have been (re-)ingested.
+
+        Args:
+            index (str): the elasticsearch index
+            names (list): names of the documents
+            chunk_size (int, optional): The number of names per delete statement. Defaults to 500.
+        """
+
+        for start in range(0, len(names), chunk_size):
+            chunk = names[start:start+chunk_size]
+            self.db.execute(f"DELETE FROM retrievals WHERE idx = ? AND name IN ({','.join('?' * len(chunk))})",
+                            [index] + chunk)
+        self.db.commit()
+        self.lru.clear()
+
+    def info(self) -> dict:
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'memory_entries': len(self.lru),
+            }
+
+
+class CachedRetriever:
+    """Wraps an ElasticsearchRetriever or DensePassageRetriever and answers repeated retrievals from a RetrievalCache.
+
+    The hits of a (document, question) don't depend on the reader model, so the models
+    extracting answers after the first one don't query elasticsearch (or encode the
+    question with DPR) again. It can be used as retriever node of an ExtractiveQAPipeline.
+    """
+
+    outgoing_edges = 1
+
+    def __init__(self, retriever, cache: RetrievalCache):
+        self.retriever = retriever
+        self.cache = cache
+        self.retriever_kind = type(retriever).__name__
+
+    def retrieve(self, query: str, filters: dict = None, top_k: int = None, index: str = None) -> list:
+        if top_k is None:
+            top_k = self.retriever.top_k
+        if index is None:
+            index = self.retriever.document_store.index
+
+        key = retrieval_key(self.retriever_kind, index, filters, query, top_k)
+        documents = self.cache.get(key)
+        if documents is None:
+            documents = self.retriever.retrieve(query=query, filters=filters, top_k=top_k, index=index)
+            names = (filters or {}).get('name', [])
+            self.cache.put(key, index, names[0] if len(names) == 1 else '', documents)
+
+        return documents
+
+    def run(self, pipeline_type: str, **kwargs):
+        if pipeline_type != "Query":
+            return self.retriever.run(pipeline_type, **kwargs)
+
+        query = kwargs.pop('query')
+        filters = kwargs.pop('filters', None)
+        top_k = kwargs.pop('top_k_retriever', None)
+        documents = self.retrieve(query=query, filters=filters, top_k=top_k, index=kwargs.get('index'))
+        output = {
+            "query": query,
+            "documents": documents,
+            **kwargs
+        }
+
+        return output, "output_1"
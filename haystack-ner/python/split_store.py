@@ -0,0 +1,208 @@
+#!/bin/env python
+import json
+import math
+import mmap
+import os
+import sqlite3
+import threading
+import regex
+from collections import Counter
+from haystack import Document
+
+
+# same token boundaries as the standard analyzer of elasticsearch (roughly)
+bm25_token = regex.compile(r"\w+")
+
+
+def bm25_tokens(text: str) -> list:
+    return bm25_token.findall(text.lower())
+
+
+class SplitStore:
+    """Local store of the splits written to elasticsearch at ingest.
+
+    The texts are appended to a data file which is read through a memory map,
+    offset, length and meta data of every split are kept in a sqlite table.
+    Replaced or removed splits leave garbage in the data file until compact is called.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.data_filename = os.path.join(directory, 'splits.dat')
+        self.lock = threading.Lock()
+        # splits are written by the elasticsearch writer thread of the ingest
+        self.db = sqlite3.connect(os.path.join(directory, 'splits.sqlite'), timeout=60, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS splits '
+                        '(idx TEXT, name TEXT, split INTEGER, start INTEGER, length INTEGER, meta TEXT, '
+                        'PRIMARY KEY (idx, name, split))')
+        self.db.commit()
+        open(self.data_filename, 'ab').close()
+        self.data = None
+
+    def data_map(self, end: int) -> mmap.mmap:
+        """Returns the memory map of the data file, remapped if it does not cover end yet."""
+
+        if self.data is None or len(self.data) < end:
+            if self.data is not None:
+                self.data.close()
+            with open(self.data_filename, 'rb') as fs:
+                self.data = mmap.mmap(fs.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.data
+
+    def write(self, index: str, docs: list) -> None:
+        """Store the splits of documents, replacing the splits stored before.
+
+        Args:
+            index (str): the elasticsearch index the splits are written to
+            docs (list): tuples of document name and its splits (dicts with text and meta)
+        """
+
+        rows = []
+        with self.lock:
+            with open(self.data_filename, 'ab') as fs:
+                start = fs.tell()
+                for name, doc_parts in docs:
+                    for split, doc_part in enumerate(doc_parts):
+                        text = doc_part['text'].encode('utf-8')
+                        fs.write(text)
+                        rows.append((index, name, split, start, len(text), json.dumps(doc_part['meta'], ensure_ascii=False)))
+                        start += len(text)
+            self.db.executemany('DELETE FROM splits WHERE idx = ? AND name = ?', [(index, name) for name, _ in docs])
+            self.db.executemany('INSERT INTO splits VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.db.commit()
+
+    def remove(self, index: str, names: list) -> None:
+        with self.lock:
+            self.db.executemany('DELETE FROM splits WHERE idx = ? AND name = ?', [(index, name) for name in names])
+            self.db.commit()
+
+    def splits(self, index: str, name: str) -> list:
+        """Returns the splits of a document as dicts with text and meta in split order"""
+
+        with self.lock:
+            rows = self.db.execute('SELECT start, length, meta FROM splits WHERE idx = ? AND name = ? ORDER BY split',
+                                    (index, name)).fetchall()
+            if len(rows) == 0:
+                return []
+            data = self.data_map(max(start + length for start, length, _ in rows))
+            return [{'text': data[start:start+length].decode('utf-8'), 'meta': json.loads(meta)} for start, length, meta in rows]
+
+    def compact(self) -> int:
+        """Rewrite the data file without the garbage of replaced or removed splits.
+
+        Returns:
+            int: the number of bytes freed
+        """
+
+        with self.lock:
+            rows = self.db.execute('SELECT rowid, start, length FROM splits ORDER BY start').fetchall()
+            old_size = os.path.getsize(self.data_filename)
+            data = self.data_map(old_size)
+            tmp_filename = f"{self.data_filename}.tmp"
+            updates = []
+            with open(tmp_filename, 'wb') as fs:
+                for rowid, start, length in rows:
+                    updates.append((fs.tell(), rowid))
+                    fs.write(data[start:start+length])
+                new_size = fs.tell()
+            self.data.close()
+            self.data = None
+            os.replace(tmp_filename, self.data_filename)
+            self.db.executemany('UPDATE splits SET start = ? WHERE rowid = ?', updates)
+            self.db.commit()
+
+        return old_size - new_size
+
+    def garbage(self) -> int:
+        """Returns the number of bytes in the data file not used by any split"""
+
+        with self.lock:
+            used = self.db.execute('SELECT COALESCE(SUM(length), 0) FROM splits').fetchone()[0]
+        return os.path.getsize(self.data_filename) - used
+
+
+class SplitStoreRetriever:
+    """Retriever ranking the splits of the filtered documents with BM25, computed in-process.
+
+    Replaces the ElasticsearchRetriever when the answers are extracted per document:
+    the splits of the document are read from the SplitStore, elasticsearch isn't needed.
+    The term statistics are those of the splits of the document, not of the whole index,
+    so the order of the splits can differ slightly from elasticsearch.
+    """
+
+    outgoing_edges = 1
+
+    def __init__(self, split_store: SplitStore, index: str, top_k: int = 10, k1: float = 1.2, b: float = 0.75):
+        self.split_store = split_store
+        self.index = index
+        self.top_k = top_k
+        self.k1 = k1
+        self.b = b
+        # the questions for a document are asked one after another, keep its splits
+        self.current = (None, None)
+
+    def document_splits(self, index: str, name: str) -> list:
+        """Returns the documents and term frequencies of the splits of a document"""
+
+        if self.current[0] != (index, name):
+            documents = []
+            term_frequencies = []
+            for split, doc_part in enumerate(self.split_store.splits(index, name)):
+                documents.append(Document(text=doc_part['text'], id=f"{name}-{split}", meta=doc_part['meta']))
+                term_frequencies.append(Counter(bm25_tokens(doc_part['text'])))
+            self.current = ((index, name), (documents, term_frequencies))
+        return self.current[1]
+
+    def rank(self, query: str, documents: list, term_frequencies: list) -> list:
+        """Returns (score, position) of the splits matching the query terms, best first"""
+
+        if len(documents) == 0:
+            return []
+        lengths = [sum(tf.values()) for tf in term_frequencies]
+        avg_length = max(sum(lengths) / len(lengths), 1.0)
+        scores = [0.0] * len(documents)
+        for term in set(bm25_tokens(query)):
+            matches = [pos for pos, tf in enumerate(term_frequencies) if term in tf]
+            if len(matches) == 0:
+                continue
+            idf = math.log(1.0 + (len(documents) - len(matches) + 0.5) / (len(matches) + 0.5))
+            for pos in matches:
+                tf = term_frequencies[pos][term]
+                scores[pos] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths[pos] / avg_length))
+
+        return sorted(((score, pos) for pos, score in enumerate(scores) if score > 0), key=lambda hit: -hit[0])
+
+    def retrieve(self, query: str, filters: dict = None, top_k: int = None, index: str = None) -> list:
+        if top_k is None:
+            top_k = self.top_k
+        if index is None:
+            index = self.index
+        if filters is None or 'name' not in filters:
+            raise ValueError("SplitStoreRetriever only retrieves from the documents named in filters['name']")
+
+        # the other filters select splits by meta value (e.g. section), like the terms filters of elasticsearch
+        meta_filters = {key: values for key, values in filters.items() if key != 'name'}
+        hits = []
+        for name in filters['name']:
+            documents, term_frequencies = self.document_splits(index, name)
+            hits.extend((score, documents[pos]) for score, pos in self.rank(query, documents, term_frequencies)
+                        if all(documents[pos].meta.get(key) in values for key, values in meta_filters.items()))
+        hits.sort(key=lambda hit: -hit[0])
+
+        results = []
+        for score, document in hits[:top_k]:
+            results.append(Document(text=document.text, id=document.id, score=score, meta=document.meta))
+        return results
+
+    def run(self, pipeline_type: str, **kwargs):
+        query = kwargs.pop('query')
+        filters = kwargs.pop('filters', None)
+        top_k = kwargs.pop('top_k_retriever', None)
+        documents = self.retrieve(query=query, filters=filters, top_k=top_k, index=kwargs.get('index'))
+        output = {
+            "query": query,
+            "documents": documents,
+            **kwargs
+        }
+
+        return output, "output_1"
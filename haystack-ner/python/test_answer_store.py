@@ -0,0 +1,43 @@
+#!/bin/env python
+import json
+import os
+from answer_store import AnswerStore, answer_file_names, answers_by_text, handle_from_text_name, read_answer_file
+
+
+def answers(name: str, count: int) -> list:
+    return [{'answer': f"{name} {rank}", 'score': 20.0 - rank, 'probability': 0.5, 'context': f"thanks to {name} {rank}", 'lang': 'en'}
+            for rank in range(1, count + 1)]
+
+
+# two texts of the same handle and a text without answers to the second question
+results_by_text = {
+    '10419-123456_2': {'Who funded the work?': answers('DFG', 2), 'Who provided funding?': answers('ERC', 1)},
+    '10419-123456_1': {'Who funded the work?': answers('BMBF', 2), 'Who provided funding?': answers('NSF', 2)},
+    '10419-654321': {'Who funded the work?': answers('Volkswagen Foundation', 1), 'Who provided funding?': []},
+    }
+
+
+def test_handle_from_text_name():
+    assert handle_from_text_name('10419-123456') == '10419/123456'
+    assert handle_from_text_name('10419-123456_1') == '10419/123456'
+    assert handle_from_text_name('10419-123456_1_roberta.json') == '10419/123456'
+
+
+def test_store_and_json_files_give_the_same_answer_sets(tmp_path):
+    answer_dir = tmp_path / 'answers'
+    os.makedirs(answer_dir)
+    answer_store = AnswerStore(str(tmp_path / 'store'), buffer_texts=2)
+    for model in ['roberta', 'xlm-roberta']:
+        for text_name, results in results_by_text.items():
+            with open(answer_dir / f"{text_name}_{model}.json", 'w', encoding='utf-8') as answer_file:
+                json.dump(results, answer_file)
+            answer_store.add(model, text_name, results)
+    answer_store.flush()
+
+    from_files = [read_answer_file(os.path.join(answer_dir, filename)) for filename in answer_file_names(answer_dir)]
+    from_store = answers_by_text(answer_store.scan(answered_only=False))
+
+    assert len(from_files) == 6
+    assert from_store == from_files
+    # one answer set per text, the answers of the texts of a handle aren't concatenated
+    assert [len(answer_set[2]['Who funded the work?']) for answer_set in from_store] == [2, 2, 2, 2, 1, 1]
@@ -0,0 +1,53 @@
+#!/bin/env python
+import rapidfuzz as fuzz
+from funder_index import FunderIndex
+from funder_registry import FunderRegistry
+
+
+# short labels first, so they are the first of the tied labels, followed by more labels sharing
+# tokens with the queries than fit on the shortlist
+names = ['Grant N', 'Society Max', 'Max Planck Society', 'German Research Foundation'] + \
+        [f"Grant No.{300000 + 7 * number}" for number in range(40)] + \
+        [f"Society Trust Max Fund {number}" for number in range(40)] + \
+        [f"Research Foundation {number}" for number in range(40)]
+rows = [row for number, name in enumerate(names)
+            for row in [{'ispref': 'True', 'id': f"doi:10.13039/5011{number:08d}", 'name': name},
+                        {'ispref': 'False', 'id': f"doi:10.13039/5011{number:08d}", 'name': f"{name} Award"}]]
+
+queries = ['the Grant No.300007 under grant 123', 'grant no 300007', 'society trust max united states', 'the society max',
+           'Max Planck Society (Germany)', 'German Research Foundation DFG', 'the research foundation under grant no 123'] + \
+          [f"the {name} under grant 123" for name in names] + names
+
+
+def best_match(results: list) -> tuple:
+    """The result find_funder_from_list takes for a match: the first with the highest similarity (if it is >= 90)"""
+
+    best = max(results, key=lambda result: result[1]) if len(results) > 0 else None
+    return best if best is not None and best[1] >= 90.0 else None
+
+
+def test_index_gives_the_match_of_the_full_scan():
+    registry = FunderRegistry.from_rows(rows)
+    funder_index = FunderIndex(registry, shortlist_size=8)
+    for label_kind in ['preflabel', 'altlabel']:
+        labels = list(registry.labels[label_kind])
+        normalized = [fuzz.utils.default_process(label) for label in labels]
+        for query in queries:
+            full_scan = fuzz.process.extract(fuzz.utils.default_process(query), normalized, scorer=fuzz.fuzz.WRatio,
+                                                processor=None, limit=5)
+            expected = best_match([(labels[labelno], similarity, int(registry.label_funder[label_kind][labelno]))
+                                    for _, similarity, labelno in full_scan])
+
+            assert best_match(funder_index.extract(query, label_kind)) == expected, query
+
+
+def test_updated_and_loaded_index_match_like_a_new_one(tmp_path):
+    funder_index = FunderIndex(FunderRegistry.from_rows(rows[20:]), shortlist_size=8)
+    registry = FunderRegistry.from_rows(rows)
+    funder_index.update(registry)
+    funder_index.dump(str(tmp_path / 'funders.idx'))
+    loaded = FunderIndex.load(str(tmp_path / 'funders.idx'), registry)
+    new_index = FunderIndex(registry, shortlist_size=8)
+    for label_kind in ['preflabel', 'altlabel']:
+        for query in queries:
+            assert loaded.extract(query, label_kind) == new_index.extract(query, label_kind), query
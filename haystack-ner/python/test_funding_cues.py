@@ -0,0 +1,41 @@
+#!/bin/env python
+from funding_cues import funding_sections
+
+
+def test_section_after_blank_line_with_wrapped_first_line():
+    text = ("Acknowledgements\n\nWe thank the Deutsche Forschungsgemeinschaft\nfor financial support under grant 123.\n\n"
+            "References\nA. B. (2001)")
+
+    assert funding_sections(text) == ["We thank the Deutsche Forschungsgemeinschaft for financial support under grant 123."]
+
+
+def test_numbered_section_after_blank_line():
+    text = ("4 Results\nSome results.\n\n5. Acknowledgements\n\nWe thank the Deutsche Forschungsgemeinschaft\n"
+            "for financial support under grant 123.\n\n6 References\nA. B. (2001)")
+
+    assert funding_sections(text) == ["We thank the Deutsche Forschungsgemeinschaft for financial support under grant 123."]
+
+
+def test_section_on_header_line():
+    text = "Funding: This work was funded by the Volkswagen Foundation.\n\nReferences\nA. B. (2001)"
+
+    assert funding_sections(text) == ["This work was funded by the Volkswagen Foundation."]
+
+
+def test_section_ends_at_max_words():
+    text = "Acknowledgements\n" + " ".join(["thanks"] * 300)
+
+    assert len(funding_sections(text, max_words=50)[0].split()) == 50
+
+
+def test_title_page_footnote_with_funding_cue():
+    text = ("Grants and Growth\nJohn Doe*\n\n* We thank the German Research Foundation (DFG)\nfor financial support.\n"
+            "\n1 University of Somewhere\f1 Introduction\nSome text.")
+
+    assert funding_sections(text) == ["* We thank the German Research Foundation (DFG) for financial support."]
+
+
+def test_footnotes_without_cue_and_after_title_page_are_ignored():
+    text = "Grants and Growth\nJohn Doe*\n\n* University of Somewhere\f* We thank the DFG for financial support."
+
+    assert funding_sections(text) == []